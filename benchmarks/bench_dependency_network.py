@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcore.
+#
+# pyomcore is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcore is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcore. If not, see <https://www.gnu.org/licenses/>.
+
+# How check_dependency_chain scales with the shape of the trade graph.
+# For each network size, builds a network of local repos (see
+# synthetic.py) in which users trade along the edges of a topology:
+#
+#   chain:   user i trades with user i+1
+#   star:    user0 trades with everybody
+#   clique:  everybody trades with everybody
+#   random:  every user trades with --degree random other users
+#   hub:     star, plus an extra connection from user0 to every user
+#
+# Every edge is traded on --trades times. Then it runs
+# check_dependency_chain from user0, and reports the time, the peak
+# memory, the counters, and how many blocks were verified per chain.
+# Networks are kept in workdir, so the next run with the same parameters
+# only runs the check.
+
+import argparse
+import random
+import shutil
+import time
+import tracemalloc
+from pyomcore.utils import *
+from pyomcore.check_dependency_chain import check_dependency_chain
+from pyomcore.add_extra_connection import add_extra_connection
+from pyomcore import tracing
+from synthetic import create_user, load_user, trade
+
+topologies = ['chain', 'star', 'clique', 'random', 'hub']
+
+
+def topology_edges(topology, n, degree, seed):
+    """The pairs of users that trade."""
+    if topology == 'chain':
+        return list(map(lambda i: (i, i + 1), range(0, n - 1)))
+    if topology in ['star', 'hub']:
+        return list(map(lambda i: (0, i), range(1, n)))
+    if topology == 'clique':
+        return [(i, j) for i in range(0, n) for j in range(i + 1, n)]
+    if topology == 'random':
+        rng = random.Random(seed)
+        edges = set()
+        for i in range(0, n):
+            others = list(filter(lambda j: j != i, range(0, n)))
+            for j in rng.sample(others, min(degree, len(others))):
+                edges.add((min(i, j), max(i, j)))
+        return sorted(edges)
+    raise Exception('unknown topology: ' + topology)
+
+
+def build_network(netdir, keycache, topology, n, trades, degree, seed):
+    netdir.mkdir(parents=True)
+    users = list(map(lambda i: create_user(netdir, keycache, i), range(0, n)))
+    edges = topology_edges(topology, n, degree, seed)
+    for _ in range(0, trades):
+        for i, j in edges:
+            trade([users[i], users[j]], 1, {})
+    if topology == 'hub':
+        hub = users[0]
+        for user in users[1:]:
+            add_extra_connection(hub.gpg_ctx(), hub.rootdir, user.rootdir,
+                                 most_recent_block_idx(user.rootdir))
+    return len(edges)
+
+
+def load_network(workdir, keycache, topology, n, trades, degree, seed):
+    """Build the network, unless it was built before with the same
+    parameters. Returns the users and the number of edges.
+    """
+    params = json.dumps({'topology': topology, 'users': n, 'trades': trades,
+                         'degree': degree, 'seed': seed}, sort_keys=True)
+    netdir = workdir.joinpath(f'{topology}-{n}')
+    params_path = netdir.with_name(netdir.name + '.json')
+    if params_path.exists() and params_path.read_text() == params:
+        numedges = json.loads(params_path.with_suffix(
+            '.edges').read_text())
+    else:
+        shutil.rmtree(netdir, ignore_errors=True)
+        start = time.perf_counter()
+        numedges = build_network(
+            netdir, keycache, topology, n, trades, degree, seed)
+        print(f'  built {netdir.name} in {time.perf_counter() - start:.1f}s')
+        params_path.with_suffix('.edges').write_text(str(numedges))
+        params_path.write_text(params)
+    return list(map(lambda i: load_user(netdir, f'user{i}'), range(0, n))), numedges
+
+
+def run_check(users):
+    rootdirs = list(map(lambda user: user.rootdir, users))
+    with tracing.measure() as counters:
+        start = time.perf_counter()
+        verifiers = check_dependency_chain(rootdirs[0], rootdirs[1:])
+        elapsed = time.perf_counter() - start
+    # Measure memory in a second run, because tracemalloc is slow.
+    tracemalloc.start()
+    check_dependency_chain(rootdirs[0], rootdirs[1:])
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    verified = []
+    total = []
+    for rootdir in rootdirs:
+        fpr = load_block(rootdir, 0)['owner']['gpg']
+        verified.append(verifiers[fpr].nextidx if fpr in verifiers else 0)
+        total.append(most_recent_block_idx(rootdir) + 1)
+    return {
+        'seconds': elapsed,
+        'peak_bytes': peak,
+        'blocks_verified': sum(verified),
+        'blocks_total': sum(total),
+        'max_blocks_verified': max(verified),
+        'chains_reached': sum(map(lambda k: 1 if k > 0 else 0, verified)),
+        'counters': counters
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='check_dependency_chain scaling benchmark')
+    parser.add_argument('workdir', help='where to build the networks')
+    parser.add_argument('--keycache', help='where to cache gpg keys (default: workdir/keys)')
+    parser.add_argument('--topology', action='append', choices=topologies,
+                        help='topologies to run (default: all)')
+    parser.add_argument('--sizes', default='10,50,100,200',
+                        help='comma separated numbers of users (default: 10,50,100,200)')
+    parser.add_argument('--trades', type=int, default=1,
+                        help='number of trades on each edge (default: 1)')
+    parser.add_argument('--degree', type=int, default=3,
+                        help='trade partners per user in the random topology (default: 3)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='write the results to this JSON file')
+    args = parser.parse_args()
+    workdir = pathlib.Path(args.workdir).resolve()
+    keycache = pathlib.Path(args.keycache).resolve(
+    ) if args.keycache else workdir.joinpath('keys')
+    keycache.mkdir(parents=True, exist_ok=True)
+    sizes = list(map(int, args.sizes.split(',')))
+    results = []
+    for topology in (args.topology or topologies):
+        for n in sizes:
+            users, numedges = load_network(workdir, keycache, topology, n,
+                                           args.trades, args.degree, args.seed)
+            result = dict(topology=topology, users=n, edges=numedges,
+                          **run_check(users))
+            results.append(result)
+            print(f'{topology:7} users={n:<4} edges={numedges:<6} '
+                  f'{result["seconds"]:8.3f}s  peak {result["peak_bytes"] / (1 << 20):7.1f} MB  '
+                  f'verified {result["blocks_verified"]}/{result["blocks_total"]} blocks '
+                  f'(max {result["max_blocks_verified"]} per chain), '
+                  f'gpg_verify={result["counters"]["gpg_verify"]}')
+    if args.out:
+        pathlib.Path(args.out).write_text(json.dumps(results, indent=2) + '\n')
+
+
+if __name__ == "__main__":
+    main()
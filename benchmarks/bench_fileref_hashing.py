@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcore.
+#
+# pyomcore is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcore is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcore. If not, see <https://www.gnu.org/licenses/>.
+
+# Time and peak memory of checking the filerefs of large linked files:
+# one at a time with load_fileref (which reads each file into memory),
+# and with check_filerefs (chunked, in a thread pool).
+#
+# usage: bench_fileref_hashing.py path/to/tmpdir [number of files] [MB per file]
+
+import sys
+import time
+import tracemalloc
+from pyomcore.utils import *
+
+if len(sys.argv) < 2:
+    print('usage: bench_fileref_hashing.py path/to/tmpdir [number of files] [MB per file]',
+          file=sys.stderr)
+    sys.exit(1)
+tmpdir = pathlib.Path(sys.argv[1]).resolve()
+numfiles = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+size = int(sys.argv[3]) * (1 << 20) if len(sys.argv) > 3 else 64 << 20
+
+tmpdir.mkdir(parents=True, exist_ok=True)
+location_array = [tmpdir]
+filerefs = []
+for i in range(0, numfiles):
+    filename = pathlib.PurePath(f'linked{i}.bin')
+    path = tmpdir.joinpath(filename)
+    if not path.exists() or path.stat().st_size != size:
+        with open(path, 'wb') as f:
+            for _ in range(0, size, 1 << 20):
+                f.write(os.urandom(1 << 20))
+    filerefs.append(create_fileref(tmpdir, 0, filename))
+
+
+def measure(name, check):
+    tracemalloc.start()
+    start = time.perf_counter()
+    check()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{name}: {elapsed:.3f}s, peak {peak / (1 << 20):.1f} MB')
+
+
+def load_filerefs():
+    for fileref in filerefs:
+        load_fileref(location_array, fileref)
+
+
+measure('load_fileref', load_filerefs)
+measure('check_filerefs', lambda: check_filerefs(location_array, filerefs))
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcore.
+#
+# pyomcore is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcore is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcore. If not, see <https://www.gnu.org/licenses/>.
+
+
+# Verify throughput per signing key type. For each algorithm, builds a
+# blockchain of --blocks empty blocks, signed by a key of that type, and
+# measures:
+#
+#   sigs/s:   gpg verifications of one blockref's signature, on their own
+#   blocks/s: verify_chain of the whole blockchain
+#
+# "rotated" is an rsa4096 blockchain that switches to ed25519 halfway,
+# with rotate_key, the way an existing blockchain would be moved to a
+# faster key. Blockchains are kept in workdir, so the next run with the
+# same parameters only measures.
+
+import argparse
+import shutil
+import time
+from pyomcore.utils import *
+from pyomcore.verifier import verify_chain, is_signed_by
+from pyomcore.rotate_key import rotate_key
+from pyomcore import tracing
+from synthetic import create_user, load_user
+
+algorithms = ['rsa4096', 'rsa2048', 'ed25519', 'nistp256', 'rotated']
+
+
+def append_empty_blocks(user, n):
+    if n > 0:
+        user.append(list(map(lambda _: {'actions': []}, range(0, n))))
+
+
+def build_chain(chaindir, keycache, algorithm, numblocks):
+    if algorithm != 'rotated':
+        user = create_user(chaindir, keycache, 0, algorithm)
+        append_empty_blocks(user, numblocks - 1)
+        return
+    user = create_user(chaindir, keycache, 0, 'rsa4096')
+    half = numblocks // 2
+    append_empty_blocks(user, half - 1)
+    # ed25519 keys are quick to generate, so this one isn't cached.
+    new_fpr = user.gpg_ctx().create_key('rotated', algorithm='ed25519', sign=True,
+                                        certify=True, passphrase=None).fpr
+    rotate_key(user.gpg_ctx(), user.rootdir, new_fpr)
+    user.v = None
+    append_empty_blocks(user, numblocks - half - 1)
+
+
+def load_chain(workdir, keycache, algorithm, numblocks):
+    """Build the blockchain, unless it was built before with the same
+    parameters. Returns its user.
+    """
+    params = json.dumps({'algorithm': algorithm, 'blocks': numblocks})
+    chaindir = workdir.joinpath(algorithm)
+    params_path = chaindir.with_name(chaindir.name + '.json')
+    if not (params_path.exists() and params_path.read_text() == params):
+        shutil.rmtree(chaindir, ignore_errors=True)
+        start = time.perf_counter()
+        build_chain(chaindir, keycache, algorithm, numblocks)
+        print(f'  built {algorithm} in {time.perf_counter() - start:.1f}s')
+        params_path.write_text(params)
+    return load_user(chaindir, 'user0')
+
+
+def run(user, numsigs):
+    with tracing.measure() as counters:
+        start = time.perf_counter()
+        v = verify_chain(user.rootdir)
+        chain_seconds = time.perf_counter() - start
+    # The most recent block is signed by the current key.
+    idx = v.nextidx - 1
+    ref_content = read_file(user.rootdir.joinpath(
+        blockfilename(idx, block_ext_ref)))
+    sig_content = read_file(user.rootdir.joinpath(
+        blockfilename(idx, block_ext_sig)))
+    start = time.perf_counter()
+    for _ in range(0, numsigs):
+        if not is_signed_by(v.gpg_ctx, v.signer_fpr, ref_content, sig_content):
+            raise Exception('bad signature')
+    sig_seconds = time.perf_counter() - start
+    return {
+        'blocks': v.nextidx,
+        'chain_seconds': chain_seconds,
+        'blocks_per_second': v.nextidx / chain_seconds,
+        'sigs_per_second': numsigs / sig_seconds,
+        'sig_bytes': len(sig_content),
+        'counters': counters
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='verify throughput per signing key type')
+    parser.add_argument('workdir', help='where to build the blockchains')
+    parser.add_argument('--keycache', help='where to cache gpg keys (default: workdir/keys)')
+    parser.add_argument('--algorithm', action='append', choices=algorithms,
+                        help='key types to run (default: all)')
+    parser.add_argument('--blocks', type=int, default=200,
+                        help='number of blocks in each blockchain (default: 200)')
+    parser.add_argument('--sigs', type=int, default=100,
+                        help='number of signature verifications (default: 100)')
+    parser.add_argument('--out', help='write the results to this JSON file')
+    args = parser.parse_args()
+    if args.blocks < 2:
+        parser.error('--blocks must be at least 2')
+    workdir = pathlib.Path(args.workdir).resolve()
+    keycache = pathlib.Path(args.keycache).resolve(
+    ) if args.keycache else workdir.joinpath('keys')
+    keycache.mkdir(parents=True, exist_ok=True)
+    results = []
+    for algorithm in (args.algorithm or algorithms):
+        user = load_chain(workdir, keycache, algorithm, args.blocks)
+        result = dict(algorithm=algorithm, **run(user, args.sigs))
+        results.append(result)
+        print(f'{algorithm:8} {result["sigs_per_second"]:8.1f} sigs/s  '
+              f'{result["blocks_per_second"]:8.1f} blocks/s  '
+              f'({result["blocks"]} blocks in {result["chain_seconds"]:.3f}s, '
+              f'{result["sig_bytes"]} byte signatures)')
+    if args.out:
+        pathlib.Path(args.out).write_text(json.dumps(results, indent=2) + '\n')
+
+
+if __name__ == "__main__":
+    main()
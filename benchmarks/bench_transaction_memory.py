@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcore.
+#
+# pyomcore is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcore is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcore. If not, see <https://www.gnu.org/licenses/>.
+
+# Memory used per registered transaction, by the old TransactionStatus
+# (full transaction dict, hex keys, set of participants, dict of
+# blockrefs) and the current one. The transactions are synthetic: two
+# participants, confirmed, with one signature each. Nothing is read from
+# disk.
+#
+# usage: bench_transaction_memory.py [number of transactions]
+
+import gc
+import hashlib
+import sys
+import tracemalloc
+from pyomcore.utils import *
+from pyomcore.verifier import TransactionDict, TransactionState, TransactionStatus
+
+count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+fprs = [f'{i:040X}' for i in range(0, 16)]
+rootdir = pathlib.Path('/nonexistent')
+location_array = [rootdir]
+
+
+class OldTransactionStatus(object):
+    """TransactionStatus as it was before it was made compact."""
+
+    def __init__(self, transaction, block_idx):
+        self.transaction = transaction
+        self.block_idx = block_idx
+        self.pending_participants = set(
+            map(lambda p: p['gpg'], transaction['participants']))
+        self.signatures = {}
+        self.state = TransactionState.PENDING
+
+
+def synthetic(i):
+    """The register_transaction action and transaction for transaction i."""
+    timestamp = datetime(2022, 1, 1, tzinfo=timezone.utc) + \
+        timedelta(seconds=i)
+    transaction_path = transactions_dirname.joinpath(
+        timestamp_path(timestamp))
+    transaction = {
+        'contracts': [],
+        'numlocations': 1,
+        'pyom_version': pyom_version_number,
+        'pyom_transaction_magic': pyom_transaction_magic,
+        'timestamp': timestamp.isoformat(),
+        'expiry': (timestamp + timedelta(days=1)).isoformat(),
+        'participants': [{'gpg': fprs[i % 16]}, {'gpg': fprs[(i + 1) % 16]}]
+    }
+    fileref = create_fileref_from_content(0, transaction_path.joinpath(
+        'transaction.json'), json.dumps(transaction, indent=2).encode('utf-8'))
+    return fileref, transaction
+
+
+def blockref(fpr, idx, i):
+    return {
+        'pyom_version': pyom_version_number,
+        'pyom_blockref_magic': pyom_blockref_magic,
+        'gpg': fpr,
+        'idx': idx,
+        'SHA-512': hashlib.sha512(str(i).encode()).hexdigest()
+    }
+
+
+def build_old():
+    transactions = {}
+    for i in range(0, count):
+        fileref, transaction = synthetic(i)
+        # Parsed from JSON, like the verifier does, so nothing is shared.
+        transaction = json.loads(json.dumps(transaction))
+        status = OldTransactionStatus(transaction, i)
+        status.pending_participants.remove(fprs[i % 16])
+        status.pending_participants.remove(fprs[(i + 1) % 16])
+        status.signatures[fprs[(i + 1) % 16]] = json.loads(
+            json.dumps(blockref(fprs[(i + 1) % 16], i, i)))
+        status.state = TransactionState.CONFIRMED
+        transactions[json.loads(json.dumps(fileref))['SHA-512']] = status
+    return transactions
+
+
+def build_new():
+    transactions = TransactionDict()
+    for i in range(0, count):
+        fileref, transaction = synthetic(i)
+        fileref = json.loads(json.dumps(fileref))
+        participants = json.loads(json.dumps(transaction['participants']))
+        status = TransactionStatus(location_array, fileref, participants, i)
+        status.remove_pending_participant(fprs[i % 16])
+        status.remove_pending_participant(fprs[(i + 1) % 16])
+        status.add_signature(fprs[(i + 1) % 16], json.loads(
+            json.dumps(blockref(fprs[(i + 1) % 16], i, i))))
+        status.state = TransactionState.CONFIRMED
+        transactions[fileref['SHA-512']] = status
+    return transactions
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    transactions = build()
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del transactions
+    return size
+
+
+results = {}
+for name, build in [('before', build_old), ('after', build_new)]:
+    size = measure(build)
+    results[name] = size / count
+    print(f'{name}: {size / count:.0f} bytes per transaction ({count} transactions)')
+print(f'ratio: {results["before"] / results["after"]:.1f}x')
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcore.
+#
+# pyomcore is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcore is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcore. If not, see <https://www.gnu.org/licenses/>.
+
+# Benchmarks for the main paths: verify_chain, Verifier.append_block,
+# create_transaction, confirm_transactions and create_ban, on a synthetic
+# network (see synthetic.py). The network is built once and kept in
+# workdir; every benchmark runs on a fresh copy of it. The results are
+# written as JSON: the median, min and max time of each benchmark, and
+# the counters from pyomcore.tracing for one run.
+#
+# With --baseline, the results are compared with an earlier results
+# file. A benchmark has regressed if its median time is more than
+# --tolerance slower, or if any of its counters went up. The exit status
+# is 1 if anything regressed.
+
+import argparse
+import shutil
+import statistics
+import sys
+import time
+from pyomcore.utils import *
+from pyomcore.verifier import verify_chain
+from pyomcore.confirm_transactions import confirm_transactions
+from pyomcore.add_ban import create_ban
+from pyomcore import tracing
+from synthetic import Network, create_user, load_user, ignore_sockets
+
+
+def timed(fn, setup, repeat):
+    """Run setup() then fn(setup result) repeat times. Only fn is timed."""
+    times = []
+    counters = None
+    for _ in range(0, repeat):
+        arg = setup()
+        with tracing.measure() as used:
+            start = time.perf_counter()
+            fn(arg)
+            times.append(time.perf_counter() - start)
+        counters = used
+    return {
+        'repeat': repeat,
+        'median': statistics.median(times),
+        'min': min(times),
+        'max': max(times),
+        'counters': counters
+    }
+
+
+class Bench(object):
+    def __init__(self, workdir, network, keycache):
+        self.workdir = workdir
+        self.network = network
+        self.keycache = keycache
+        self.netdir = workdir.joinpath('network')
+        self.copies = 0
+        params_path = workdir.joinpath('network.json')
+        params = json.dumps(network.params(), sort_keys=True)
+        if not params_path.exists() or params_path.read_text() != params:
+            shutil.rmtree(self.netdir, ignore_errors=True)
+            network.build(self.netdir, keycache)
+            params_path.write_text(params)
+
+    def copy(self):
+        """A fresh copy of the network. Returns its directory."""
+        self.copies += 1
+        copydir = self.workdir.joinpath('scratch', str(self.copies))
+        shutil.rmtree(copydir, ignore_errors=True)
+        shutil.copytree(self.netdir, copydir, symlinks=True, ignore=ignore_sockets)
+        return copydir
+
+    def user(self, copydir, i):
+        return load_user(copydir, f'user{i}')
+
+    def verify_chain(self, repeat):
+        rootdir = self.user(self.copy(), 0).rootdir
+        return timed(lambda _: verify_chain(rootdir), lambda: None, repeat)
+
+    def append_block(self, repeat):
+        user = self.user(self.copy(), 0)
+        v = verify_chain(user.rootdir)
+        gpg_ctx = user.gpg_ctx()
+        return timed(lambda _: v.append_block(gpg_ctx, {'actions': []}), lambda: None, repeat)
+
+    def create_transaction(self, repeat):
+        copydir = self.copy()
+        participants = list(map(lambda i: {
+            'rootdir': self.user(copydir, i).rootdir,
+            'locations_init': [],
+            'protoblock_init': {}
+        }, range(0, self.network.participants)))
+        return timed(lambda _: create_transaction(participants, timedelta(days=1)), lambda: None, repeat)
+
+    def confirm_transactions(self, repeat):
+        copydir = self.copy()
+        users = [self.user(copydir, 0), self.user(copydir, 1)]
+
+        def setup():
+            participants = list(map(lambda user: {
+                'rootdir': user.rootdir,
+                'locations_init': [],
+                'protoblock_init': {}
+            }, users))
+            for user, protoblock in zip(users, create_transaction(participants, timedelta(days=1))):
+                user.append([protoblock])
+            return users[0]
+        return timed(lambda user: confirm_transactions(user.gpg_ctx(), user.rootdir, users[1].rootdir, False),
+                     setup, repeat)
+
+    def create_ban(self, repeat):
+        copydir = self.copy()
+        banner = self.user(copydir, 0)
+        victims = []
+
+        def setup():
+            # Every run needs a new PYOMer to ban.
+            n = self.network.numusers + self.network.bans + len(victims)
+            victim = create_user(copydir, self.keycache, n)
+            victims.append(victim)
+            forkrootdir = copydir.joinpath(victim.name + '_fork', 'pyom')
+            shutil.copytree(victim.rootdir, forkrootdir)
+            fork = load_user(copydir, victim.name + '_fork')
+            fork.gpg_dir = victim.gpg_dir
+            victim.append([{'actions': []}])
+            fork.append([{'actions': [{'type': 'link_file', 'file': create_fileref(
+                fork.rootdir, 0, block0_pubkey_filename)}]}])
+            return victim, fork
+        return timed(lambda forks: create_ban(banner.gpg_ctx(), banner.rootdir, forks[0].rootdir, forks[1].rootdir),
+                     setup, repeat)
+
+
+benchmarks = ['verify_chain', 'append_block', 'create_transaction',
+              'confirm_transactions', 'create_ban']
+
+
+def compare(results, baseline, tolerance):
+    """Returns a list of regressions."""
+    regressions = []
+    for name, result in results['benchmarks'].items():
+        if not name in baseline['benchmarks']:
+            continue
+        base = baseline['benchmarks'][name]
+        if result['median'] > base['median'] * (1 + tolerance):
+            regressions.append(
+                f'{name}: median {result["median"]:.4f}s, baseline {base["median"]:.4f}s')
+        for counter, value in result['counters'].items():
+            if value > base['counters'].get(counter, value):
+                regressions.append(
+                    f'{name}: {counter} {value}, baseline {base["counters"][counter]}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='pyomcore benchmarks')
+    parser.add_argument('workdir', help='where to build the network')
+    parser.add_argument('--keycache', help='where to cache gpg keys (default: workdir/keys)')
+    parser.add_argument('--out', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare with this results file')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed slowdown relative to the baseline (default: 0.25)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', action='append', choices=benchmarks,
+                        help='run only these benchmarks')
+    parser.add_argument('--users', type=int, default=4)
+    parser.add_argument('--blocks', type=int, default=100)
+    parser.add_argument('--transactions-per-block', type=int, default=2)
+    parser.add_argument('--participants', type=int, default=2)
+    parser.add_argument('--contracts', type=int, default=0)
+    parser.add_argument('--bans', type=int, default=1)
+    parser.add_argument('--extra-connections', type=int, default=1)
+    args = parser.parse_args()
+    workdir = pathlib.Path(args.workdir).resolve()
+    keycache = pathlib.Path(args.keycache).resolve(
+    ) if args.keycache else workdir.joinpath('keys')
+    network = Network(numusers=args.users, numblocks=args.blocks,
+                      transactions_per_block=args.transactions_per_block,
+                      participants=args.participants, contracts=args.contracts,
+                      bans=args.bans, extra_connections=args.extra_connections)
+    bench = Bench(workdir, network, keycache)
+    results = {'params': network.params(), 'benchmarks': {}}
+    for name in (args.only or benchmarks):
+        result = getattr(bench, name)(args.repeat)
+        results['benchmarks'][name] = result
+        print(f'{name}: median {result["median"]:.4f}s, min {result["min"]:.4f}s, max {result["max"]:.4f}s')
+    if args.out:
+        pathlib.Path(args.out).write_text(json.dumps(results, indent=2) + '\n')
+    if args.baseline:
+        baseline = json.loads(pathlib.Path(args.baseline).read_bytes())
+        if baseline['params'] != results['params']:
+            print('warning: the baseline was run with different parameters', file=sys.stderr)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print('regression: ' + regression)
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
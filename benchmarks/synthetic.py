@@ -0,0 +1,236 @@
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcore.
+#
+# pyomcore is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcore is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcore. If not, see <https://www.gnu.org/licenses/>.
+
+# Builds networks of synthetic blockchains for the benchmarks. The users
+# get throwaway keys, ed25519 unless another algorithm is asked for, which
+# are generated once and cached in keycache, because generating keys is
+# slow.
+
+import shutil
+import subprocess
+import uuid
+from pyomcore.utils import *
+from pyomcore.verifier import verify_chain
+from pyomcore.initialize_blockchain import ignore_local_state
+from pyomcore.add_smart_contract import add_smart_contract
+from pyomcore.add_extra_connection import add_extra_connection
+from pyomcore.add_ban import create_ban
+from pyomcore.confirm_transactions import find_confirm_actions
+
+
+# gpg-agent's sockets can't be copied.
+ignore_sockets = shutil.ignore_patterns('S.*')
+
+
+def cached_key(keycache, i, algorithm='ed25519'):
+    """A gnupg home directory with a secret key for user i."""
+    name = f'key{i}' if algorithm == 'ed25519' else f'key{i}-{algorithm}'
+    keydir = keycache.joinpath(name)
+    if not keydir.exists():
+        tmpdir = keycache.joinpath(name + '.tmp')
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        gpg_ctx = init_local_gpg(tmpdir)
+        gpg_ctx.create_key(f'synthetic{i}', algorithm=algorithm,
+                           sign=True, certify=True, passphrase=None)
+        tmpdir.rename(keydir)
+    return keydir
+
+
+class User(object):
+    def __init__(self, name, gpg_dir, rootdir):
+        self.name = name
+        self.gpg_dir = gpg_dir
+        self.rootdir = rootdir
+        self.v = None
+
+    def gpg_ctx(self):
+        return gpg.Context(home_dir=self.gpg_dir.as_posix())
+
+    def verifier(self):
+        """A Verifier that is kept up to date with append_blocks."""
+        if self.v is None:
+            self.v = verify_chain(self.rootdir)
+        return self.v
+
+    def append(self, protoblocks):
+        self.verifier().append_blocks(self.gpg_ctx(), protoblocks)
+
+
+def create_user(workdir, keycache, i, algorithm='ed25519'):
+    name = f'user{i}'
+    userdir = workdir.joinpath(name)
+    gpg_dir = userdir.joinpath('gnupg')
+    shutil.copytree(cached_key(keycache, i, algorithm),
+                    gpg_dir, ignore=ignore_sockets)
+    rootdir = userdir.joinpath('pyom')
+    rootdir.mkdir(parents=True)
+    subprocess.run(['git', '-C', rootdir.as_posix(), 'init', '--quiet'], check=True)
+    ignore_local_state(rootdir)
+    gpg_ctx = gpg.Context(home_dir=gpg_dir.as_posix())
+    fpr = export_block0_pubkey(gpg_ctx, rootdir)
+    create_block0(gpg_ctx, rootdir, fpr)
+    init_local_gpg(rootdir.joinpath(gnupg_dirname))
+    return User(name, gpg_dir, rootdir)
+
+
+def create_contract(workdir, author, n):
+    """A smart contract repo, with a tag signed by author."""
+    repodir = workdir.joinpath('contracts', f'contract{n}')
+    repodir.mkdir(parents=True)
+    env = dict(os.environ, GNUPGHOME=author.gpg_dir.as_posix())
+    fpr = load_block(author.rootdir, 0)['owner']['gpg']
+
+    def git(*args):
+        subprocess.run(['git', '-C', repodir.as_posix(), '-c', 'user.name=synthetic',
+                        '-c', 'user.email=synthetic@example.com', '-c', 'user.signingkey=' + fpr] +
+                       list(args), env=env, check=True, capture_output=True)
+    git('init', '--quiet')
+    repodir.joinpath(smartcontract_pubkey_filename).write_bytes(
+        author.rootdir.joinpath(block0_pubkey_filename).read_bytes())
+    repodir.joinpath(smartcontract_uuid_filename).write_text(
+        str(uuid.uuid4()) + '\n')
+    git('add', '.')
+    git('commit', '--quiet', '-m', 'synthetic contract')
+    git('tag', '-s', '-m', 'v1', 'v1')
+    return repodir, fpr
+
+
+def install_contract(user, repodir):
+    """Clone the contract into the user's repo and add it to their
+    blockchain. Returns its path in the user's repo.
+    """
+    path = smart_contracts_dirname.joinpath(repodir.name)
+    subprocess.run(['git', 'clone', '--quiet', repodir.as_posix(),
+                    user.rootdir.joinpath(path).as_posix()], check=True)
+    user.v = None
+    add_smart_contract(user.gpg_ctx(), user.rootdir, path)
+    return path
+
+
+def trade(users, transactions_per_block, contracts):
+    """All the users register transactions_per_block transactions in one
+    block each, then confirm them, one block per other user.
+    """
+    participants = []
+    for user in users:
+        participants.append({
+            'rootdir': user.rootdir,
+            'locations_init': list(map(lambda path: create_pathref(0, path), contracts)),
+            'protoblock_init': {}
+        })
+    transaction_init = {
+        'numlocations': len(contracts),
+        'contracts': list(map(lambda item: {
+            'path': create_pathref(item[0], pathlib.PurePath('.')),
+            'uuid_hash': {'SHA-512': sha512_hex(users[0].rootdir.joinpath(
+                item[1]).joinpath(smartcontract_uuid_filename).read_bytes())},
+            'authors': [{'gpg': contracts[item[1]]}]
+        }, enumerate(contracts)))
+    }
+    protoblocks = list(map(lambda user: {'actions': []}, users))
+    for _ in range(0, transactions_per_block):
+        for protoblock, new in zip(protoblocks, create_transaction(participants, timedelta(days=1), transaction_init)):
+            protoblock['actions'].extend(new['actions'])
+    for user, protoblock in zip(users, protoblocks):
+        user.append([protoblock])
+    for this_user in users:
+        for that_user in users:
+            if that_user is this_user:
+                continue
+            actions = find_confirm_actions(
+                this_user.verifier(), that_user.verifier(), False)
+            if len(actions) > 0:
+                this_user.append([{'actions': actions}])
+
+
+def fork_and_ban(workdir, banner, victim):
+    """Fork the victim's blockchain and make banner ban them."""
+    forkdir = workdir.joinpath(victim.name + '_fork')
+    shutil.copytree(victim.rootdir, forkdir.joinpath('pyom'))
+    fork = User(victim.name + '_fork', victim.gpg_dir, forkdir.joinpath('pyom'))
+    victim.append([{'actions': []}])
+    fork.append([{'actions': [{'type': 'link_file', 'file': create_fileref(
+        fork.rootdir, 0, block0_pubkey_filename)}]}])
+    banner.v = None
+    create_ban(banner.gpg_ctx(), banner.rootdir,
+               victim.rootdir, fork.rootdir)
+
+
+class Network(object):
+    """The parameters of a synthetic network. Call build() to create it."""
+
+    def __init__(self, numusers=2, numblocks=10, transactions_per_block=1,
+                 participants=2, contracts=0, bans=0, extra_connections=0):
+        self.numusers = numusers
+        self.numblocks = numblocks
+        self.transactions_per_block = transactions_per_block
+        self.participants = participants
+        self.contracts = contracts
+        self.bans = bans
+        self.extra_connections = extra_connections
+        if participants > numusers:
+            raise Exception('more participants than users')
+        if extra_connections >= numusers:
+            raise Exception('too many extra connections')
+
+    def params(self):
+        return dict(vars(self))
+
+    def build(self, workdir, keycache):
+        """Create the users in workdir. Users trade in groups of
+        self.participants, in rotation, until user0 has at least
+        self.numblocks blocks. Bans are of extra users who fork their
+        blockchains, and are banned by user0. Returns the users that
+        trade, then the banned users.
+        """
+        workdir.mkdir(parents=True, exist_ok=False)
+        keycache.mkdir(parents=True, exist_ok=True)
+        users = list(map(lambda i: create_user(workdir, keycache, i),
+                         range(0, self.numusers)))
+        contracts = {}
+        for n in range(0, self.contracts):
+            repodir, fpr = create_contract(
+                workdir, users[n % self.numusers], n)
+            for user in users:
+                path = install_contract(user, repodir)
+            contracts[path] = fpr
+        rotation = 0
+        while users[0].verifier().nextidx < self.numblocks:
+            if self.transactions_per_block == 0:
+                users[0].append([{'actions': []}])
+                continue
+            group = [users[0]] + list(map(lambda i: users[1 + (rotation + i) % (self.numusers - 1)],
+                                          range(0, self.participants - 1)))
+            rotation += 1
+            trade(group, self.transactions_per_block, contracts)
+        for i in range(1, 1 + self.extra_connections):
+            users[0].v = None
+            add_extra_connection(users[0].gpg_ctx(), users[0].rootdir, users[i].rootdir,
+                                 most_recent_block_idx(users[i].rootdir))
+        banned = []
+        for i in range(0, self.bans):
+            victim = create_user(workdir, keycache, self.numusers + i)
+            fork_and_ban(workdir, users[0], victim)
+            banned.append(victim)
+        for user in users + banned:
+            user.v = None
+        return users, banned
+
+
+def load_user(workdir, name):
+    """A user created by an earlier build()."""
+    userdir = workdir.joinpath(name)
+    return User(name, userdir.joinpath('gnupg'), userdir.joinpath('pyom'))
@@ -25,5 +25,8 @@ setup(
     package_dir={'': 'src'},
     packages=['pyomcore'],
     install_requires=[],
+    entry_points={
+        'console_scripts': ['pyom=pyomcore.cli:main'],
+    },
     license='GPLv3',
 )
@@ -19,9 +19,15 @@
 import sys
 from .utils import *
 from .verifier import Verifier, verify_chain
+from .group_commit import repo_lock
+from .rotate_key import import_key_rotation_actions
 
 
-def add_ban(gpg_ctx, v, fpr, idx, key_content, remotes, ref_content1, sig_content1, ref_content2, sig_content2):
+def add_ban(gpg_ctx, v, fpr, idx, key_content, remotes, ref_content1, sig_content1, ref_content2, sig_content2,
+            rotation_actions=()):
+    """rotation_actions are the import_key_rotation actions for fpr's key
+    rotations, which are needed if the blockrefs are signed by a new key.
+    """
     ban_dir1 = banned_dirname.joinpath(fpr).joinpath('fork1')
     ban_dir2 = banned_dirname.joinpath(fpr).joinpath('fork2')
     v.rootdir.joinpath(ban_dir1).mkdir(parents=True, exist_ok=True)
@@ -40,8 +46,17 @@ def add_ban(gpg_ctx, v, fpr, idx, key_content, remotes, ref_content1, sig_conten
     v.rootdir.joinpath(this_sigpath2).write_bytes(sig_content2)
     key_filename = banned_dirname.joinpath(fpr).joinpath(fpr + '.key')
     v.rootdir.joinpath(key_filename).write_bytes(key_content)
+    actions = list(rotation_actions)
+    if len(actions) > 0 and fpr not in v.known_gpg_keys:
+        # Rotations can only be imported for a known key.
+        actions.insert(0, {
+            'type': 'import_gpg_key',
+            'gpg': fpr,
+            'keyfile': create_fileref(v.rootdir, 0, key_filename),
+            'git_remote_urls': remotes
+        })
     protoblock = {
-        'actions': [
+        'actions': actions + [
             {
                 'type': 'ban',
                 'gpg': fpr,
@@ -61,39 +76,43 @@ def create_ban(gpg_ctx, rootdir, forkdir1, forkdir2):
     """Ban a PYOMer who has forked their blockchain. gpg_ctx should be ~/.gnupg
     Searches the 2 blockchains to find the first mismatch.
     """
-    v = verify_chain(rootdir)
-    v1 = verify_chain(forkdir1)
-    v2 = verify_chain(forkdir2)
-    if v1.fpr != v2.fpr:
-        raise Exception('forkdir1 and forkdir2 belong to different PYOMers')
-    fpr = v1.fpr
-    if v.is_banned(fpr):
-        raise Exception('PYOMer is already banned: ' + fpr)
-    numblocks1 = 1 + most_recent_block_idx(forkdir1)
-    numblocks2 = 1 + most_recent_block_idx(forkdir2)
-    for idx in range(0, min(numblocks1, numblocks2)):
-        ref_content1 = forkdir1.joinpath(
-            blockfilename(idx, block_ext_ref)).read_bytes()
-        blockref1 = json.loads(ref_content1)
-        ref_content2 = forkdir2.joinpath(
-            blockfilename(idx, block_ext_ref)).read_bytes()
-        blockref2 = json.loads(ref_content2)
-        if blockref1['SHA-512'] != blockref2['SHA-512']:
-            sig_content1 = forkdir1.joinpath(
-                blockfilename(idx, block_ext_sig)).read_bytes()
-            sig_content2 = forkdir2.joinpath(
-                blockfilename(idx, block_ext_sig)).read_bytes()
-            key_content = forkdir1.joinpath(
-                block0_pubkey_filename).read_bytes()
-            remotes = git_repo_remote_urls(forkdir1)
-            remotes.update(git_repo_remote_urls(forkdir2))
-            add_ban(gpg_ctx, v, fpr, idx, key_content, remotes,
-                    ref_content1, sig_content1, ref_content2, sig_content2)
-            return
-    raise Exception('no fork found')
+    with repo_lock(rootdir):
+        v = verify_chain(rootdir)
+        v1 = verify_chain(forkdir1)
+        v2 = verify_chain(forkdir2)
+        if v1.fpr != v2.fpr:
+            raise Exception('forkdir1 and forkdir2 belong to different PYOMers')
+        fpr = v1.fpr
+        if v.is_banned(fpr):
+            raise Exception('PYOMer is already banned: ' + fpr)
+        numblocks1 = 1 + most_recent_block_idx(forkdir1)
+        numblocks2 = 1 + most_recent_block_idx(forkdir2)
+        numblocks = min(numblocks1, numblocks2)
+        for (idx, ref_content1), (_, ref_content2) in zip(
+                iter_block_files(forkdir1, 0, numblocks, exts=(block_ext_ref,),
+                                 max_size=v1.limits.max_block_size),
+                iter_block_files(forkdir2, 0, numblocks, exts=(block_ext_ref,),
+                                 max_size=v2.limits.max_block_size)):
+            blockref1 = parse_json(ref_content1, v1.limits.max_json_depth)
+            blockref2 = parse_json(ref_content2, v2.limits.max_json_depth)
+            if blockref1['SHA-512'] != blockref2['SHA-512']:
+                sig_content1 = read_file(forkdir1.joinpath(
+                    blockfilename(idx, block_ext_sig)), v1.limits.max_block_size)
+                sig_content2 = read_file(forkdir2.joinpath(
+                    blockfilename(idx, block_ext_sig)), v2.limits.max_block_size)
+                key_content = read_file(forkdir1.joinpath(
+                    block0_pubkey_filename), v1.limits.max_fileref_size)
+                remotes = git_repo_remote_urls(forkdir1)
+                remotes.update(git_repo_remote_urls(forkdir2))
+                add_ban(gpg_ctx, v, fpr, idx, key_content, remotes,
+                        ref_content1, sig_content1, ref_content2, sig_content2,
+                        import_key_rotation_actions(v, v1))
+                return
+        raise Exception('no fork found')
 
 
 if __name__ == "__main__":
+    profile_from_argv()
     if len(sys.argv) != 3:
         print('usage: add_ban path/to/pyomfork1 path/to/pyomfork2', file=sys.stderr)
         sys.exit(1)
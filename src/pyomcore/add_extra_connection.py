@@ -19,35 +19,39 @@
 import sys
 from .utils import *
 from .verifier import Verifier, verify_chain
+from .group_commit import repo_lock
+from .rotate_key import import_key_rotation_actions
 
 
 def add_extra_connection(gpg_ctx, this_rootdir, that_rootdir, that_idx):
-    this_v = verify_chain(this_rootdir)
-    that_v = verify_chain(that_rootdir)
-    dirname = mk_unique_path(extra_connections_dirname.joinpath(that_v.fpr))
-    this_rootdir.joinpath(dirname).mkdir(parents=True, exist_ok=True)
-    this_refpath = dirname.joinpath(
-        blockfilename(that_idx, block_ext_ref).name)
-    this_sigpath = dirname.joinpath(
-        blockfilename(that_idx, block_ext_sig).name)
-    this_rootdir.joinpath(this_refpath).write_bytes(
-        that_rootdir.joinpath(blockfilename(that_idx, block_ext_ref)).read_bytes())
-    this_rootdir.joinpath(this_sigpath).write_bytes(
-        that_rootdir.joinpath(blockfilename(that_idx, block_ext_sig)).read_bytes())
-    protoblock = {
-        'actions': [
-            {
-                'type': 'add_extra_connection',
-                'gpg': that_v.fpr,
-                'block_ref': create_fileref(this_rootdir, 0, this_refpath),
-                'block_sig': create_fileref(this_rootdir, 0, this_sigpath),
-            }
-        ]
-    }
-    this_v.append_block(gpg_ctx, protoblock)
+    with repo_lock(this_rootdir):
+        this_v = verify_chain(this_rootdir)
+        that_v = verify_chain(that_rootdir)
+        dirname = mk_unique_path(extra_connections_dirname.joinpath(that_v.fpr))
+        this_rootdir.joinpath(dirname).mkdir(parents=True, exist_ok=True)
+        this_refpath = dirname.joinpath(
+            blockfilename(that_idx, block_ext_ref).name)
+        this_sigpath = dirname.joinpath(
+            blockfilename(that_idx, block_ext_sig).name)
+        this_rootdir.joinpath(this_refpath).write_bytes(
+            that_rootdir.joinpath(blockfilename(that_idx, block_ext_ref)).read_bytes())
+        this_rootdir.joinpath(this_sigpath).write_bytes(
+            that_rootdir.joinpath(blockfilename(that_idx, block_ext_sig)).read_bytes())
+        protoblock = {
+            'actions': import_key_rotation_actions(this_v, that_v) + [
+                {
+                    'type': 'add_extra_connection',
+                    'gpg': that_v.fpr,
+                    'block_ref': create_fileref(this_rootdir, 0, this_refpath),
+                    'block_sig': create_fileref(this_rootdir, 0, this_sigpath),
+                }
+            ]
+        }
+        this_v.append_block(gpg_ctx, protoblock)
 
 
 if __name__ == "__main__":
+    profile_from_argv()
     if len(sys.argv) != 3:
         print(
             'usage: add_extra_connection path/to/other/pyom <block number>', file=sys.stderr)
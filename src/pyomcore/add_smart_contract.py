@@ -19,6 +19,7 @@
 import sys
 from .utils import *
 from .verifier import Verifier, verify_chain
+from .group_commit import repo_lock
 
 
 def add_smart_contract(gpg_ctx, rootdir, submodule_path):
@@ -26,36 +27,38 @@ def add_smart_contract(gpg_ctx, rootdir, submodule_path):
     the smart contract developer and checks that the current commit has
     a signed tag.
     """
-    v = verify_chain(rootdir)
-    # The submodule should contain the public key of the smart contract's developer
-    # and a unique uuid for the smart contract.
-    keypath = submodule_path.joinpath(smartcontract_pubkey_filename)
-    uuidpath = submodule_path.joinpath(smartcontract_uuid_filename)
-    fpr = import_key(v.gpg_ctx, rootdir.joinpath(keypath).read_bytes())
-    repodir = rootdir.joinpath(submodule_path)
-    protoblock = {
-        'actions': [
-            {
-                'type': 'import_gpg_key',
-                'gpg': fpr,
-                'keyfile': create_fileref(rootdir, 0, keypath),
-                'git_remote_urls': git_repo_remote_urls(repodir)
-            },
-            {
-                'type': 'link_file',
-                'file': create_fileref(rootdir, 0, uuidpath)
-            },
-            {
-                'type': 'verify_signed_tag',
-                'gpg': fpr,
-                'git_repo': create_pathref(0, submodule_path)
-            }
-        ]
-    }
-    v.append_block(gpg_ctx, protoblock)
+    with repo_lock(rootdir):
+        v = verify_chain(rootdir)
+        # The submodule should contain the public key of the smart contract's developer
+        # and a unique uuid for the smart contract.
+        keypath = submodule_path.joinpath(smartcontract_pubkey_filename)
+        uuidpath = submodule_path.joinpath(smartcontract_uuid_filename)
+        fpr = import_key(v.gpg_ctx, rootdir.joinpath(keypath).read_bytes())
+        repodir = rootdir.joinpath(submodule_path)
+        protoblock = {
+            'actions': [
+                {
+                    'type': 'import_gpg_key',
+                    'gpg': fpr,
+                    'keyfile': create_fileref(rootdir, 0, keypath),
+                    'git_remote_urls': git_repo_remote_urls(repodir)
+                },
+                {
+                    'type': 'link_file',
+                    'file': create_fileref(rootdir, 0, uuidpath)
+                },
+                {
+                    'type': 'verify_signed_tag',
+                    'gpg': fpr,
+                    'git_repo': create_pathref(0, submodule_path)
+                }
+            ]
+        }
+        v.append_block(gpg_ctx, protoblock)
 
 
 if __name__ == "__main__":
+    profile_from_argv()
     if len(sys.argv) != 2:
         print('usage: add_smart_contract path/to/smart_contract', file=sys.stderr)
         sys.exit(1)
@@ -19,23 +19,26 @@
 import sys
 from .utils import *
 from .verifier import Verifier, verify_chain
+from .group_commit import repo_lock
 
 
 def annul_transaction(gpg_ctx, rootdir, transaction_hash, explanation):
-    v = verify_chain(rootdir)
-    protoblock = {
-        'actions': [
-            {
-                'type': 'annul_transaction',
-                'transaction': {'SHA-512': transaction_hash},
-                'explanation': explanation
-            }
-        ]
-    }
-    v.append_block(gpg_ctx, protoblock)
+    with repo_lock(rootdir):
+        v = verify_chain(rootdir)
+        protoblock = {
+            'actions': [
+                {
+                    'type': 'annul_transaction',
+                    'transaction': {'SHA-512': transaction_hash},
+                    'explanation': explanation
+                }
+            ]
+        }
+        v.append_block(gpg_ctx, protoblock)
 
 
 if __name__ == "__main__":
+    profile_from_argv()
     if len(sys.argv) != 3:
         print('usage: annul_transaction transaction_hash "why I did it"',
               file=sys.stderr)
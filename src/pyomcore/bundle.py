@@ -0,0 +1,508 @@
+#!/usr/bin/env python3
+
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcore.
+#
+# pyomcore is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcore is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcore. If not, see <https://www.gnu.org/licenses/>.
+
+import struct
+import sys
+from .utils import *
+from .verifier import Verifier, is_fileref, verify_chain
+
+# A bundle is a single file with a range of blocks from one blockchain,
+# and the files that their filerefs point to, so that blocks can be
+# copied between machines without cloning the whole git repo. Importing
+# a bundle writes byte-identical copies of the files.
+#
+# The format is streamable: it can be written to a pipe, and read from
+# one, because there's an index at the end rather than the start.
+#
+#   bundle_magic
+#   header length (uint32), header (JSON)
+#   records, each:
+#     path length (uint32), path (UTF-8, relative to the repo)
+#     data length (uint64), data, SHA-512 of the data (64 bytes)
+#   0 (uint32): end of the records
+#   index length (uint64), index (JSON)
+#   index offset (uint64), bundle_magic
+#
+# All the integers are big-endian. The records for each block come in
+# order: first the files that the block links to, then its .json, .ref.json
+# and .ref.json.sig. public.key is always the first record. Git repos,
+# like smart contracts, are not included, not even the files in them that
+# blocks link to: they must already be on the receiving side.
+#
+# Because of the order, receive_bundle can verify each block as soon as
+# it arrives, while the rest of the bundle is still on its way.
+
+bundle_magic = b'PYOMBNDL'
+path_len_format = struct.Struct('>I')
+data_len_format = struct.Struct('>Q')
+digest_size = 64
+
+
+# The directories that a bundle can write to, apart from public.key: the
+# blockchain, and the evidence that blocks link to. Nothing else, so that
+# a bundle can't change git's or gpg's configuration, or the local state.
+bundle_dirnames = (blockchain_dirname, transactions_dirname, confirmations_dirname,
+                   cancellations_dirname, extra_connections_dirname, banned_dirname,
+                   key_rotations_dirname)
+
+
+def safe_relative_path(path):
+    """Check that a path from a bundle can't escape the repo, and is one
+    of the files that a bundle can contain.
+    """
+    relpath = pathlib.PurePosixPath(path)
+    if (relpath.is_absolute() or len(relpath.parts) == 0 or
+            any(map(lambda part: part.startswith('.'), relpath.parts))):
+        raise Exception('bundle: bad path: ' + path)
+    if relpath != pathlib.PurePosixPath(block0_pubkey_filename) and not (
+            len(relpath.parts) > 1 and
+            relpath.parts[0] in map(lambda d: d.as_posix(), bundle_dirnames)):
+        raise Exception('bundle: path is not allowed in a bundle: ' + path)
+    return relpath
+
+
+def in_git_repo(rootdir, path):
+    """Check whether path is in a git repo inside rootdir, like a smart
+    contract.
+    """
+    for parent in path.parents:
+        if parent == rootdir:
+            return False
+        if parent.joinpath('.git').exists():
+            return True
+    return False
+
+
+def linked_files(rootdir, block):
+    """The files that a block's filerefs point to, relative to rootdir,
+    not including the previous block or files in git repos. Includes the
+    files that a registered transaction links to.
+    """
+    prev = block.get('prev')
+    paths = []
+    for obj in walkjson(block):
+        if is_fileref(obj) and obj is not prev:
+            paths.append(resolve_path([rootdir], obj))
+    for action in block['actions']:
+        if action['type'] != 'register_transaction':
+            continue
+        location_array = list(map(lambda loc: resolve_path(
+            [rootdir], loc), action['locations']))
+        transaction = parse_json(load_fileref([rootdir], action['transaction']))
+        for obj in walkjson(transaction):
+            if is_fileref(obj):
+                paths.append(resolve_path(location_array, obj))
+    return list(map(lambda path: pathlib.PurePath(path.relative_to(rootdir)),
+                    filter(lambda path: not in_git_repo(rootdir, path), paths)))
+
+
+class BundleWriter(object):
+    def __init__(self, f, header):
+        self.f = f
+        # f might be a pipe, so keep track of the offset.
+        self.offset = 0
+        self.index = []
+        self.paths = set()
+        header_content = json.dumps(header).encode('utf-8')
+        self.write(bundle_magic + path_len_format.pack(len(header_content)) + header_content)
+
+    def write(self, data):
+        self.f.write(data)
+        self.offset += len(data)
+
+    def add_file(self, rootdir, relpath):
+        """Add a file, unless it's already in the bundle."""
+        name = relpath.as_posix()
+        if name in self.paths:
+            return
+        self.paths.add(name)
+        path_content = name.encode('utf-8')
+        path = rootdir.joinpath(relpath)
+        h = hashlib.sha512()
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            self.write(path_len_format.pack(len(path_content)) +
+                       path_content + data_len_format.pack(size))
+            data_offset = self.offset
+            remaining = size
+            while remaining > 0:
+                chunk = f.read(min(hash_chunk_size, remaining))
+                if len(chunk) == 0:
+                    raise Exception('bundle: file changed while reading: ' + path.as_posix())
+                h.update(chunk)
+                self.write(chunk)
+                remaining -= len(chunk)
+        count_resource('files_opened')
+        count_resource('bytes_read', size)
+        count_resource('bytes_hashed', size)
+        self.write(h.digest())
+        self.index.append({'path': name, 'offset': data_offset,
+                          'size': size, 'SHA-512': h.hexdigest()})
+
+    def finish(self):
+        self.write(path_len_format.pack(0))
+        index_offset = self.offset
+        index_content = json.dumps(self.index).encode('utf-8')
+        self.write(data_len_format.pack(len(index_content)) + index_content)
+        self.write(data_len_format.pack(index_offset) + bundle_magic)
+
+
+def export_bundle(rootdir, f, start=0, stop=None):
+    """Write the blocks from start up to, but not including, stop (default:
+    the end of the chain) to the binary file object f. Returns the index.
+    """
+    rootdir = rootdir.resolve()
+    if stop is None:
+        stop = most_recent_block_idx(rootdir) + 1
+    fpr = load_block(rootdir, 0)['owner']['gpg']
+    writer = BundleWriter(f, {
+        'pyom_version': pyom_version_number,
+        'gpg': fpr,
+        'start': start,
+        'stop': stop
+    })
+    writer.add_file(rootdir, block0_pubkey_filename)
+    for idx, block_content in iter_block_files(rootdir, start, stop, exts=(block_ext_json,)):
+        for relpath in linked_files(rootdir, parse_json(block_content)):
+            writer.add_file(rootdir, relpath)
+        for ext in [block_ext_json, block_ext_ref, block_ext_sig]:
+            writer.add_file(rootdir, blockfilename(idx, ext))
+    writer.finish()
+    return writer.index
+
+
+def read_exactly(f, n):
+    data = f.read(n)
+    if len(data) != n:
+        raise Exception('bundle: unexpected end of file')
+    return data
+
+
+def read_bundle_header(f):
+    if read_exactly(f, len(bundle_magic)) != bundle_magic:
+        raise Exception('bundle: bad magic number')
+    (header_len,) = path_len_format.unpack(read_exactly(f, path_len_format.size))
+    header = json.loads(read_exactly(f, header_len))
+    if header['pyom_version'] != pyom_version_number:
+        raise Exception('bundle: bad pyom version')
+    return header
+
+
+def read_record_header(f):
+    """Returns (path, size) for the next record, or None at the end."""
+    (path_len,) = path_len_format.unpack(read_exactly(f, path_len_format.size))
+    if path_len == 0:
+        return None
+    path = safe_relative_path(read_exactly(f, path_len).decode('utf-8'))
+    (size,) = data_len_format.unpack(read_exactly(f, data_len_format.size))
+    return path, size
+
+
+def copy_record_data(f, size, out):
+    """Copy a record's data from f to out, in chunks, and check its hash."""
+    h = hashlib.sha512()
+    remaining = size
+    while remaining > 0:
+        chunk = read_exactly(f, min(hash_chunk_size, remaining))
+        h.update(chunk)
+        out.write(chunk)
+        remaining -= len(chunk)
+    count_resource('bytes_hashed', size)
+    if read_exactly(f, digest_size) != h.digest():
+        raise Exception('bundle: hash mismatch')
+
+
+def read_record(f, max_size=None):
+    """Returns (path, data) for the next record, or None at the end. The
+    data is read into memory, so records larger than max_size raise an
+    exception.
+    """
+    record = read_record_header(f)
+    if record is None:
+        return None
+    path, size = record
+    return path, read_record_data(f, path, size, max_size)
+
+
+def read_record_data(f, path, size, max_size=None):
+    """The data of the record whose header has just been read."""
+    if max_size is not None and size > max_size:
+        raise Exception('bundle: record is too large: ' + path.as_posix())
+    data = read_exactly(f, size)
+    count_resource('bytes_hashed', size)
+    if read_exactly(f, digest_size) != hashlib.sha512(data).digest():
+        raise Exception('bundle: hash mismatch: ' + path.as_posix())
+    return data
+
+
+def write_record_data(f, size, rootdir, relpath):
+    """Write the data of the record whose header has just been read to
+    relpath, via a temporary file in the local state directory, like
+    write_block_files.
+    """
+    path = rootdir.joinpath(relpath)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmpdir = rootdir.joinpath(tmp_dirname)
+    tmpdir.mkdir(parents=True, exist_ok=True)
+    tmp_path = tmpdir.joinpath(path.name)
+    try:
+        with open(tmp_path, 'wb') as out:
+            copy_record_data(f, size, out)
+    except Exception:
+        try:
+            tmp_path.unlink(missing_ok=True)
+        except OSError:
+            pass
+        raise
+    tmp_path.rename(path)
+
+
+def read_bundle_index(f):
+    """The index of a bundle in a seekable file."""
+    f.seek(-(data_len_format.size + len(bundle_magic)), os.SEEK_END)
+    (index_offset,) = data_len_format.unpack(read_exactly(f, data_len_format.size))
+    if read_exactly(f, len(bundle_magic)) != bundle_magic:
+        raise Exception('bundle: bad magic number at end of file')
+    f.seek(index_offset)
+    (index_len,) = data_len_format.unpack(read_exactly(f, data_len_format.size))
+    return json.loads(read_exactly(f, index_len))
+
+
+def skip_bundle_trailer(f):
+    """Read the index and the trailer after the records, so that a pipe or
+    a socket is left at the end of the bundle.
+    """
+    (index_len,) = data_len_format.unpack(read_exactly(f, data_len_format.size))
+    remaining = index_len
+    while remaining > 0:
+        remaining -= len(read_exactly(f, min(hash_chunk_size, remaining)))
+    read_exactly(f, data_len_format.size)
+    if read_exactly(f, len(bundle_magic)) != bundle_magic:
+        raise Exception('bundle: bad magic number at end of bundle')
+
+
+def check_existing_file(path, size, f):
+    """If the file is already there, it must be identical. Returns True if
+    it is, in which case the record's data is skipped.
+    """
+    if not path.exists():
+        return False
+    if path.stat().st_size == size:
+        h = hashlib.sha512()
+        remaining = size
+        while remaining > 0:
+            chunk = read_exactly(f, min(hash_chunk_size, remaining))
+            h.update(chunk)
+            remaining -= len(chunk)
+        digest = read_exactly(f, digest_size)
+        if digest == h.digest() and sha512_file(path) == digest.hex():
+            return True
+    raise Exception('bundle: a different file already exists: ' + path.as_posix())
+
+
+block_exts = (block_ext_json, block_ext_ref, block_ext_sig)
+
+
+def next_block_file(relpath, idx, contents):
+    """The extension of relpath, which must be one of the files of block
+    idx that haven't arrived yet. contents maps extension to the files
+    that have.
+    """
+    ext = next(filter(lambda ext: relpath == blockfilename(idx, ext), block_exts), None)
+    if ext is None or ext in contents:
+        raise Exception('bundle: unexpected block file: ' + relpath.as_posix())
+    return ext
+
+
+def has_block(rootdir, idx):
+    """The signature is written last, so it's only there if the block is
+    complete.
+    """
+    return rootdir.joinpath(blockfilename(idx, block_ext_sig)).exists()
+
+
+def check_existing_block(rootdir, idx, block_contents):
+    for ext, content in zip(block_exts, block_contents):
+        if read_file(rootdir.joinpath(blockfilename(idx, ext))) != content:
+            raise Exception('bundle: block ' + str(idx) + ' is different from ours')
+
+
+def import_bundle(f, rootdir, fsync_policy=None):
+    """Read a bundle from the binary file object f, and write its files
+    into rootdir. Existing files must be identical to the ones in the
+    bundle. The blocks must be consecutive, and are written with
+    write_block_files, so a crash can't leave a hole or a partial block
+    behind. Returns the header.
+    """
+    header = read_bundle_header(f)
+    idx = header['start']
+    if idx > 0 and not has_block(rootdir, idx - 1):
+        raise Exception('bundle: starts at block ' + str(idx) +
+                        ', but block ' + str(idx - 1) + ' is missing')
+    contents = {}
+    while True:
+        record = read_record_header(f)
+        if record is None:
+            break
+        relpath, size = record
+        if relpath.parts[0] != blockchain_dirname.as_posix():
+            if len(contents) > 0:
+                raise Exception('bundle: unexpected file in block ' + str(idx) +
+                                ': ' + relpath.as_posix())
+            if not check_existing_file(rootdir.joinpath(relpath), size, f):
+                write_record_data(f, size, rootdir, relpath)
+            continue
+        ext = next_block_file(relpath, idx, contents)
+        contents[ext] = read_record_data(f, relpath, size, default_limits.max_block_size)
+        if len(contents) < len(block_exts):
+            continue
+        block_contents = tuple(map(lambda ext: contents[ext], block_exts))
+        if has_block(rootdir, idx):
+            check_existing_block(rootdir, idx, block_contents)
+        else:
+            write_block_files(rootdir, idx, [block_contents], fsync_policy)
+        contents = {}
+        idx += 1
+    if len(contents) > 0 or idx != header['stop']:
+        raise Exception('bundle: ended in the middle of block ' + str(idx))
+    return header
+
+
+def check_linked(rootdir, idx, block, paths):
+    """Check that block idx links to every file in paths, which were
+    written for it.
+    """
+    allowed = set(map(lambda path: path.as_posix(), linked_files(rootdir, block)))
+    if idx == 0:
+        allowed.add(block0_pubkey_filename.as_posix())
+    for path in paths:
+        relpath = path.relative_to(rootdir).as_posix()
+        if relpath not in allowed:
+            raise Exception('bundle: block ' + str(idx) +
+                            ' doesn\'t link to ' + relpath)
+
+
+def receive_bundle(f, rootdir, v=None, fsync_policy=None):
+    """Read a bundle from f, which can be a pipe or a socket, and verify
+    each block as soon as it has arrived. The block's files are written to
+    rootdir after it has passed. The files that it links to have to be
+    written first, so that the verifier can check them, but they are
+    removed again if the block fails, or doesn't link to them. Only the
+    paths that safe_relative_path allows are written at all. Blocks that
+    rootdir already has must
+    be identical. The git repos that the blocks use, like smart contracts,
+    must already be in rootdir.
+
+    v is a Verifier that has verified all of rootdir. If it's None, the
+    blockchain in rootdir is verified first. Returns the Verifier, which
+    must not be used after an exception.
+    """
+    header = read_bundle_header(f)
+    rootdir.mkdir(parents=True, exist_ok=True)
+    rootdir = rootdir.resolve()
+    if v is None and rootdir.joinpath(blockfilename(0, block_ext_json)).exists():
+        v = verify_chain(rootdir)
+    limits = v.limits if v is not None else default_limits
+    idx = header['start']
+    # The files of block idx, and the files it links to that were written.
+    contents = {}
+    linked = []
+    try:
+        while True:
+            record = read_record_header(f)
+            if record is None:
+                break
+            relpath, size = record
+            path = rootdir.joinpath(relpath)
+            if relpath.parts[0] != blockchain_dirname.as_posix():
+                if size > limits.max_linked_file_size:
+                    raise Exception('bundle: file is too large: ' + relpath.as_posix())
+                if not check_existing_file(path, size, f):
+                    write_record_data(f, size, rootdir, relpath)
+                    linked.append(path)
+                continue
+            ext = next_block_file(relpath, idx, contents)
+            contents[ext] = read_record_data(f, relpath, size, limits.max_block_size)
+            if len(contents) < len(block_exts):
+                continue
+            block_contents = tuple(map(lambda ext: contents[ext], block_exts))
+            if v is None:
+                v = Verifier(rootdir, init_local_gpg(rootdir.joinpath(gnupg_dirname)))
+            if v.fpr != header['gpg']:
+                raise Exception('bundle: blockchain of a different key')
+            if idx < v.nextidx:
+                check_existing_block(rootdir, idx, block_contents)
+                check_linked(rootdir, idx, parse_json(block_contents[0]), linked)
+            else:
+                v.verify_block_files(idx, *block_contents)
+                check_linked(rootdir, idx, parse_json(block_contents[0]), linked)
+                write_block_files(rootdir, idx, [block_contents], fsync_policy)
+            contents = {}
+            linked = []
+            idx += 1
+        if len(contents) > 0 or len(linked) > 0 or idx != header['stop']:
+            raise Exception('bundle: ended in the middle of block ' + str(idx))
+        skip_bundle_trailer(f)
+    except Exception:
+        # Don't keep files that no verified block links to.
+        for path in reversed(linked):
+            path.unlink(missing_ok=True)
+        raise
+    return v
+
+
+if __name__ == "__main__":
+    profile_from_argv()
+    args = sys.argv[1:]
+    if len(args) >= 2 and args[0] == 'export' and len(args) <= 4:
+        rootdir = pathlib.Path.cwd()
+        start = int(args[2]) if len(args) > 2 else 0
+        stop = int(args[3]) if len(args) > 3 else None
+        if args[1] == '-':
+            export_bundle(rootdir, sys.stdout.buffer, start, stop)
+        else:
+            with open(args[1], 'wb') as f:
+                export_bundle(rootdir, f, start, stop)
+    elif len(args) == 3 and args[0] == 'import':
+        rootdir = pathlib.Path(args[2]).resolve()
+        if args[1] == '-':
+            header = import_bundle(sys.stdin.buffer, rootdir)
+        else:
+            with open(args[1], 'rb') as f:
+                header = import_bundle(f, rootdir)
+        print('imported blocks ' + str(header['start']) + ' to ' +
+              str(header['stop'] - 1) + ' of ' + header['gpg'])
+    elif len(args) == 3 and args[0] == 'receive':
+        rootdir = pathlib.Path(args[2]).resolve()
+        if args[1] == '-':
+            v = receive_bundle(sys.stdin.buffer, rootdir)
+        else:
+            with open(args[1], 'rb') as f:
+                v = receive_bundle(f, rootdir)
+        print('verified up to block ' + str(v.nextidx - 1) + ' of ' + v.fpr)
+    elif len(args) == 2 and args[0] == 'list':
+        with open(args[1], 'rb') as f:
+            print(json.dumps(read_bundle_header(f)))
+            for entry in read_bundle_index(f):
+                print(entry['path'], entry['size'])
+    else:
+        print('usage: bundle export path/to/out.bundle|- [start [stop]]\n' +
+              '       bundle import path/to/in.bundle|- path/to/pyom_repo\n' +
+              '       bundle receive path/to/in.bundle|- path/to/pyom_repo\n' +
+              '       bundle list path/to/in.bundle', file=sys.stderr)
+        sys.exit(1)
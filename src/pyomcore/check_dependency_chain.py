@@ -28,15 +28,14 @@ def check_dependency(worklist, verifiers, that_fpr, that_blockref):
     that_v = verifiers[that_fpr]
     # Check that the hash matches
     that_idx = that_blockref['idx']
-    that_block_content = that_v.rootdir.joinpath(
-        blockfilename(that_idx, block_ext_json)).read_bytes()
-    if that_blockref['SHA-512'] != hashlib.sha512(that_block_content).hexdigest():
+    that_block_content = read_file(that_v.rootdir.joinpath(
+        blockfilename(that_idx, block_ext_json)), that_v.limits.max_block_size)
+    if that_blockref['SHA-512'] != sha512_hex(that_block_content):
         raise Exception('check_dependency_chain: hash mismatch')
     if that_idx < that_v.nextidx:
         # already visited
         return
-    for idx in range(that_v.nextidx, that_idx + 1):
-        that_v.verify_block(idx)
+    that_v.verify_blocks(that_v.nextidx, that_idx + 1)
     worklist.append(that_fpr)
 
 
@@ -56,7 +55,7 @@ def is_detached(verifiers, transaction_status):
     return False
 
 
-def check_dependency_chain(mainrootdir, rootdirs):
+def check_dependency_chain(mainrootdir, rootdirs, main_v=None):
     """Checks the consistency of your dependencies. Inconsistency can happen
     when somebody forks their blockchain. (Forking your blockchain is
     against the rules and will get you banned.) Blockchains are linked
@@ -71,8 +70,12 @@ def check_dependency_chain(mainrootdir, rootdirs):
 
     mainrootdir is your blockchain and rootdirs are other blockchains that it
     depends on. Only dependencies that can be reached from mainrootdir are checked.
+    main_v can be a Verifier that has already verified all of mainrootdir.
+    Returns the Verifiers, indexed by fpr. Each has only verified the blocks
+    that are in the dependency chain.
     """
-    main_v = verify_chain(mainrootdir)
+    if main_v is None:
+        main_v = verify_chain(mainrootdir)
     # Add all the rootdirs to a dict.
     verifiers = {main_v.fpr: main_v}
     for rootdir in rootdirs:
@@ -87,14 +90,16 @@ def check_dependency_chain(mainrootdir, rootdirs):
     while len(worklist) > 0:
         this_fpr = worklist.pop()
         this_v = verifiers[this_fpr]
-        for that_fpr, that_blockref in this_v.extra_connections.items():
-            check_dependency(worklist, verifiers, that_fpr, that_blockref)
-        for transaction_hash, transaction_status in this_v.transactions.items():
-            if not transaction_status.is_confirmed():
-                # Only confirmed transactions are included in the dependency chain
-                continue
-            for that_fpr, that_blockref in transaction_status.signatures.items():
+        with span('check_dependencies', 'dependency', gpg=this_fpr):
+            for that_fpr, that_blockref in this_v.extra_connections.items():
                 check_dependency(worklist, verifiers, that_fpr, that_blockref)
+            for transaction_hash, transaction_status in this_v.transactions.items():
+                if not transaction_status.is_confirmed():
+                    # Only confirmed transactions are included in the dependency chain
+                    continue
+                for that_fpr, that_blockref in transaction_status.signatures.items():
+                    check_dependency(worklist, verifiers,
+                                     that_fpr, that_blockref)
     # Check for annulled transactions that should have been reinstated: you aren't
     # allowed to cherry-pick which transactions to annul.
     for this_fpr, this_v in verifiers.items():
@@ -104,13 +109,20 @@ def check_dependency_chain(mainrootdir, rootdirs):
             if not is_detached(verifiers, transaction_status):
                 raise Exception('annulled transaction should be reinstated: ' +
                                 this_fpr + ': ' + transaction_hash)
+    return verifiers
 
 
 if __name__ == "__main__":
+    profile_from_argv()
     if len(sys.argv) < 2:
         print('usage: check_dependency_chain path/to/my/pyom_repo path/to/other/pyom_repo1 path/to/other/pyom_repo2 ...',
               file=sys.stderr)
         sys.exit(1)
     mainrootdir = pathlib.Path(sys.argv[1]).resolve()
     rootdirs = list(map(lambda p: pathlib.Path(p).resolve(), sys.argv[2:]))
-    check_dependency_chain(mainrootdir, rootdirs)
+    from .daemon import daemon_serves, daemon_request
+    if daemon_serves(mainrootdir):
+        daemon_request(mainrootdir, {'op': 'check_dependency_chain', 'rootdir': mainrootdir.as_posix(),
+                                     'rootdirs': list(map(lambda p: p.as_posix(), rootdirs))})
+    else:
+        check_dependency_chain(mainrootdir, rootdirs)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcore.
+#
+# pyomcore is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcore is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcore. If not, see <https://www.gnu.org/licenses/>.
+
+# The pyom command. "pyom confirm_transactions ..." is the same as
+# "python3 -m pyomcore.confirm_transactions ...". Only the module for the
+# requested subcommand is imported, so that cron jobs that run pyom
+# thousands of times a day don't pay for everything else. Don't import
+# pyomcore.utils here: it's the subcommand's job.
+
+import runpy
+import sys
+
+commands = [
+    'add_ban',
+    'add_extra_connection',
+    'add_smart_contract',
+    'annul_transaction',
+    'bundle',
+    'check_dependency_chain',
+    'confirm_transactions',
+    'copy_bans',
+    'create_block',
+    'daemon',
+    'export_ledger',
+    'initialize_blockchain',
+    'recover_blockchain',
+    'reinstate_transaction',
+    'remove_extra_connection',
+    'rotate_key',
+    'sign_transactions',
+    'state_digest',
+    'sync_peers',
+    'verifier',
+    'watch_forks',
+]
+
+
+def usage():
+    print('usage: pyom <command> [args ...]\ncommands:\n  ' +
+          '\n  '.join(commands), file=sys.stderr)
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+    if len(argv) < 2 or not argv[1] in commands:
+        usage()
+        sys.exit(1)
+    module = 'pyomcore.' + argv[1]
+    sys.argv = [module] + argv[2:]
+    runpy.run_module(module, run_name='__main__', alter_sys=True)
+
+
+if __name__ == "__main__":
+    main()
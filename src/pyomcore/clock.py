@@ -0,0 +1,73 @@
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcore.
+#
+# pyomcore is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcore is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcore. If not, see <https://www.gnu.org/licenses/>.
+
+import contextlib
+import threading
+from datetime import datetime, timedelta, timezone
+
+# Everything that creates or compares timestamps gets the time from
+# utc_now(). Tests replace the clock with a FakeClock, so that they can
+# let transactions expire without sleeping.
+
+
+class SystemClock(object):
+    def now(self):
+        return datetime.now(timezone.utc)
+
+
+class FakeClock(object):
+    """A clock that only moves when it is told to. Every call to now()
+    also moves it forward by tick, because block timestamps must be
+    strictly increasing, and in the past when the block is verified.
+    """
+
+    def __init__(self, start=None, tick=timedelta(microseconds=1)):
+        self.time = start if start is not None else datetime.now(timezone.utc)
+        self.tick = tick
+        self.lock = threading.Lock()
+
+    def now(self):
+        with self.lock:
+            self.time += self.tick
+            return self.time
+
+    def advance(self, delta):
+        with self.lock:
+            self.time += delta
+
+
+clock = SystemClock()
+
+
+def utc_now():
+    return clock.now()
+
+
+def set_clock(new_clock):
+    """Returns the old clock."""
+    global clock
+    old_clock = clock
+    clock = new_clock
+    return old_clock
+
+
+@contextlib.contextmanager
+def use_clock(new_clock):
+    old_clock = set_clock(new_clock)
+    try:
+        yield new_clock
+    finally:
+        set_clock(old_clock)
@@ -19,6 +19,8 @@
 import sys
 from .utils import *
 from .verifier import Verifier, verify_chain
+from .group_commit import repo_lock
+from .rotate_key import import_key_rotation_actions
 
 
 def copy_block(this_rootdir, this_subdir, that_rootdir, that_idx):
@@ -43,13 +45,14 @@ def copy_block(this_rootdir, this_subdir, that_rootdir, that_idx):
     }
 
 
-def confirm_transactions(gpg_ctx, this_rootdir, that_rootdir, confirm_only=True):
-    """Look for transactions that can be confirmed in this_rootdir because
-    they were accepted in that_rootdir. gpg_ctx should be ~/.gnupg
+def find_confirm_actions(this_v, that_v, confirm_only=True):
+    """Returns the actions that confirm, sign or cancel the pending
+    transactions of this_v, based on the blockchain verified by that_v.
+    Copies of that_v's blocks are written into this_v's directory as evidence.
     """
+    this_rootdir = this_v.rootdir
+    that_rootdir = that_v.rootdir
     confirm_actions = []
-    this_v = verify_chain(this_rootdir)
-    that_v = verify_chain(that_rootdir)
     for transaction_hash, this_transaction_status in this_v.transactions.items():
         if not this_transaction_status.is_pending():
             continue
@@ -59,7 +62,7 @@ def confirm_transactions(gpg_ctx, this_rootdir, that_rootdir, confirm_only=True)
             if confirm_only and len(this_transaction_status.pending_participants) > 1:
                 raise Exception('Can\'t confirm because you\'re not the last participant. ' +
                                 'Use sign_transactions.py to sign without confirming.')
-            timestamp = datetime.now(timezone.utc)
+            timestamp = utc_now()
             confirmation_path = mk_unique_path(confirmations_dirname)
             that_transaction_status = that_v.transactions[transaction_hash]
             that_idx = that_transaction_status.block_idx
@@ -81,32 +84,25 @@ def confirm_transactions(gpg_ctx, this_rootdir, that_rootdir, confirm_only=True)
             transaction_timestamp = datetime.fromisoformat(
                 transaction['timestamp'])
             expiry_timestamp = datetime.fromisoformat(transaction['expiry'])
-            # Search backwards to first block after the expiry
+            # Search backwards for the first block after the expiry, then
+            # the last block before the transaction.
             end_idx = None
-            that_idx = most_recent_block_idx(that_rootdir)
-            while True:
-                that_block = load_block(that_rootdir, that_idx)
+            start_idx = None
+            for that_block in iter_blocks(that_rootdir, reverse=True):
                 that_timestamp = datetime.fromisoformat(
                     that_block['timestamp'])
-                if that_timestamp < expiry_timestamp:
+                if not (that_timestamp < expiry_timestamp):
+                    end_idx = that_block['idx']
+                elif end_idx is None:
                     break
-                end_idx = that_idx
-                that_idx -= 1
-            # If end_idx is None, then no evidence for cancellation yet
-            if not end_idx is None:
-                that_idx = end_idx
+                elif that_timestamp < transaction_timestamp:
+                    start_idx = that_block['idx']
+                    break
+            # If start_idx is None, then no evidence for cancellation yet
+            if not start_idx is None:
                 cancellation_path = mk_unique_path(cancellations_dirname)
-                # Search backwards to first block before transaction
-                blocks = []
-                while True:
-                    blocks.insert(0, copy_block(
-                        this_rootdir, cancellation_path, that_rootdir, that_idx))
-                    that_block = load_block(that_rootdir, that_idx)
-                    that_timestamp = datetime.fromisoformat(
-                        that_block['timestamp'])
-                    if that_timestamp < transaction_timestamp:
-                        break
-                    that_idx -= 1
+                blocks = list(map(lambda that_idx: copy_block(
+                    this_rootdir, cancellation_path, that_rootdir, that_idx), range(start_idx, end_idx + 1)))
                 cancel_action = {
                     'type': 'cancel_transaction',
                     'gpg': that_v.fpr,
@@ -114,18 +110,40 @@ def confirm_transactions(gpg_ctx, this_rootdir, that_rootdir, confirm_only=True)
                     'blocks': blocks
                 }
                 confirm_actions.append(cancel_action)
+    if len(confirm_actions) > 0:
+        # Blocks that that_v's owner signed with a new key can only be
+        # checked after the key rotation has been imported.
+        confirm_actions = import_key_rotation_actions(
+            this_v, that_v) + confirm_actions
+    return confirm_actions
+
 
-    if len(confirm_actions) == 0:
-        return
-    protoblock = {'actions': confirm_actions}
-    this_v.append_block(gpg_ctx, protoblock)
+def confirm_transactions(gpg_ctx, this_rootdir, that_rootdir, confirm_only=True):
+    """Look for transactions that can be confirmed in this_rootdir because
+    they were accepted in that_rootdir. gpg_ctx should be ~/.gnupg
+    """
+    with repo_lock(this_rootdir):
+        this_v = verify_chain(this_rootdir)
+        that_v = verify_chain(that_rootdir)
+        confirm_actions = find_confirm_actions(this_v, that_v, confirm_only)
+        if len(confirm_actions) == 0:
+            return
+        protoblock = {'actions': confirm_actions}
+        this_v.append_block(gpg_ctx, protoblock)
 
 
 if __name__ == "__main__":
+    profile_from_argv()
     if len(sys.argv) != 2:
         print('usage: confirm_transactions path/to/other/pyom_repo', file=sys.stderr)
         sys.exit(1)
+    from .daemon import daemon_serves, daemon_request
     rootdir = pathlib.Path.cwd()
-    gpg_ctx = gpg.Context()
-    confirm_transactions(gpg_ctx, rootdir, pathlib.Path(
-        sys.argv[1]).resolve(), confirm_only=True)
+    that_rootdir = pathlib.Path(sys.argv[1]).resolve()
+    if daemon_serves(rootdir):
+        daemon_request(rootdir, {'op': 'confirm', 'rootdir': rootdir.as_posix(),
+                                 'that_rootdir': that_rootdir.as_posix(), 'confirm_only': True})
+    else:
+        gpg_ctx = gpg.Context()
+        confirm_transactions(
+            gpg_ctx, rootdir, that_rootdir, confirm_only=True)
@@ -19,29 +19,32 @@
 import sys
 from .utils import *
 from .verifier import Verifier, verify_chain
+from .group_commit import repo_lock
 from .add_ban import add_ban
 
 
 def copy_bans(gpg_ctx, mainrootdir, rootdirs):
     """Copy information about banned users from the other blockchains"""
-    main_v = verify_chain(mainrootdir)
-    for rootdir in rootdirs:
-        v = verify_chain(rootdir)
-        for fpr, action in v.banned.items():
-            if not main_v.is_banned(fpr):
-                key_content = load_fileref([rootdir], action['keyfile'])
-                remotes = action['git_remote_urls']
-                ref_content1 = load_fileref([rootdir], action['block_ref1'])
-                sig_content1 = load_fileref([rootdir], action['block_sig1'])
-                ref_content2 = load_fileref([rootdir], action['block_ref2'])
-                sig_content2 = load_fileref([rootdir], action['block_sig2'])
-                blockref1 = json.loads(ref_content1)
-                idx = blockref1['idx']
-                add_ban(gpg_ctx, main_v, fpr, idx, key_content, remotes,
-                        ref_content1, sig_content1, ref_content2, sig_content2)
+    with repo_lock(mainrootdir):
+        main_v = verify_chain(mainrootdir)
+        for rootdir in rootdirs:
+            v = verify_chain(rootdir)
+            for fpr, action in v.banned.items():
+                if not main_v.is_banned(fpr):
+                    key_content = load_fileref([rootdir], action['keyfile'])
+                    remotes = action['git_remote_urls']
+                    ref_content1 = load_fileref([rootdir], action['block_ref1'])
+                    sig_content1 = load_fileref([rootdir], action['block_sig1'])
+                    ref_content2 = load_fileref([rootdir], action['block_ref2'])
+                    sig_content2 = load_fileref([rootdir], action['block_sig2'])
+                    blockref1 = json.loads(ref_content1)
+                    idx = blockref1['idx']
+                    add_ban(gpg_ctx, main_v, fpr, idx, key_content, remotes,
+                            ref_content1, sig_content1, ref_content2, sig_content2)
 
 
 if __name__ == "__main__":
+    profile_from_argv()
     if len(sys.argv) < 2:
         print('usage: copy_bans path/to/my/pyom_repo path/to/other/pyom_repo1 path/to/other/pyom_repo2 ...',
               file=sys.stderr)
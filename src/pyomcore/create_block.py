@@ -19,15 +19,24 @@
 import sys
 from .utils import *
 from .verifier import Verifier, verify_chain
+from .group_commit import submit_protoblocks
 
-# Load a protoblock (a JSON file containing an incomplete block) and
-# add it to your blockchain.
+# Load one or more protoblocks (JSON files containing incomplete blocks)
+# and add them to your blockchain, one block per protoblock. If other
+# processes are adding blocks at the same time, a single protoblock may be
+# merged with their actions into one block.
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print('usage: create_block path/to/protoblock.json', file=sys.stderr)
+    profile_from_argv()
+    if len(sys.argv) < 2:
+        print('usage: create_block path/to/protoblock.json ...', file=sys.stderr)
         sys.exit(1)
+    from .daemon import daemon_serves, daemon_request
     rootdir = pathlib.Path.cwd()
-    protoblock = json.loads(pathlib.Path(sys.argv[1]).read_bytes())
-    gpg_ctx = gpg.Context()
-    v = verify_chain(rootdir)
-    v.append_block(gpg_ctx, protoblock)
+    protoblocks = list(map(lambda p: json.loads(
+        pathlib.Path(p).read_bytes()), sys.argv[1:]))
+    if daemon_serves(rootdir):
+        daemon_request(rootdir, {'op': 'append', 'rootdir': rootdir.as_posix(),
+                                 'protoblocks': protoblocks})
+    else:
+        gpg_ctx = gpg.Context()
+        submit_protoblocks(gpg_ctx, rootdir, protoblocks)
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcore.
+#
+# pyomcore is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcore is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcore. If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import contextlib
+import signal
+import socket
+import socketserver
+import sys
+from .utils import *
+from .verifier import Verifier, check_blockchain_dir, verify_chain
+from .state_history import StateHistory
+from .group_commit import repo_lock
+from .confirm_transactions import find_confirm_actions
+from .check_dependency_chain import check_dependency_chain
+
+# The daemon keeps verified blockchains in memory, so that commands don't
+# have to verify them from scratch every time. It listens on a Unix socket
+# in the .pyom directory of your blockchain. Requests and responses are
+# one line of JSON each.
+daemon_socket_filename = pathlib.PurePath('daemon.sock')
+
+# Seconds that a client has to send its request, so that one that never
+# does can't block the daemon.
+daemon_request_timeout = 10
+
+
+def daemon_socket_path(rootdir):
+    """The PYOM_DAEMON_SOCKET environment variable takes precedence, so that
+    commands run in other directories can find the daemon.
+    """
+    if 'PYOM_DAEMON_SOCKET' in os.environ:
+        return pathlib.Path(os.environ['PYOM_DAEMON_SOCKET'])
+    return rootdir.joinpath(local_state_dirname).joinpath(daemon_socket_filename)
+
+
+def connect_daemon(rootdir):
+    """Returns a connected socket, or None if no daemon is running."""
+    path = daemon_socket_path(rootdir)
+    if not path.is_socket():
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path.as_posix())
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def daemon_running(rootdir):
+    sock = connect_daemon(rootdir)
+    if sock is None:
+        return False
+    sock.close()
+    return True
+
+
+def daemon_serves(rootdir):
+    """Check whether a daemon is running with rootdir as its own blockchain."""
+    if not daemon_running(rootdir):
+        return False
+    return daemon_request(rootdir, {'op': 'info'})['rootdir'] == rootdir.as_posix()
+
+
+def daemon_request(rootdir, request):
+    """Send a request to the daemon and return the result."""
+    sock = connect_daemon(rootdir)
+    if sock is None:
+        raise Exception('daemon_request: no daemon running')
+    with sock, sock.makefile('rwb') as f:
+        f.write(json.dumps(request).encode('utf-8') + b'\n')
+        f.flush()
+        response = json.loads(f.readline())
+    if not response['ok']:
+        raise Exception(response['error'])
+    return response['result']
+
+
+def block_hash(rootdir, idx):
+    return sha512_hex(read_file(rootdir.joinpath(blockfilename(idx, block_ext_json)),
+                                default_limits.max_block_size))
+
+
+class CachedChain(object):
+    """A Verifier that is kept up to date incrementally. Only blocks that
+    have appeared since the last refresh are verified. If the last block
+    that was verified has changed (because the blockchain was rewritten),
+    the whole chain is verified again. With history, the Verifier keeps a
+    StateHistory, which costs memory for every block.
+    """
+
+    def __init__(self, rootdir, history=False):
+        self.rootdir = rootdir
+        self.history = history
+        self.v = None
+        self.last_hash = None
+
+    def last_block_changed(self):
+        """The last block that was verified is gone (because the chain
+        was rolled back) or different (because it was rewritten).
+        """
+        try:
+            return block_hash(self.rootdir, self.v.nextidx - 1) != self.last_hash
+        except FileNotFoundError:
+            return True
+
+    def refresh(self):
+        try:
+            if self.v is not None and self.last_block_changed():
+                self.v = None
+            if self.v is None:
+                self.v = verify_chain(
+                    self.rootdir, history=StateHistory() if self.history else None)
+            else:
+                self.v.verify_blocks(self.v.nextidx)
+            self.last_hash = block_hash(self.rootdir, self.v.nextidx - 1)
+        except Exception:
+            # The verifier might be half way through a block.
+            self.v = None
+            raise
+        return self.v
+
+    def invalidate(self):
+        self.v = None
+
+
+class Daemon(object):
+    def __init__(self, rootdir, gpg_ctx, history=False):
+        self.rootdir = rootdir
+        self.gpg_ctx = gpg_ctx
+        self.history = history
+        self.chains = {rootdir: CachedChain(rootdir, history)}
+
+    def chain(self, rootdir):
+        if not rootdir in self.chains:
+            self.chains[rootdir] = CachedChain(rootdir, self.history)
+        return self.chains[rootdir]
+
+    def handle(self, request):
+        op = request['op']
+        if op in ['append', 'confirm', 'check_dependency_chain']:
+            if pathlib.Path(request['rootdir']) != self.rootdir:
+                raise Exception('daemon serves a different blockchain: ' +
+                                self.rootdir.as_posix())
+        if op == 'info':
+            return {'rootdir': self.rootdir.as_posix()}
+        elif op == 'verify':
+            v = self.chain(pathlib.Path(request['rootdir'])).refresh()
+            return {'fpr': v.fpr, 'numblocks': v.nextidx}
+        elif op == 'query':
+            return self.query(request)
+        elif op == 'append':
+            return self.append(request['protoblocks'])
+        elif op == 'confirm':
+            return self.confirm(pathlib.Path(request['that_rootdir']), request['confirm_only'])
+        elif op == 'check_dependency_chain':
+            rootdirs = list(map(pathlib.Path, request['rootdirs']))
+            chain = self.chain(self.rootdir)
+            try:
+                check_dependency_chain(self.rootdir, rootdirs, chain.refresh())
+            except Exception:
+                chain.invalidate()
+                raise
+            return {}
+        else:
+            raise Exception('unknown daemon request: ' + op)
+
+    def query(self, request):
+        """If the request has an idx, the answer is the state after that
+        block, rather than the current state.
+        """
+        v = self.chain(pathlib.Path(request['rootdir'])).refresh()
+        state = v
+        numblocks = v.nextidx
+        if 'idx' in request:
+            if v.history is None:
+                raise Exception('daemon was started without --history')
+            state = v.history.state_at(request['idx'])
+            numblocks = state.idx + 1
+        if 'transaction' in request:
+            transaction_status = state.transactions.get(
+                request['transaction'])
+            if transaction_status is None:
+                raise Exception('unknown transaction: ' +
+                                request['transaction'])
+            return {
+                'state': transaction_status.state.name,
+                'block_idx': transaction_status.block_idx,
+                'pending_participants': sorted(transaction_status.pending_participants)
+            }
+        return {
+            'fpr': v.fpr,
+            'signer': signer_at(v.fpr, state.key_rotations.get(v.fpr, []), numblocks),
+            'numblocks': numblocks,
+            'transactions': dict(map(lambda item: (item[0], item[1].state.name), state.transactions.items())),
+            'banned': sorted(state.banned.keys()),
+            'extra_connections': dict(map(lambda item: (item[0], item[1]['idx']), state.extra_connections.items()))
+        }
+
+    def append_protoblocks(self, protoblocks):
+        """Must be called with the repo lock held."""
+        chain = self.chain(self.rootdir)
+        v = chain.refresh()
+        idx = v.nextidx
+        try:
+            v.append_blocks(self.gpg_ctx, protoblocks)
+        except Exception:
+            chain.invalidate()
+            raise
+        chain.last_hash = block_hash(self.rootdir, v.nextidx - 1)
+        return {'idx': list(range(idx, v.nextidx))}
+
+    def append(self, protoblocks):
+        with repo_lock(self.rootdir):
+            return self.append_protoblocks(protoblocks)
+
+    def confirm(self, that_rootdir, confirm_only):
+        with repo_lock(self.rootdir):
+            this_v = self.chain(self.rootdir).refresh()
+            that_v = self.chain(that_rootdir).refresh()
+            confirm_actions = find_confirm_actions(
+                this_v, that_v, confirm_only)
+            if len(confirm_actions) == 0:
+                return {'idx': []}
+            return self.append_protoblocks([{'actions': confirm_actions}])
+
+
+class DaemonRequestHandler(socketserver.StreamRequestHandler):
+    timeout = daemon_request_timeout
+
+    def handle(self):
+        try:
+            line = self.rfile.readline()
+        except OSError:
+            # Timed out, or the client went away.
+            return
+        if len(line) == 0:
+            # daemon_running connects without sending a request.
+            return
+        try:
+            request = json.loads(line)
+            response = {'ok': True, 'result': self.server.daemon.handle(request)}
+        except Exception as e:
+            response = {'ok': False, 'error': str(e)}
+        self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+
+@contextlib.contextmanager
+def daemon_server(daemon):
+    """A server for daemon on its socket. The socket is removed when the
+    server is closed. Only the owner can connect to it, because the daemon
+    signs blocks with the owner's key.
+    """
+    path = daemon_socket_path(daemon.rootdir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.is_socket() and not daemon_running(daemon.rootdir):
+        # Left over from a daemon that didn't shut down cleanly.
+        path.unlink()
+    # The socket is created with mode 0600, rather than chmod'ed
+    # afterwards, so nobody else can connect in between.
+    old_umask = os.umask(0o177)
+    try:
+        server = socketserver.UnixStreamServer(path.as_posix(), DaemonRequestHandler)
+    finally:
+        os.umask(old_umask)
+    with server:
+        server.daemon = daemon
+        try:
+            yield server
+        finally:
+            path.unlink()
+
+
+def run_daemon(gpg_ctx, rootdir, peer_rootdirs, history=False):
+    """Serve requests until interrupted. Requests are handled one at a
+    time, because the verifiers and gpg contexts aren't thread safe.
+    Queries for the state after an earlier block need history.
+    """
+    daemon = Daemon(rootdir, gpg_ctx, history)
+    daemon.chain(rootdir).refresh()
+    for peer_rootdir in peer_rootdirs:
+        daemon.chain(peer_rootdir).refresh()
+    with daemon_server(daemon) as server:
+        server.serve_forever()
+
+
+if __name__ == "__main__":
+    profile_from_argv()
+    history = '--history' in sys.argv
+    if history:
+        sys.argv.remove('--history')
+    rootdir = pathlib.Path.cwd()
+    peer_rootdirs = list(
+        map(lambda p: pathlib.Path(p).resolve(), sys.argv[1:]))
+    # Exit cleanly (and remove the socket) when killed.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        run_daemon(gpg.Context(), rootdir, peer_rootdirs, history)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcore.
+#
+# pyomcore is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcore is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcore. If not, see <https://www.gnu.org/licenses/>.
+
+import csv
+import sys
+from .utils import *
+
+# Export blockchains for analytics. Every block, action, transaction
+# state change, and signature of a transaction is a record. Records
+# are streamed one block at a time, so memory use doesn't depend on
+# the length of the chain. The export doesn't check signatures, so
+# run the verifier first.
+#
+# Each blockchain is exported to a file in outdir, named after the
+# owner's fingerprint and a hash of the blockchain's path, so that
+# copies of the same blockchain, like a mirror or a fork, don't share
+# a file. A cursor file next to it records the last block
+# that was exported, its hash, and the size of the output file, so the
+# next export only appends the new blocks. If the block at the cursor has
+# changed, the blockchain was rewritten and the export fails.
+
+# Columns of the CSV tables. NDJSON records have these fields too, plus
+# 'record', and action records have the whole action.
+csv_tables = {
+    'blocks': ['owner', 'idx', 'timestamp', 'SHA-512', 'numactions'],
+    'actions': ['owner', 'idx', 'position', 'type', 'gpg', 'transaction'],
+    'transactions': ['owner', 'idx', 'position', 'transaction', 'type', 'state', 'gpg'],
+    'signatures': ['owner', 'idx', 'position', 'transaction', 'gpg']
+}
+
+# The state of a transaction after each of the actions that change it.
+# sign_transaction doesn't change the state: it's a 'signatures' record.
+transaction_action_states = {
+    'register_transaction': 'PENDING',
+    'confirm_transaction': 'CONFIRMED',
+    'cancel_transaction': 'CANCELLED',
+    'annul_transaction': 'ANNULLED',
+    'reinstate_transaction': 'CONFIRMED'
+}
+
+
+def block_records(owner, block, block_hash):
+    """The records for one block, in order: the block, then each action,
+    each followed by its transaction state change or signature, if it has
+    one.
+    """
+    yield 'blocks', {
+        'owner': owner,
+        'idx': block['idx'],
+        'timestamp': block['timestamp'],
+        'SHA-512': block_hash,
+        'numactions': len(block['actions'])
+    }
+    for position, action in enumerate(block['actions']):
+        t = action['type']
+        transaction_hash = action['transaction']['SHA-512'] if 'transaction' in action else None
+        yield 'actions', {
+            'owner': owner,
+            'idx': block['idx'],
+            'position': position,
+            'type': t,
+            'gpg': action.get('gpg'),
+            'transaction': transaction_hash,
+            'action': action
+        }
+        if t in transaction_action_states:
+            yield 'transactions', {
+                'owner': owner,
+                'idx': block['idx'],
+                'position': position,
+                'transaction': transaction_hash,
+                'type': t,
+                'state': transaction_action_states[t],
+                'gpg': action.get('gpg', owner)
+            }
+        elif t == 'sign_transaction':
+            yield 'signatures', {
+                'owner': owner,
+                'idx': block['idx'],
+                'position': position,
+                'transaction': transaction_hash,
+                'gpg': action['gpg']
+            }
+
+
+def iter_ledger_records(rootdir, cursor=None):
+    """Yields (table, record, cursor) for the blocks after the cursor.
+    cursor is the cursor after the record's block.
+    """
+    owner = load_block(rootdir, 0)['owner']['gpg']
+    start = 0
+    prev_hash = None
+    if cursor is not None:
+        start = cursor['idx'] + 1
+        prev_hash = cursor['SHA-512']
+        block_path = rootdir.joinpath(
+            blockfilename(cursor['idx'], block_ext_json))
+        if not block_path.exists() or sha512_hex(read_file(block_path, default_limits.max_block_size)) != prev_hash:
+            raise Exception('export_ledger: block ' + str(cursor['idx']) +
+                            ' has changed since the last export: ' + rootdir.as_posix())
+    for idx, block_content in iter_block_files(rootdir, start, exts=(block_ext_json,),
+                                               max_size=default_limits.max_block_size):
+        block = parse_json(block_content, default_limits.max_json_depth)
+        block_hash = sha512_hex(block_content)
+        if block['idx'] != idx:
+            raise Exception('export_ledger: bad idx in block ' + str(idx))
+        if prev_hash is not None and block['prev']['SHA-512'] != prev_hash:
+            raise Exception('export_ledger: bad prev hash in block ' + str(idx))
+        prev_hash = block_hash
+        block_cursor = {'idx': idx, 'SHA-512': block_hash}
+        for table, record in block_records(owner, block, block_hash):
+            yield table, record, block_cursor
+
+
+def export_filename(rootdir, owner, table):
+    name = owner + '.' + sha512_hex(rootdir.resolve().as_posix().encode('utf-8'))[0:16]
+    if table is None:
+        return pathlib.PurePath(name + '.ndjson')
+    return pathlib.PurePath(name + '.' + table + '.csv')
+
+
+def export_ledger(rootdir, outdir, table=None):
+    """Append the records for the new blocks of rootdir to a file in outdir.
+    If table is None, all the records are written as NDJSON. Otherwise,
+    table is one of the keys of csv_tables, and only the records for that
+    table are written, as CSV. Returns the number of records written.
+    """
+    if table is not None and not table in csv_tables:
+        raise Exception('export_ledger: unknown table: ' + table)
+    owner = load_block(rootdir, 0)['owner']['gpg']
+    outdir.mkdir(parents=True, exist_ok=True)
+    out_path = outdir.joinpath(export_filename(rootdir, owner, table))
+    cursor_path = out_path.with_name(out_path.name + '.cursor.json')
+    cursor = None
+    if cursor_path.exists() and out_path.exists():
+        cursor = parse_json(read_file(cursor_path))
+    count = 0
+    with open(out_path, 'a+', newline='') as f:
+        # Throw away anything that was written after the cursor was saved.
+        f.truncate(0 if cursor is None else cursor['offset'])
+        f.seek(0, os.SEEK_END)
+        writer = None
+        if table is not None:
+            writer = csv.DictWriter(
+                f, csv_tables[table], extrasaction='ignore')
+            if cursor is None:
+                writer.writeheader()
+        for record_table, record, new_cursor in iter_ledger_records(rootdir, cursor):
+            cursor = new_cursor
+            if table is None:
+                f.write(json.dumps(
+                    dict(record=record_table, **record)) + '\n')
+            elif record_table == table:
+                writer.writerow(record)
+            else:
+                continue
+            count += 1
+        f.flush()
+        os.fsync(f.fileno())
+        if cursor is not None:
+            cursor = dict(cursor, offset=f.tell())
+    if cursor is not None:
+        tmp_path = cursor_path.with_name(cursor_path.name + '.tmp')
+        tmp_path.write_bytes(json.dumps(cursor, indent=2).encode('utf-8'))
+        tmp_path.rename(cursor_path)
+    return count
+
+
+def export_ledgers(rootdirs, outdir, table=None, max_workers=None):
+    """Export several blockchains in parallel, one process per blockchain.
+    Returns a dict from rootdir to the number of records written.
+    """
+    if len(rootdirs) == 1:
+        return {rootdirs[0]: export_ledger(rootdirs[0], outdir, table)}
+    with futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        counts = list(executor.map(export_ledger, rootdirs, [
+                      outdir] * len(rootdirs), [table] * len(rootdirs)))
+    return dict(zip(rootdirs, counts))
+
+
+if __name__ == "__main__":
+    profile_from_argv()
+    args = sys.argv[1:]
+    table = None
+    if len(args) >= 2 and args[0] == '--csv':
+        table = args[1]
+        args = args[2:]
+    if len(args) == 0 or (table is not None and not table in csv_tables):
+        print('usage: export_ledger [--csv blocks|actions|transactions|signatures] path/to/outdir [path/to/pyom_repo ...]',
+              file=sys.stderr)
+        sys.exit(1)
+    outdir = pathlib.Path(args[0]).resolve()
+    rootdirs = list(map(lambda p: pathlib.Path(p).resolve(), args[1:]))
+    if len(rootdirs) == 0:
+        rootdirs = [pathlib.Path.cwd()]
+    for rootdir, count in export_ledgers(rootdirs, outdir, table).items():
+        print(rootdir.as_posix() + ': ' + str(count) + ' records')
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcore.
+#
+# pyomcore is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcore is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcore. If not, see <https://www.gnu.org/licenses/>.
+
+import contextlib
+import fcntl
+import os
+import secrets
+import time
+from .utils import *
+from .verifier import Verifier, verify_chain
+from .recover_blockchain import recover_blockchain_dir
+
+lock_filename = pathlib.PurePath('lock')
+queue_dirname = pathlib.PurePath('queue')
+queue_ext_entry = '.protoblocks.json'
+queue_ext_result = '.result.json'
+journal_filename = pathlib.PurePath('commit.json')
+
+
+@contextlib.contextmanager
+def repo_lock(rootdir, recover=True):
+    """Exclusive lock on the blockchain in rootdir. Hold it while computing
+    nextidx and appending blocks, so that two processes can't write the
+    same block index. Nobody else can be writing blocks while we hold the
+    lock, so an incomplete block at the end of the chain must be left over
+    from a crash, and it is rolled back unless recover is False.
+    """
+    statedir = rootdir.joinpath(local_state_dirname)
+    statedir.mkdir(parents=True, exist_ok=True)
+    with open(statedir.joinpath(lock_filename), 'a') as lockfile:
+        fcntl.flock(lockfile, fcntl.LOCK_EX)
+        try:
+            if recover:
+                recover_blockchain_dir(rootdir)
+            yield
+        finally:
+            fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+
+def queue_dir(rootdir):
+    return rootdir.joinpath(local_state_dirname).joinpath(queue_dirname)
+
+
+def is_mergeable(protoblocks):
+    """Only single protoblocks that contain nothing but actions can be
+    merged with other submissions.
+    """
+    return len(protoblocks) == 1 and list(protoblocks[0].keys()) == ['actions']
+
+
+def group_entries(entries):
+    """Split the queue into groups. Each group becomes one call to
+    append_blocks: consecutive mergeable entries are coalesced into a
+    single protoblock, everything else is appended as submitted.
+    """
+    groups = []
+    for name, protoblocks in entries:
+        if is_mergeable(protoblocks) and len(groups) > 0 and groups[-1]['mergeable']:
+            groups[-1]['names'].append(name)
+            groups[-1]['protoblocks'][0]['actions'].extend(
+                protoblocks[0]['actions'])
+        else:
+            groups.append({
+                'mergeable': is_mergeable(protoblocks),
+                'names': [name],
+                'protoblocks': copy.deepcopy(protoblocks)
+            })
+    return groups
+
+
+def write_result(qdir, name, result):
+    """Write the result for a queue entry, then remove the entry. A crash
+    in between leaves both, and the entry is skipped next time.
+    """
+    result_path = qdir.joinpath(name + queue_ext_result)
+    tmp_path = qdir.joinpath(name + '.result.tmp')
+    tmp_path.write_bytes(json.dumps(result).encode('utf-8'))
+    tmp_path.rename(result_path)
+    qdir.joinpath(name + queue_ext_entry).unlink(missing_ok=True)
+
+
+def is_committed(rootdir, idx, protoblocks):
+    """Check whether protoblocks are already in the blockchain, as the
+    blocks starting at idx.
+    """
+    for i, protoblock in enumerate(protoblocks):
+        if not rootdir.joinpath(blockfilename(idx + i, block_ext_sig)).exists():
+            return False
+        block = load_block(rootdir, idx + i)
+        if any(map(lambda key: block.get(key) != protoblock[key], protoblock.keys())):
+            return False
+    return True
+
+
+def append_groups(gpg_ctx, v, qdir, groups):
+    """Append the groups to the blockchain and write their results. The
+    groups are written to the journal first, so that if we crash after the
+    blocks are written, recover_journal can tell that they were.
+    """
+    idx = v.nextidx
+    journal = []
+    for g in groups:
+        journal.append({'names': g['names'], 'idx': idx, 'protoblocks': g['protoblocks']})
+        idx += len(g['protoblocks'])
+    tmp_path = qdir.joinpath(journal_filename.name + '.tmp')
+    tmp_path.write_bytes(json.dumps(journal).encode('utf-8'))
+    tmp_path.rename(qdir.joinpath(journal_filename))
+    v.append_blocks(gpg_ctx, list(itertools.chain.from_iterable(
+        map(lambda g: g['protoblocks'], groups))))
+    recover_journal(qdir, v.rootdir)
+
+
+def recover_journal(qdir, rootdir):
+    """Write the results of the groups in the journal that made it into the
+    blockchain, and remove the journal. Entries whose blocks aren't there
+    stay in the queue, and are appended again.
+    """
+    journal_path = qdir.joinpath(journal_filename)
+    if not journal_path.exists():
+        return
+    for g in json.loads(journal_path.read_bytes()):
+        if is_committed(rootdir, g['idx'], g['protoblocks']):
+            result = {'idx': list(range(g['idx'], g['idx'] + len(g['protoblocks'])))}
+            for name in g['names']:
+                # If the entry is gone, its result has already been read.
+                if qdir.joinpath(name + queue_ext_entry).exists():
+                    write_result(qdir, name, result)
+    journal_path.unlink()
+
+
+def commit_pending(gpg_ctx, rootdir):
+    """Append everything in the queue to the blockchain. Must be called
+    with the repo lock held. A result file is written for every entry.
+    """
+    qdir = queue_dir(rootdir)
+    recover_journal(qdir, rootdir)
+    entries = []
+    for path in sorted(qdir.glob('*' + queue_ext_entry)):
+        name = path.name[:-len(queue_ext_entry)]
+        if qdir.joinpath(name + queue_ext_result).exists():
+            # We crashed after writing the result.
+            path.unlink()
+            continue
+        entries.append((name, json.loads(path.read_bytes())))
+    if len(entries) == 0:
+        return
+    try:
+        # Fast path: verify the chain once and append all the groups.
+        v = verify_chain(rootdir)
+        append_groups(gpg_ctx, v, qdir, group_entries(entries))
+    except Exception:
+        # One of the submissions is bad. Append them one at a time, so that
+        # only the bad ones fail. append_blocks doesn't write anything
+        # unless every protoblock passes, so the chain is still intact, and
+        # the chain only has to be verified again after a failure.
+        recover_journal(qdir, rootdir)
+        v = verify_chain(rootdir)
+        for name, entry_protoblocks in entries:
+            if not qdir.joinpath(name + queue_ext_entry).exists():
+                continue
+            if v.stale:
+                v = verify_chain(rootdir)
+            try:
+                append_groups(gpg_ctx, v, qdir, [{'names': [name],
+                                                  'protoblocks': entry_protoblocks}])
+            except Exception as e:
+                recover_journal(qdir, rootdir)
+                if qdir.joinpath(name + queue_ext_entry).exists():
+                    write_result(qdir, name, {'error': str(e)})
+
+
+def submit_protoblocks(gpg_ctx, rootdir, protoblocks):
+    """Queue protoblocks for the blockchain in rootdir and wait until they
+    have been appended. Concurrent submissions are coalesced: whichever
+    process gets the lock first appends everything in the queue, merging
+    simple protoblocks into a single block. Returns the indices of the
+    blocks that contain the submitted actions.
+    """
+    qdir = queue_dir(rootdir)
+    qdir.mkdir(parents=True, exist_ok=True)
+    # Names sort in submission order.
+    name = f'{time.time_ns():020}-{os.getpid()}-{secrets.token_hex(4)}'
+    tmp_path = qdir.joinpath(name + '.tmp')
+    tmp_path.write_bytes(json.dumps(protoblocks).encode('utf-8'))
+    tmp_path.rename(qdir.joinpath(name + queue_ext_entry))
+    result_path = qdir.joinpath(name + queue_ext_result)
+    with repo_lock(rootdir):
+        if not result_path.exists():
+            commit_pending(gpg_ctx, rootdir)
+    result = json.loads(result_path.read_bytes())
+    result_path.unlink()
+    if 'error' in result:
+        raise Exception('submit_protoblocks: ' + result['error'])
+    return result['idx']
+
+
+def submit_protoblock(gpg_ctx, rootdir, protoblock):
+    """Like submit_protoblocks, but for a single protoblock. Returns the
+    index of the block that contains its actions.
+    """
+    return submit_protoblocks(gpg_ctx, rootdir, [protoblock])[0]
@@ -23,6 +23,18 @@ from .verifier import verify_chain
 from .add_smart_contract import add_smart_contract
 
 
+def ignore_local_state(rootdir):
+    """Add the machine-local state directory to .gitignore."""
+    gitignore_path = rootdir.joinpath('.gitignore')
+    entry = '/' + local_state_dirname.as_posix() + '/'
+    lines = []
+    if gitignore_path.exists():
+        lines = gitignore_path.read_text().splitlines()
+    if not entry in lines:
+        lines.append(entry)
+        gitignore_path.write_text('\n'.join(lines) + '\n')
+
+
 def initialize_blockchain(gpg_ctx, rootdir):
     """Initialize a pyom directory with a blockchain. gpg_ctx should be ~/.gnupg"""
     for x in iter_dir_recursive(rootdir.joinpath(blockchain_dirname)):
@@ -30,6 +42,7 @@ def initialize_blockchain(gpg_ctx, rootdir):
     result = subprocess.run(
         ['git', '-C', rootdir.as_posix(), 'init'], capture_output=True)
     result.check_returncode()
+    ignore_local_state(rootdir)
     fpr = export_block0_pubkey(gpg_ctx, rootdir)
     create_block0(gpg_ctx, rootdir, fpr)
     init_local_gpg(rootdir.joinpath(gnupg_dirname))
@@ -39,4 +52,5 @@ def initialize_blockchain(gpg_ctx, rootdir):
 
 
 if __name__ == "__main__":
+    profile_from_argv()
     initialize_blockchain(gpg.Context(), pathlib.Path.cwd())
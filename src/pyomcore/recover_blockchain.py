@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcore.
+#
+# pyomcore is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcore is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcore. If not, see <https://www.gnu.org/licenses/>.
+
+import shutil
+import sys
+from .utils import *
+
+
+def is_stale_tmp_file(rootdir, filename):
+    """Check whether filename is a temporary block file, like
+    blockchain/.../000000000000abcd.json.tmp, which older versions of
+    import_bundle left next to the block if they were interrupted.
+    """
+    if not filename.name.endswith('.tmp'):
+        return False
+    name = filename.name[:-len('.tmp')]
+    try:
+        idx = int(name[:16], 16)
+    except ValueError:
+        return False
+    ext = name[16:]
+    if not ext in [block_ext_json, block_ext_ref, block_ext_sig]:
+        return False
+    return filename == rootdir.joinpath(blockfilename(idx, ext)).with_name(filename.name)
+
+
+def recover_blockchain_dir(rootdir):
+    """Roll back the damage from a crash while blocks were being written.
+    write_block_files renames the files of each block into place in order,
+    so the only thing a crash can leave behind is an incomplete triple of
+    files at the end of the chain. Those files are deleted, along with any
+    leftover temporary files, in .pyom/tmp or next to the blocks. Anything else that is wrong with the
+    blockchain directory wasn't caused by a crash, so it's an error.
+    Returns the list of deleted files.
+    """
+    removed = []
+    tail = []
+    n = 0
+    for filename in iter_dir_recursive(rootdir.joinpath(blockchain_dirname)):
+        if is_stale_tmp_file(rootdir, filename):
+            filename.unlink()
+            removed.append(filename)
+            continue
+        idx = n // 3
+        ext = block_ext_json if n % 3 == 0 else (
+            block_ext_ref if n % 3 == 1 else block_ext_sig)
+        expected = rootdir.joinpath(blockfilename(idx, ext))
+        if filename != expected:
+            raise Exception('recover_blockchain_dir: unexpected file in blockchain dir: ' +
+                            filename.as_posix() + ' expected: ' + expected.as_posix())
+        tail = [] if n % 3 == 0 else tail
+        tail.append(filename)
+        n += 1
+    if n % 3 != 0:
+        for filename in tail:
+            filename.unlink()
+            removed.append(filename)
+    tmpdir = rootdir.joinpath(tmp_dirname)
+    if tmpdir.exists():
+        removed.extend(iter_dir_recursive(tmpdir))
+        shutil.rmtree(tmpdir)
+    return removed
+
+
+if __name__ == "__main__":
+    profile_from_argv()
+    if len(sys.argv) != 1:
+        print('usage: recover_blockchain', file=sys.stderr)
+        sys.exit(1)
+    # Not at the top: group_commit imports this module.
+    from .group_commit import repo_lock
+    rootdir = pathlib.Path.cwd()
+    # Without the lock, we could delete the files of a block that another
+    # process is still writing.
+    with repo_lock(rootdir, recover=False):
+        for filename in recover_blockchain_dir(rootdir):
+            print('removed: ' + filename.as_posix())
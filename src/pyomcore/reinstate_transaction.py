@@ -19,22 +19,25 @@
 import sys
 from .utils import *
 from .verifier import Verifier, verify_chain
+from .group_commit import repo_lock
 
 
 def reinstate_transaction(gpg_ctx, rootdir, transaction_hash):
-    v = verify_chain(rootdir)
-    protoblock = {
-        'actions': [
-            {
-                'type': 'reinstate_transaction',
-                'transaction': {'SHA-512': transaction_hash}
-            }
-        ]
-    }
-    v.append_block(gpg_ctx, protoblock)
+    with repo_lock(rootdir):
+        v = verify_chain(rootdir)
+        protoblock = {
+            'actions': [
+                {
+                    'type': 'reinstate_transaction',
+                    'transaction': {'SHA-512': transaction_hash}
+                }
+            ]
+        }
+        v.append_block(gpg_ctx, protoblock)
 
 
 if __name__ == "__main__":
+    profile_from_argv()
     if len(sys.argv) != 2:
         print('usage: reinstate_transaction transaction_hash', file=sys.stderr)
         sys.exit(1)
@@ -19,23 +19,26 @@
 import sys
 from .utils import *
 from .verifier import Verifier, verify_chain
+from .group_commit import repo_lock
 
 
 def remove_extra_connection(gpg_ctx, this_rootdir, that_rootdir):
-    this_v = verify_chain(this_rootdir)
-    that_v = verify_chain(that_rootdir)
-    protoblock = {
-        'actions': [
-            {
-                'type': 'remove_extra_connection',
-                'gpg': that_v.fpr,
-            }
-        ]
-    }
-    this_v.append_block(gpg_ctx, protoblock)
+    with repo_lock(this_rootdir):
+        this_v = verify_chain(this_rootdir)
+        that_v = verify_chain(that_rootdir)
+        protoblock = {
+            'actions': [
+                {
+                    'type': 'remove_extra_connection',
+                    'gpg': that_v.fpr,
+                }
+            ]
+        }
+        this_v.append_block(gpg_ctx, protoblock)
 
 
 if __name__ == "__main__":
+    profile_from_argv()
     if len(sys.argv) != 2:
         print('usage: remove_extra_connection path/to/other/pyom', file=sys.stderr)
         sys.exit(1)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcore.
+#
+# pyomcore is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcore is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcore. If not, see <https://www.gnu.org/licenses/>.
+
+import sys
+from .utils import *
+from .verifier import verify_chain
+from .group_commit import repo_lock
+
+# A PYOMer's identity is the key in public.key, which is fixed by block 0.
+# rotate_key switches the key that signs their blocks to a new one, for
+# example from rsa4096 to ed25519, which is much faster to verify. The
+# rotate_key action links to the new public key and to a statement that
+# names the owner, both keys, and the block idx, signed by both keys. The
+# block with the action is signed by the old key, and the blocks after it
+# by the new key. Blockrefs still have the owner's fpr in them.
+#
+# The evidence doesn't depend on the rest of the blockchain, so other
+# PYOMers copy it into their own blockchains, with import_key_rotation
+# actions, before they check blocks that were signed by the new key.
+
+
+def create_rotate_key_action(gpg_ctx, v, new_fpr):
+    """The rotate_key action for the next block of v's blockchain. Writes
+    the new public key and the signed statement into v's directory.
+    """
+    old_fpr = v.signer_fpr
+    # Export the key like public.key, without changing the caller's context.
+    armor = gpg_ctx.armor
+    gpg_ctx.armor = True
+    try:
+        key_content = gpg_ctx.key_export(pattern=new_fpr)
+    finally:
+        gpg_ctx.armor = armor
+    if not key_content:
+        raise Exception('rotate_key: key not found: ' + new_fpr)
+    statement_content = json.dumps({
+        'pyom_version': pyom_version_number,
+        'pyom_key_rotation_magic': pyom_key_rotation_magic,
+        'owner': v.fpr,
+        'old_gpg': old_fpr,
+        'new_gpg': new_fpr,
+        'idx': v.nextidx
+    }, indent=2).encode('utf-8')
+    with signing_key(gpg_ctx, new_fpr):
+        new_sig_content = sign_blockref(gpg_ctx, new_fpr, statement_content)
+    with signing_key(gpg_ctx, old_fpr):
+        old_sig_content = sign_blockref(gpg_ctx, old_fpr, statement_content)
+    dirname = mk_unique_path(key_rotations_dirname)
+    v.rootdir.joinpath(dirname).mkdir(parents=True, exist_ok=False)
+    action = {'type': 'rotate_key', 'gpg': new_fpr}
+    for name, filename, content in [
+            ('keyfile', 'public.key', key_content),
+            ('statement', 'statement.json', statement_content),
+            ('old_sig', 'statement.json.old.sig', old_sig_content),
+            ('new_sig', 'statement.json.new.sig', new_sig_content)]:
+        path = dirname.joinpath(filename)
+        v.rootdir.joinpath(path).write_bytes(content)
+        action[name] = create_fileref_from_content(0, path, content)
+    return action
+
+
+def rotate_key(gpg_ctx, rootdir, new_fpr):
+    """Switch rootdir's blockchain to new_fpr's key, from the next block
+    on. gpg_ctx should be ~/.gnupg, with the secret keys of both the
+    current key and the new one. Returns the new block.
+    """
+    with repo_lock(rootdir):
+        v = verify_chain(rootdir)
+        action = create_rotate_key_action(gpg_ctx, v, new_fpr)
+        return v.append_block(gpg_ctx, {'actions': [action]})
+
+
+def import_key_rotation_actions(this_v, that_v):
+    """The import_key_rotation actions that this_v's blockchain needs
+    before it can check that_v's recent blocks. The evidence is copied
+    into this_v's directory.
+    """
+    return copy_key_rotations(this_v, that_v.fpr, that_v.rotations(that_v.fpr), that_v.rootdir)
+
+
+def copy_key_rotations(this_v, fpr, rotations, that_rootdir):
+    """Like import_key_rotation_actions, for fpr's rotations, whose
+    filerefs are relative to that_rootdir.
+    """
+    actions = []
+    known = len(this_v.rotations(fpr))
+    for rotation in rotations[known:]:
+        dirname = key_rotations_dirname.joinpath(fpr, str(rotation['idx']))
+        this_v.rootdir.joinpath(dirname).mkdir(parents=True, exist_ok=True)
+        action = {'type': 'import_key_rotation', 'gpg': rotation['gpg']}
+        for name in ['keyfile', 'statement', 'old_sig', 'new_sig']:
+            content = load_fileref(
+                [that_rootdir], rotation[name], this_v.limits.max_fileref_size)
+            path = dirname.joinpath(
+                pathlib.PurePath(rotation[name]['filename']).name)
+            this_v.rootdir.joinpath(path).write_bytes(content)
+            action[name] = create_fileref_from_content(0, path, content)
+        actions.append(action)
+    return actions
+
+
+if __name__ == "__main__":
+    profile_from_argv()
+    if len(sys.argv) != 2:
+        print('usage: rotate_key <fingerprint of the new key>', file=sys.stderr)
+        sys.exit(1)
+    block = rotate_key(gpg.Context(), pathlib.Path.cwd(), sys.argv[1])
+    print('blocks after ' + str(block['idx']) +
+          ' are signed by ' + sys.argv[1])
@@ -25,10 +25,17 @@ from .confirm_transactions import confirm_transactions
 # signs if you're the last participant and can confirm instantly. sign_transactions.py
 # signs even if you're not the last participant to sign.
 if __name__ == "__main__":
+    profile_from_argv()
     if len(sys.argv) != 2:
         print('usage: confirm_transactions path/to/other/pyom_repo', file=sys.stderr)
         sys.exit(1)
+    from .daemon import daemon_serves, daemon_request
     rootdir = pathlib.Path.cwd()
-    gpg_ctx = gpg.Context()
-    confirm_transactions(gpg_ctx, rootdir, pathlib.Path(
-        sys.argv[1]).resolve(), confirm_only=False)
+    that_rootdir = pathlib.Path(sys.argv[1]).resolve()
+    if daemon_serves(rootdir):
+        daemon_request(rootdir, {'op': 'confirm', 'rootdir': rootdir.as_posix(),
+                                 'that_rootdir': that_rootdir.as_posix(), 'confirm_only': False})
+    else:
+        gpg_ctx = gpg.Context()
+        confirm_transactions(
+            gpg_ctx, rootdir, that_rootdir, confirm_only=False)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcore.
+#
+# pyomcore is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcore is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcore. If not, see <https://www.gnu.org/licenses/>.
+
+import sys
+from .utils import *
+from .verifier import Verifier, check_blockref_sig, check_key_rotation, is_signed_by, verify_chain
+from .group_commit import repo_lock
+
+# A state digest is a summary of the state of a blockchain after its most
+# recent block: the transaction states, the bans, the extra connections,
+# and the owner's key rotations. The owner signs it, like a blockref, and publishes it in
+# the repo next to the blockchain. Other PYOMers can look things up in it
+# without replaying the blockchain. The digest is only as trustworthy as
+# its owner, but it's signed, so a false digest is evidence against them,
+# and audit_state_digest can check it at any time.
+
+
+def build_state_digest(v):
+    """The state digest for the blocks that v has verified."""
+    idx = v.nextidx - 1
+    blockref = parse_json(read_file(
+        v.rootdir.joinpath(blockfilename(idx, block_ext_ref))))
+    transactions = {}
+    for transaction_hash, transaction_status in v.transactions.items():
+        transactions[transaction_hash] = {
+            'state': transaction_status.state.name,
+            'block_idx': transaction_status.block_idx,
+            'pending_participants': sorted(transaction_status.pending_participants)
+        }
+    extra_connections = {}
+    for fpr, that_blockref in v.extra_connections.items():
+        extra_connections[fpr] = {
+            'idx': that_blockref['idx'],
+            'SHA-512': that_blockref['SHA-512']
+        }
+    return {
+        'pyom_version': pyom_version_number,
+        'pyom_state_digest_magic': pyom_state_digest_magic,
+        'gpg': v.fpr,
+        'head': {'idx': idx, 'SHA-512': blockref['SHA-512']},
+        'transactions': transactions,
+        'banned': sorted(v.banned),
+        'extra_connections': extra_connections,
+        'key_rotations': v.rotations(v.fpr)
+    }
+
+
+def state_digest_content(digest):
+    """The same digest always has the same encoding."""
+    return json.dumps(digest, indent=2, sort_keys=True).encode('utf-8')
+
+
+def write_state_digest(gpg_ctx, rootdir):
+    """Verify the blockchain and write a signed state digest for it.
+    gpg_ctx should be ~/.gnupg. Returns the digest.
+    """
+    with repo_lock(rootdir):
+        v = verify_chain(rootdir)
+        digest = build_state_digest(v)
+        content = state_digest_content(digest)
+        with signing_key(gpg_ctx, v.signer_fpr) if v.signer_fpr != v.fpr else contextlib.nullcontext():
+            sig_content = sign_blockref(gpg_ctx, v.signer_fpr, content)
+        for filename, data in [(state_digest_filename, content), (state_digest_sig_filename, sig_content)]:
+            path = rootdir.joinpath(filename)
+            tmp_path = path.with_name(path.name + '.tmp')
+            tmp_path.write_bytes(data)
+            tmp_path.rename(path)
+        return digest
+
+
+def read_state_digest(rootdir, allow_stale=False):
+    """Read the state digest of the blockchain in rootdir, and check its
+    signature, and that its head matches the signed blockref at that
+    index. Unless allow_stale is True, the head must also be the most
+    recent block. Returns the digest.
+    """
+    content = read_file(rootdir.joinpath(state_digest_filename))
+    sig_content = read_file(rootdir.joinpath(state_digest_sig_filename))
+    gpg_ctx = init_local_gpg(rootdir.joinpath(gnupg_dirname))
+    fpr = import_key(gpg_ctx, read_file(
+        rootdir.joinpath(block0_pubkey_filename)))
+    digest = parse_json(content)
+    # The key rotations are checked before the signature, because the
+    # digest is signed by the most recent key.
+    rotations = digest.get('key_rotations', [])
+    signer = fpr
+    for rotation in rotations:
+        statement = check_key_rotation(
+            gpg_ctx, [rootdir], rotation, fpr, signer)
+        if statement['idx'] != rotation['idx']:
+            raise Exception('key rotation doesn\'t match state digest')
+        signer = rotation['gpg']
+    if not is_signed_by(gpg_ctx, signer, content, sig_content):
+        raise Exception('state digest has bad signature')
+    if digest['pyom_version'] != pyom_version_number:
+        raise Exception('bad pyom version in state digest')
+    if digest['pyom_state_digest_magic'] != pyom_state_digest_magic:
+        raise Exception('bad pyom_state_digest_magic')
+    if digest['gpg'] != fpr:
+        raise Exception('fpr mismatch in state digest')
+    idx = digest['head']['idx']
+    if not allow_stale and idx != most_recent_block_idx(rootdir):
+        raise Exception('state digest is out of date: block ' + str(idx) +
+                        ', but the most recent block is ' + str(most_recent_block_idx(rootdir)))
+    blockref = check_blockref_sig(gpg_ctx, fpr,
+                                  read_file(rootdir.joinpath(
+                                      blockfilename(idx, block_ext_ref))),
+                                  read_file(rootdir.joinpath(
+                                      blockfilename(idx, block_ext_sig))),
+                                  rotations)
+    if blockref['idx'] != idx or blockref['SHA-512'] != digest['head']['SHA-512']:
+        raise Exception('state digest doesn\'t match block ' + str(idx))
+    return digest
+
+
+def audit_state_digest(rootdir, digest):
+    """Replay the blockchain up to the digest's head, and check that the
+    digest is correct.
+    """
+    gpg_ctx = init_local_gpg(rootdir.joinpath(gnupg_dirname))
+    v = Verifier(rootdir, gpg_ctx)
+    v.verify_blocks(0, digest['head']['idx'] + 1)
+    if state_digest_content(build_state_digest(v)) != state_digest_content(digest):
+        raise Exception('state digest doesn\'t match the blockchain')
+
+
+if __name__ == "__main__":
+    profile_from_argv()
+    if not (2 <= len(sys.argv) <= 3) or not sys.argv[1] in ['write', 'check', 'audit']:
+        print('usage: state_digest write|check|audit [path/to/pyom_repo]', file=sys.stderr)
+        sys.exit(1)
+    rootdir = pathlib.Path(sys.argv[2]).resolve(
+    ) if len(sys.argv) == 3 else pathlib.Path.cwd()
+    if sys.argv[1] == 'write':
+        digest = write_state_digest(gpg.Context(), rootdir)
+    else:
+        digest = read_state_digest(rootdir)
+        if sys.argv[1] == 'audit':
+            audit_state_digest(rootdir, digest)
+    print('state digest: block ' + str(digest['head']['idx']) + ', ' +
+          str(len(digest['transactions'])) + ' transactions, ' +
+          str(len(digest['banned'])) + ' banned')
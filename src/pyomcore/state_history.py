@@ -0,0 +1,220 @@
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcore.
+#
+# pyomcore is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcore is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcore. If not, see <https://www.gnu.org/licenses/>.
+
+import collections.abc
+import copy
+import sqlite3
+from .utils import *
+from .verifier import TransactionStatus
+
+# Pass a StateHistory to Verifier (or verify_chain) to be able to ask
+# what the state was after any block, without replaying the blockchain.
+# For every block, the history records the entries of the Verifier's
+# tables that the block changed. Every snapshot_interval blocks it also
+# saves a copy of the whole state. The state after block idx is rebuilt
+# from the most recent snapshot and the deltas since then. The snapshots
+# are kept in a sqlite database, like the StateStore, so that memory only
+# grows with the number of changes, not with the number of snapshots
+# times the size of the state.
+
+# The tables of the Verifier's state.
+state_tables = ('known_gpg_keys', 'transactions',
+                'banned', 'extra_connections', 'key_rotations')
+
+
+class RecordingDict(collections.abc.MutableMapping):
+    """Wraps one of the Verifier's tables and records every change in
+    the current delta. None means the entry was deleted.
+    """
+
+    def __init__(self, table, delta):
+        self.table = table
+        self.delta = delta
+
+    def __getitem__(self, key):
+        return self.table[key]
+
+    def __setitem__(self, key, value):
+        self.table[key] = value
+        # TransactionStatus objects are modified in place, so keep a copy.
+        self.delta[key] = copy.copy(value)
+
+    def __delitem__(self, key):
+        del self.table[key]
+        self.delta[key] = None
+
+    def __contains__(self, key):
+        return key in self.table
+
+    def __iter__(self):
+        return iter(self.table)
+
+    def __len__(self):
+        return len(self.table)
+
+    def items(self):
+        return self.table.items()
+
+
+class State(object):
+    """The state of a blockchain after a block. Has the same tables as
+    the Verifier, as plain dicts. They must not be modified.
+    """
+
+    def __init__(self, idx, tables):
+        self.idx = idx
+        for name in state_tables:
+            setattr(self, name, tables[name])
+
+    def is_banned(self, fpr):
+        return (fpr in self.banned)
+
+
+def encode_value(name, value):
+    if name == 'transactions':
+        value = value.to_json()
+    return json.dumps(value)
+
+
+def decode_value(name, content):
+    value = json.loads(content)
+    if name == 'transactions':
+        value = TransactionStatus.from_json(value)
+    return value
+
+
+class StateHistory(object):
+    """path is the database file for the snapshots. The default is a
+    temporary file.
+    """
+
+    def __init__(self, snapshot_interval=1000, path=''):
+        if snapshot_interval < 1:
+            raise Exception('snapshot_interval must be at least 1')
+        self.snapshot_interval = snapshot_interval
+        self.tables = None
+        self.pending = dict(map(lambda name: (name, {}), state_tables))
+        # deltas[idx] maps table name to {key: value}, for the tables
+        # that block idx changed.
+        self.deltas = []
+        # Snapshot i is the state after block (i + 1) * snapshot_interval - 1.
+        self.numsnapshots = 0
+        self.db = sqlite3.connect(path)
+        # Like the StateStore, the database can be rebuilt from the
+        # blockchain, so it doesn't need to survive a crash.
+        self.db.execute('PRAGMA synchronous = OFF')
+        self.db.execute('PRAGMA journal_mode = OFF')
+        self.db.execute('CREATE TABLE IF NOT EXISTS snapshots (snapshot INTEGER NOT NULL, ' +
+                        'name TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, ' +
+                        'PRIMARY KEY (snapshot, name, key))')
+
+    def attach(self, verifier):
+        """Called by the Verifier, before it modifies its state."""
+        if self.tables is not None:
+            raise Exception('StateHistory is already attached to a Verifier')
+        self.tables = {}
+        for name in state_tables:
+            self.tables[name] = getattr(verifier, name)
+            setattr(verifier, name, RecordingDict(
+                self.tables[name], self.pending[name]))
+
+    def end_block(self, idx):
+        """Called by the Verifier after it has verified block idx."""
+        if idx != len(self.deltas):
+            raise Exception('StateHistory: unexpected idx')
+        delta = {}
+        for name in state_tables:
+            if len(self.pending[name]) > 0:
+                delta[name] = dict(self.pending[name])
+                self.pending[name].clear()
+        self.deltas.append(delta)
+        if len(self.deltas) % self.snapshot_interval == 0:
+            self.save_snapshot()
+
+    def save_snapshot(self):
+        snapshot = self.numsnapshots
+        for name in state_tables:
+            self.db.executemany('INSERT INTO snapshots (snapshot, name, key, value) VALUES (?, ?, ?, ?)',
+                                map(lambda item: (snapshot, name, item[0], encode_value(name, item[1])),
+                                    self.tables[name].items()))
+        self.db.commit()
+        self.numsnapshots += 1
+
+    def close(self):
+        self.db.close()
+
+    def numblocks(self):
+        return len(self.deltas)
+
+    def check_idx(self, idx):
+        if not (0 <= idx < len(self.deltas)):
+            raise Exception('StateHistory: no state for block ' + str(idx))
+
+    def table_at(self, name, idx):
+        """One of the tables, as it was after block idx."""
+        self.check_idx(idx)
+        start = (idx + 1) // self.snapshot_interval
+        table = {}
+        if start > 0:
+            for key, content in self.db.execute('SELECT key, value FROM snapshots ' +
+                                                'WHERE snapshot = ? AND name = ? ORDER BY rowid',
+                                                (start - 1, name)):
+                table[key] = decode_value(name, content)
+        for delta in self.deltas[start * self.snapshot_interval: idx + 1]:
+            for key, value in delta.get(name, {}).items():
+                if value is None:
+                    del table[key]
+                else:
+                    table[key] = value
+        return table
+
+    def value_at(self, name, key, idx):
+        """One entry of a table, as it was after block idx. Returns None
+        if it didn't exist. Only looks back as far as the most recent
+        snapshot.
+        """
+        self.check_idx(idx)
+        start = (idx + 1) // self.snapshot_interval
+        for delta in reversed(self.deltas[start * self.snapshot_interval: idx + 1]):
+            changes = delta.get(name, {})
+            if key in changes:
+                return changes[key]
+        if start > 0:
+            row = self.db.execute('SELECT value FROM snapshots WHERE snapshot = ? AND name = ? AND key = ?',
+                                  (start - 1, name, key)).fetchone()
+            if row is not None:
+                return decode_value(name, row[0])
+        return None
+
+    def state_at(self, idx):
+        """The whole state, as it was after block idx."""
+        return State(idx, dict(map(lambda name: (name, self.table_at(name, idx)), state_tables)))
+
+    def transaction_at(self, transaction_hash, idx):
+        """The TransactionStatus after block idx, or None."""
+        return self.value_at('transactions', transaction_hash, idx)
+
+    def banned_at(self, idx):
+        """The ban actions in effect after block idx, indexed by fpr."""
+        return self.table_at('banned', idx)
+
+    def extra_connections_at(self, idx):
+        return self.table_at('extra_connections', idx)
+
+    def changes(self, idx):
+        """The entries that block idx changed, by table name."""
+        self.check_idx(idx)
+        return self.deltas[idx]
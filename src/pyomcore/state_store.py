@@ -0,0 +1,171 @@
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcore.
+#
+# pyomcore is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcore is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcore. If not, see <https://www.gnu.org/licenses/>.
+
+import collections
+import collections.abc
+import sqlite3
+from .utils import *
+from .verifier import TransactionStatus
+
+# A place for the Verifier to keep its state when a blockchain has too
+# many transactions to hold in memory. The state is kept in a sqlite
+# database. By default it's a temporary database that is deleted when
+# the StateStore is closed.
+
+
+class JsonTable(collections.abc.MutableMapping):
+    """A dict from str to JSON values, stored in a sqlite table. Values
+    are copies: modifying them doesn't change the table.
+    """
+
+    def __init__(self, db, table):
+        self.db = db
+        self.table = table
+        self.db.execute('CREATE TABLE IF NOT EXISTS ' + table +
+                        ' (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+
+    def __getitem__(self, key):
+        row = self.db.execute('SELECT value FROM ' + self.table +
+                              ' WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return json.loads(row[0])
+
+    def __setitem__(self, key, value):
+        self.db.execute('INSERT OR REPLACE INTO ' + self.table +
+                        ' (key, value) VALUES (?, ?)', (key, json.dumps(value)))
+
+    def __delitem__(self, key):
+        if self.db.execute('DELETE FROM ' + self.table + ' WHERE key = ?', (key,)).rowcount == 0:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return self.db.execute('SELECT 1 FROM ' + self.table + ' WHERE key = ?', (key,)).fetchone() is not None
+
+    def __iter__(self):
+        for row in self.db.execute('SELECT key FROM ' + self.table + ' ORDER BY rowid').fetchall():
+            yield row[0]
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM ' + self.table).fetchone()[0]
+
+
+class TransactionTable(collections.abc.MutableMapping):
+    """A dict from transaction hash to TransactionStatus. Every status is
+    written through to the database when it is assigned. Transactions that
+    can still change often (PENDING and ANNULLED) stay in memory. Only the
+    hot_size most recently used CONFIRMED and CANCELLED transactions are
+    kept in memory, the rest are loaded from the database when needed.
+    """
+
+    def __init__(self, db, hot_size):
+        self.db = db
+        self.hot_size = hot_size
+        self.active = {}
+        self.final = collections.OrderedDict()
+        self.db.execute('CREATE TABLE IF NOT EXISTS transactions ' +
+                        '(hash TEXT PRIMARY KEY, status TEXT NOT NULL)')
+
+    def cache(self, transaction_hash, transaction_status):
+        self.active.pop(transaction_hash, None)
+        self.final.pop(transaction_hash, None)
+        if transaction_status.is_final():
+            self.final[transaction_hash] = transaction_status
+            while len(self.final) > self.hot_size:
+                # Already in the database, so it can just be dropped.
+                self.final.popitem(last=False)
+        else:
+            self.active[transaction_hash] = transaction_status
+
+    def lookup(self, transaction_hash):
+        if transaction_hash in self.active:
+            return self.active[transaction_hash]
+        if transaction_hash in self.final:
+            self.final.move_to_end(transaction_hash)
+            return self.final[transaction_hash]
+        return None
+
+    def __getitem__(self, transaction_hash):
+        transaction_status = self.lookup(transaction_hash)
+        if transaction_status is not None:
+            return transaction_status
+        row = self.db.execute('SELECT status FROM transactions WHERE hash = ?',
+                              (transaction_hash,)).fetchone()
+        if row is None:
+            raise KeyError(transaction_hash)
+        transaction_status = TransactionStatus.from_json(json.loads(row[0]))
+        self.cache(transaction_hash, transaction_status)
+        return transaction_status
+
+    def __setitem__(self, transaction_hash, transaction_status):
+        self.db.execute('INSERT OR REPLACE INTO transactions (hash, status) VALUES (?, ?)',
+                        (transaction_hash, json.dumps(transaction_status.to_json())))
+        self.cache(transaction_hash, transaction_status)
+
+    def __delitem__(self, transaction_hash):
+        self.active.pop(transaction_hash, None)
+        self.final.pop(transaction_hash, None)
+        if self.db.execute('DELETE FROM transactions WHERE hash = ?', (transaction_hash,)).rowcount == 0:
+            raise KeyError(transaction_hash)
+
+    def __contains__(self, transaction_hash):
+        if self.lookup(transaction_hash) is not None:
+            return True
+        return self.db.execute('SELECT 1 FROM transactions WHERE hash = ?',
+                               (transaction_hash,)).fetchone() is not None
+
+    def __iter__(self):
+        for row in self.db.execute('SELECT hash FROM transactions ORDER BY rowid'):
+            yield row[0]
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM transactions').fetchone()[0]
+
+    def items(self):
+        """Stream the transactions without filling up the cache."""
+        cursor = self.db.execute(
+            'SELECT hash, status FROM transactions ORDER BY rowid')
+        while True:
+            rows = cursor.fetchmany(1000)
+            if len(rows) == 0:
+                break
+            for transaction_hash, status in rows:
+                transaction_status = self.lookup(transaction_hash)
+                if transaction_status is None:
+                    transaction_status = TransactionStatus.from_json(
+                        json.loads(status))
+                yield transaction_hash, transaction_status
+
+
+class StateStore(object):
+    """Pass to Verifier (or verify_chain) to keep the state in sqlite.
+    path is the database file. The default is a temporary file.
+    """
+
+    def __init__(self, path='', hot_size=10000):
+        self.db = sqlite3.connect(path)
+        # The database is a cache of the blockchain, so it doesn't need to
+        # survive a crash.
+        self.db.execute('PRAGMA synchronous = OFF')
+        self.db.execute('PRAGMA journal_mode = OFF')
+        self.transactions = TransactionTable(self.db, hot_size)
+        self.banned = JsonTable(self.db, 'banned')
+        self.known_gpg_keys = JsonTable(self.db, 'known_gpg_keys')
+        self.extra_connections = JsonTable(self.db, 'extra_connections')
+        self.key_rotations = JsonTable(self.db, 'key_rotations')
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcore.
+#
+# pyomcore is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcore is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcore. If not, see <https://www.gnu.org/licenses/>.
+
+import sys
+from .utils import *
+from .verifier import Verifier, verify_chain
+
+asyncio = lazy_import('asyncio')
+
+# Mirrors of the other PYOMers' repos are kept in a directory named after
+# their gpg fingerprint, inside mirrordir. The mirrors are read-only
+# copies: every sync resets them to whatever the remote has, so don't
+# use them for trading. The head block index of every mirror at the end
+# of the last sync is recorded in sync_state_filename.
+sync_state_filename = pathlib.PurePath('sync_state.json')
+
+
+def remote_url_order(remotes):
+    """Try 'origin' first, then the other remotes in alphabetical order."""
+    names = sorted(remotes.keys(), key=lambda name: (name != 'origin', name))
+    return list(map(lambda name: remotes[name], names))
+
+
+def mirror_head_idx(mirror):
+    try:
+        return most_recent_block_idx(mirror)
+    except Exception:
+        # Not a PYOM blockchain (e.g. a smart contract repo), or empty.
+        return None
+
+
+async def run_git(semaphore, *args):
+    async with semaphore:
+        count_resource('git_subprocess')
+        proc = await asyncio.create_subprocess_exec(
+            'git', *args, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE)
+        _, stderr = await proc.communicate()
+    if proc.returncode != 0:
+        raise Exception('git ' + ' '.join(args) + ': ' + stderr.decode().strip())
+
+
+async def sync_one(semaphore, mirror, remotes):
+    """Clone or update one mirror. Returns None on success, or an error message."""
+    errors = []
+    for url in remote_url_order(remotes):
+        # The urls come from other PYOMers' blockchains. One that starts
+        # with '-' would be an option, like --upload-pack=command.
+        if url.startswith('-'):
+            errors.append('bad git remote url: ' + url)
+            continue
+        try:
+            if mirror.joinpath('.git').exists():
+                await run_git(semaphore, '-C', mirror.as_posix(), 'fetch', '--quiet', '--', url, 'HEAD')
+                await run_git(semaphore, '-C', mirror.as_posix(), 'reset', '--quiet', '--hard', 'FETCH_HEAD')
+            else:
+                await run_git(semaphore, 'clone', '--quiet', '--', url, mirror.as_posix())
+            return None
+        except Exception as e:
+            errors.append(str(e))
+    if len(errors) == 0:
+        return 'no git_remote_urls'
+    return '\n'.join(errors)
+
+
+async def sync_all(mirrordir, known_gpg_keys, max_concurrency):
+    semaphore = asyncio.Semaphore(max_concurrency)
+    fprs = sorted(known_gpg_keys.keys())
+    errors = await asyncio.gather(*map(
+        lambda fpr: sync_one(semaphore, mirrordir.joinpath(fpr), known_gpg_keys[fpr]), fprs))
+    return dict(zip(fprs, errors))
+
+
+def sync_peers(mirrordir, known_gpg_keys, max_concurrency=16):
+    """Fetch every repo in known_gpg_keys (a dict from gpg fingerprint to
+    git_remote_urls, like Verifier.known_gpg_keys) into mirrordir, running
+    up to max_concurrency git processes at a time. Returns a dict from
+    fingerprint to a report: the head block index at the last sync and
+    now, whether there are new blocks, and an error message if the fetch
+    failed.
+    """
+    mirrordir.mkdir(parents=True, exist_ok=True)
+    state_path = mirrordir.joinpath(sync_state_filename)
+    state = {}
+    if state_path.exists():
+        state = json.loads(state_path.read_bytes())
+    errors = asyncio.run(sync_all(mirrordir, known_gpg_keys, max_concurrency))
+    report = {}
+    for fpr, error in errors.items():
+        old_head = state.get(fpr)
+        new_head = mirror_head_idx(mirrordir.joinpath(fpr))
+        report[fpr] = {
+            'old_head': old_head,
+            'new_head': new_head,
+            'new_blocks': new_head is not None and (old_head is None or new_head > old_head),
+            'error': error
+        }
+        state[fpr] = new_head
+    state_path.write_bytes(json.dumps(state, indent=2).encode('utf-8'))
+    return report
+
+
+if __name__ == "__main__":
+    profile_from_argv()
+    if len(sys.argv) != 2:
+        print('usage: sync_peers path/to/mirrordir', file=sys.stderr)
+        sys.exit(1)
+    rootdir = pathlib.Path.cwd()
+    v = verify_chain(rootdir)
+    known_gpg_keys = dict(
+        filter(lambda item: item[0] != v.fpr, v.known_gpg_keys.items()))
+    mirrordir = pathlib.Path(sys.argv[1]).resolve()
+    report = sync_peers(mirrordir, known_gpg_keys)
+    for fpr, r in report.items():
+        if r['error'] is not None:
+            print(fpr + ': error: ' + r['error'])
+        elif r['new_blocks']:
+            print(fpr + ': new blocks: ' + str(r['old_head']) + ' -> ' + str(r['new_head']))
+    # Look for forks in the mirrors that changed.
+    from .watch_forks import watch_forks
+    changed = sorted(filter(lambda fpr: report[fpr]['error'] is None, report.keys()))
+    for e in watch_forks(mirrordir, changed):
+        print(e['gpg'] + ': fork at block ' + str(e['idx']) +
+              ' (use watch_forks --ban to ban)')
@@ -0,0 +1,208 @@
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcore.
+#
+# pyomcore is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcore is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcore. If not, see <https://www.gnu.org/licenses/>.
+
+import atexit
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+# Spans for finding out where the time goes. Wrap interesting code in
+# "with span('name', key=value):". When tracing is off, span() returns a
+# shared object that does nothing. Every command accepts
+# "--profile out.json", which writes the spans in the Chrome trace
+# format. Open it in chrome://tracing or https://ui.perfetto.dev.
+#
+# There are also counters for the expensive operations, which are always
+# on. "--counters" prints them when the command exits. Tests can use
+# budget() to check that an operation doesn't do more work than expected.
+
+tracer = None
+
+# What the counters count.
+counter_names = (
+    'gpg_verify',      # signature verifications
+    'gpg_sign',        # signatures created
+    'gpg_key_import',  # keys imported
+    'git_subprocess',  # git processes started
+    'files_opened',    # files read
+    'bytes_read',
+    'bytes_hashed',    # bytes hashed with SHA-512
+    'json_parsed'      # JSON documents parsed
+)
+
+counters = dict.fromkeys(counter_names, 0)
+counters_lock = threading.Lock()
+
+
+def count_resource(name, n=1):
+    with counters_lock:
+        counters[name] += n
+
+
+def read_counters():
+    """A copy of the counters."""
+    with counters_lock:
+        return dict(counters)
+
+
+def reset_counters():
+    with counters_lock:
+        for name in counter_names:
+            counters[name] = 0
+
+
+@contextlib.contextmanager
+def measure():
+    """Yields a dict that is filled in with the increase in each counter
+    when the with block exits.
+    """
+    result = {}
+    before = read_counters()
+    try:
+        yield result
+    finally:
+        after = read_counters()
+        result.update(map(lambda name: (
+            name, after[name] - before[name]), counter_names))
+
+
+@contextlib.contextmanager
+def budget(**limits):
+    """Raise an exception if the with block increases any of the named
+    counters by more than the limit. For example:
+    with budget(gpg_verify=1, git_subprocess=0):
+        ...
+    """
+    for name in limits:
+        if not name in counters:
+            raise Exception('budget: unknown counter: ' + name)
+    with measure() as used:
+        yield used
+    over = sorted(filter(lambda name: used[name] > limits[name], limits))
+    if len(over) > 0:
+        raise Exception('over budget: ' + ', '.join(map(lambda name: name + '=' +
+                                                        str(used[name]) + ' (limit ' + str(limits[name]) + ')', over)))
+
+
+def print_counters(file=sys.stderr):
+    for name, value in read_counters().items():
+        print(f'{name}: {value}', file=file)
+
+
+class NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+null_span = NullSpan()
+
+
+class Span(object):
+    def __init__(self, tracer, name, cat, args):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end = time.perf_counter_ns()
+        if exc_type is not None:
+            self.args['error'] = str(exc_value)
+        self.tracer.add(self.name, self.cat, self.start, end, self.args)
+        return False
+
+
+class Tracer(object):
+    def __init__(self):
+        self.origin = time.perf_counter_ns()
+        self.pid = os.getpid()
+        # list.append is atomic, so threads don't need a lock.
+        self.events = []
+
+    def add(self, name, cat, start, end, args):
+        event = {
+            'name': name,
+            'cat': cat,
+            'ph': 'X',
+            'ts': (start - self.origin) / 1000,
+            'dur': (end - start) / 1000,
+            'pid': self.pid,
+            'tid': threading.get_ident()
+        }
+        if len(args) > 0:
+            event['args'] = args
+        self.events.append(event)
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.events,
+                      'displayTimeUnit': 'ms'}, f)
+
+
+def span(name, cat='pyom', **args):
+    if tracer is None:
+        return null_span
+    return Span(tracer, name, cat, args)
+
+
+def start_tracing():
+    global tracer
+    tracer = Tracer()
+    return tracer
+
+
+def stop_tracing(path):
+    global tracer
+    if tracer is not None:
+        tracer.write(path)
+        tracer = None
+
+
+def profile_from_argv():
+    """Called at the start of every command. If sys.argv has
+    "--profile out.json", remove it, and write a trace to out.json when
+    the command exits. If it has "--counters", remove it, and print the
+    counters when the command exits.
+    """
+    if '--counters' in sys.argv:
+        sys.argv.remove('--counters')
+        atexit.register(print_counters)
+    if not '--profile' in sys.argv:
+        return
+    i = sys.argv.index('--profile')
+    if i + 1 >= len(sys.argv):
+        print('--profile needs a filename', file=sys.stderr)
+        sys.exit(1)
+    path = os.path.abspath(sys.argv[i + 1])
+    del sys.argv[i:i + 2]
+    command = Span(start_tracing(), os.path.basename(sys.argv[0]), 'command', {
+                   'argv': sys.argv[1:]})
+    command.__enter__()
+
+    def finish():
+        command.__exit__(None, None, None)
+        stop_tracing(path)
+    atexit.register(finish)
@@ -15,15 +15,65 @@
 # along with pyomcore. If not, see <https://www.gnu.org/licenses/>.
 
 from datetime import datetime, timedelta, timezone
+from enum import Enum
+import collections
+import contextlib
 import copy
-import gpg
 import hashlib
+import importlib.util
 import itertools
 import json
+import os
 import pathlib
 import re
 import stat
-import subprocess
+import sys
+import threading
+import types
+from .tracing import span, count_resource, profile_from_argv
+from .clock import utc_now
+
+
+class MissingModule(types.ModuleType):
+    def __getattr__(self, attr):
+        raise ModuleNotFoundError(
+            'No module named ' + repr(self.__name__), name=self.__name__)
+
+
+def lazy_import(name):
+    """Import a module the first time that one of its attributes is used.
+    Commands that only read JSON don't need to pay for loading gpg.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        # Only an error if the module is actually used.
+        return MissingModule(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    parent, _, child = name.rpartition('.')
+    if parent:
+        # Like a normal import, make the module an attribute of its package.
+        setattr(sys.modules[parent], child, module)
+    return module
+
+
+def finish_lazy_import(*modules):
+    """Finish loading modules from lazy_import, if they haven't been used
+    yet. LazyLoader isn't thread safe, so call this before their first use
+    in a thread pool.
+    """
+    for module in modules:
+        getattr(module, '__spec__')
+
+
+futures = lazy_import('concurrent.futures')
+gpg = lazy_import('gpg')
+subprocess = lazy_import('subprocess')
 
 # Version number
 pyom_version_number = 1
@@ -42,6 +92,11 @@ pyom_transaction_magic = '89371ff4-8c0b-11ec-af4e-8f95f2c69a61'
 # for filerefs and check that their file hashes are correct.
 pyom_fileref_magic = '4885be82-7524-11ec-997c-f3c69ad4da31'
 
+# Included in every state digest (see state_digest.py) as a magic number.
+pyom_state_digest_magic = '39a392ce-cb49-11f1-a0c0-02fc00000001'
+# Included in every key rotation statement (see rotate_key.py).
+pyom_key_rotation_magic = '39a392ce-cb49-11f1-a0c0-02fc00000002'
+
 # Local files and directories
 block0_pubkey_filename = pathlib.PurePath('public.key')
 blockchain_dirname = pathlib.PurePath('blockchain')
@@ -50,8 +105,14 @@ confirmations_dirname = pathlib.PurePath('confirmations')
 cancellations_dirname = pathlib.PurePath('cancellations')
 extra_connections_dirname = pathlib.PurePath('extra_connections')
 banned_dirname = pathlib.PurePath('banned')
+key_rotations_dirname = pathlib.PurePath('key_rotations')
 gnupg_dirname = pathlib.PurePath('gnupg')
 smart_contracts_dirname = pathlib.PurePath('smart_contracts')
+state_digest_filename = pathlib.PurePath('state_digest.json')
+state_digest_sig_filename = pathlib.PurePath('state_digest.json.sig')
+# Machine-local state (locks, queues, caches). Not part of the blockchain
+# and shouldn't be committed to git.
+local_state_dirname = pathlib.PurePath('.pyom')
 
 # Smart contract files and directories
 smartcontract_pubkey_filename = pathlib.PurePath('public.key')
@@ -62,6 +123,34 @@ block_ext_json = '.json'
 block_ext_ref = '.ref.json'
 block_ext_sig = '.ref.json.sig'
 
+# New block files are written here first, then renamed into the blockchain
+# directory.
+tmp_dirname = local_state_dirname.joinpath('tmp')
+
+
+class FsyncPolicy(Enum):
+    """When to flush new block files to stable storage:
+    NONE   leave it to the operating system
+    BATCH  fsync every file, and each directory once per call to create_blocks
+    FILE   fsync every file and directory as soon as it is written
+    """
+    NONE = 0
+    BATCH = 1
+    FILE = 2
+
+
+def fsync_policy_from_env():
+    """The FsyncPolicy named by the PYOM_FSYNC environment variable."""
+    name = os.environ.get('PYOM_FSYNC', 'BATCH')
+    if not name in FsyncPolicy.__members__:
+        raise Exception('PYOM_FSYNC must be one of ' + ', '.join(FsyncPolicy.__members__) +
+                        ', not: ' + repr(name))
+    return FsyncPolicy[name]
+
+
+# Can be overridden with the PYOM_FSYNC environment variable.
+default_fsync_policy = fsync_policy_from_env()
+
 
 def init_local_gpg(gpgdir):
     """Create a gpg context in gpgdir (so that you can import other PYOMers gpg
@@ -73,13 +162,19 @@ def init_local_gpg(gpgdir):
     return gpg_ctx
 
 
+def git_run(repodir, args, **kwargs):
+    """Run a git command in repodir, with subprocess.run."""
+    count_resource('git_subprocess')
+    with span('git ' + args[0], 'git', repodir=repodir.as_posix(), args=args):
+        return subprocess.run(['git', '-C', repodir.as_posix()] + args, **kwargs)
+
+
 def git_repo_current_commit_id(repodir):
     """Get the current commit ID of a git repo."""
     if not repodir.is_dir():
         raise Exception(
             'git_repo_current_commit_id: not a dir: ' + repodir.as_posix())
-    result = subprocess.run(
-        ['git', '-C', repodir.as_posix(), 'rev-parse', 'HEAD'], capture_output=True)
+    result = git_run(repodir, ['rev-parse', 'HEAD'], capture_output=True)
     result.check_returncode()
     commit_id = result.stdout.decode().strip()
     # check it's a hex number
@@ -89,17 +184,15 @@ def git_repo_current_commit_id(repodir):
 
 def git_repo_remote_url(repodir, name):
     """Get url of a named remote of a git repo."""
-    args = ['git', '-C', repodir.as_posix(), 'config', '--get',
-            'remote.' + name + '.url']
-    result = subprocess.run(args, capture_output=True)
+    result = git_run(repodir, ['config', '--get',
+                               'remote.' + name + '.url'], capture_output=True)
     result.check_returncode()
     return result.stdout.decode().strip()
 
 
 def git_repo_remote_urls(repodir):
     """Get urls of the remotes of a git repo."""
-    result = subprocess.run(
-        ['git', '-C', repodir.as_posix(), 'remote'], capture_output=True)
+    result = git_run(repodir, ['remote'], capture_output=True)
     result.check_returncode()
     return dict(map(lambda name: (name, git_repo_remote_url(repodir, name)),
                     result.stdout.decode().splitlines()))
@@ -108,13 +201,13 @@ def git_repo_remote_urls(repodir):
 def git_list_signed_tags(gpg_ctx, repodir, commit_id):
     """List the signed tags for a specific commit."""
     env = {'GNUPGHOME': gpg_ctx.home_dir}
-    list_result = subprocess.run(
-        ['git', '-C', repodir.as_posix(), 'tag', '--points-at', commit_id], env=env, capture_output=True)
+    list_result = git_run(
+        repodir, ['tag', '--points-at', commit_id], env=env, capture_output=True)
     list_result.check_returncode()
     # for each tag, check if it's signed by fpr
     for tagname in list_result.stdout.decode().splitlines():
-        verify_result = subprocess.run(
-            ['git', '-C', repodir.as_posix(), 'verify-tag', '--raw', tagname], env=env, capture_output=True)
+        verify_result = git_run(
+            repodir, ['verify-tag', '--raw', tagname], env=env, capture_output=True)
         if verify_result.returncode == 0:
             for msg in verify_result.stderr.decode().splitlines():
                 m = re.fullmatch(
@@ -173,11 +266,19 @@ def create_fileref(rootdir, locidx, filename):
     """locidx is a symbolic name for the main directory that the file is
     in. It's replaced with an absolute path when the fileref is read.
     """
-    content = rootdir.joinpath(filename).read_bytes()
     return {'pyom_fileref_magic': pyom_fileref_magic,
             'locidx': locidx,
             'filename': filename.as_posix(),
-            'SHA-512': hashlib.sha512(content).hexdigest()
+            'SHA-512': sha512_file(rootdir.joinpath(filename))
+            }
+
+
+def create_fileref_from_content(locidx, filename, content):
+    """Like create_fileref, except that the file contents are already in memory."""
+    return {'pyom_fileref_magic': pyom_fileref_magic,
+            'locidx': locidx,
+            'filename': filename.as_posix(),
+            'SHA-512': sha512_hex(content)
             }
 
 
@@ -188,16 +289,152 @@ def create_pathref(locidx, filename):
             }
 
 
-def getprevhash(rootdir, idx):
+def prevfilename(idx):
+    """The file that block idx links to with its 'prev' fileref."""
     if idx == 0:
-        filename = block0_pubkey_filename
+        return block0_pubkey_filename
     else:
-        filename = blockfilename(idx-1, block_ext_json)
-    return create_fileref(rootdir, 0, filename)
+        return blockfilename(idx-1, block_ext_json)
+
+
+def getprevhash(rootdir, idx):
+    return create_fileref(rootdir, 0, prevfilename(idx))
+
+
+class Limits(object):
+    """Limits on the input from other PYOMers. The verifier checks them
+    before it does the expensive work, so that a huge block, deeply
+    nested JSON, or a giant linked file can't exhaust memory or stall it.
+    """
+
+    def __init__(self, max_block_size=4 << 20, max_json_depth=64, max_actions=10000,
+                 max_fileref_size=16 << 20, max_linked_file_size=1 << 30, max_cancel_blocks=1000):
+        # Size of each of a block's files: .json, .ref and .sig.
+        self.max_block_size = max_block_size
+        self.max_json_depth = max_json_depth
+        # Actions per block.
+        self.max_actions = max_actions
+        # Size of the files that are read into memory, like keys,
+        # transactions, and copies of other blocks.
+        self.max_fileref_size = max_fileref_size
+        # Size of the files that are only hashed, like link_file.
+        self.max_linked_file_size = max_linked_file_size
+        # Blocks of evidence in a cancel_transaction action.
+        self.max_cancel_blocks = max_cancel_blocks
+
+
+default_limits = Limits()
+
+
+def check_file_size(path, size, max_size):
+    if max_size is not None and size > max_size:
+        raise Exception('file is too large: ' + path.as_posix() + ' (' + str(size) +
+                        ' bytes, limit ' + str(max_size) + ')')
+
+
+def read_file(path, max_size=None):
+    """path.read_bytes(), counted by the counters in tracing.py. If the
+    file is larger than max_size, raise an exception without reading it.
+    """
+    with open(path, 'rb') as f:
+        if max_size is None:
+            content = f.read()
+        else:
+            check_file_size(path, os.fstat(f.fileno()).st_size, max_size)
+            # In case the file grew since the fstat.
+            content = f.read(max_size + 1)
+            check_file_size(path, len(content), max_size)
+    count_resource('files_opened')
+    count_resource('bytes_read', len(content))
+    return content
+
+
+def sha512_hex(content):
+    count_resource('bytes_hashed', len(content))
+    return hashlib.sha512(content).hexdigest()
+
+
+def parse_json(content, max_depth=None):
+    """json.loads, counted by the counters in tracing.py. If max_depth is
+    given, raise an exception if lists and dicts are nested more deeply.
+    """
+    count_resource('json_parsed')
+    try:
+        obj = json.loads(content)
+    except RecursionError:
+        raise Exception('JSON is nested too deeply')
+    if max_depth is not None:
+        check_json_depth(obj, max_depth)
+    return obj
 
 
 def load_block(rootdir, idx):
-    return json.loads(rootdir.joinpath(blockfilename(idx, block_ext_json)).read_bytes())
+    return parse_json(read_file(rootdir.joinpath(blockfilename(idx, block_ext_json))))
+
+
+# How many blocks the block iterators read ahead of the consumer.
+default_read_ahead = 4
+
+
+def read_ahead_map(fn, items, read_ahead=None):
+    """Like map(fn, items), except that fn is called in a thread pool, up to
+    read_ahead items ahead of the consumer, so that reading files overlaps
+    with processing them.
+    """
+    if read_ahead is None:
+        read_ahead = default_read_ahead
+    items = iter(items)
+    with futures.ThreadPoolExecutor(max_workers=read_ahead) as executor:
+        pending = collections.deque(map(lambda item: executor.submit(
+            fn, item), itertools.islice(items, read_ahead)))
+        try:
+            while len(pending) > 0:
+                future = pending.popleft()
+                for item in itertools.islice(items, 1):
+                    pending.append(executor.submit(fn, item))
+                yield future.result()
+        finally:
+            # The consumer stopped early.
+            for future in pending:
+                future.cancel()
+
+
+def block_range(rootdir, start, stop, reverse):
+    if stop is None:
+        stop = 1 + most_recent_block_idx(rootdir)
+    if reverse:
+        return range(stop - 1, start - 1, -1)
+    return range(start, stop)
+
+
+def iter_block_files(rootdir, start=0, stop=None, reverse=False,
+                     exts=(block_ext_json, block_ext_ref, block_ext_sig), read_ahead=None, max_size=None):
+    """Yields (idx, content, ...) for the blocks from start up to, but not
+    including, stop, with the contents of the files with extensions exts.
+    stop defaults to the end of the chain. Files larger than max_size
+    raise an exception.
+    """
+    def read(idx):
+        with span('read_block_files', 'io', idx=idx):
+            return (idx,) + tuple(map(lambda ext: read_file(rootdir.joinpath(
+                blockfilename(idx, ext)), max_size), exts))
+    return read_ahead_map(read, block_range(rootdir, start, stop, reverse), read_ahead)
+
+
+def iter_blocks(rootdir, start=0, stop=None, reverse=False, read_ahead=None):
+    """Like iter_block_files, but yields the parsed blocks."""
+    return read_ahead_map(lambda idx: load_block(rootdir, idx),
+                          block_range(rootdir, start, stop, reverse), read_ahead)
+
+
+def iter_actions(rootdir, start=0, stop=None, reverse=False, read_ahead=None):
+    """Yields (idx, action) for every action in the blocks. If reverse is
+    True, the actions in each block are also reversed.
+    """
+    for block in iter_blocks(rootdir, start, stop, reverse, read_ahead):
+        actions = block['actions']
+        for action in (reversed(actions) if reverse else actions):
+            yield block['idx'], action
 
 
 def resolve_path(location_array, fileref):
@@ -212,23 +449,97 @@ def resolve_path(location_array, fileref):
     return fullpath
 
 
-def load_fileref(location_array, fileref):
-    """A fileref is a dict containing a file path and an expected SHA-512 hash."""
+# Files are hashed in chunks of this size, so that memory use doesn't
+# depend on the size of the file.
+hash_chunk_size = 1 << 20
+
+
+def sha512_file(path):
+    """The SHA-512 of a file, as a hex string."""
+    h = hashlib.sha512()
+    buf = bytearray(hash_chunk_size)
+    view = memoryview(buf)
+    size = 0
+    with open(path, 'rb') as f:
+        while True:
+            n = f.readinto(buf)
+            if n == 0:
+                break
+            h.update(view[:n])
+            size += n
+    count_resource('files_opened')
+    count_resource('bytes_read', size)
+    count_resource('bytes_hashed', size)
+    return h.hexdigest()
+
+
+def check_fileref(location_array, fileref, max_size=None):
+    """Like load_fileref, but only checks the hash, without reading the
+    whole file into memory. Use it for files that might be large.
+    """
     if fileref['pyom_fileref_magic'] != pyom_fileref_magic:
         raise Exception('bad fileref magic number')
     fullpath = resolve_path(location_array, fileref)
-    content = fullpath.read_bytes()
-    if hashlib.sha512(content).hexdigest() != fileref['SHA-512']:
-        raise Exception('hash mismatch on fileref: ' + fullpath.as_posix())
+    if max_size is not None:
+        check_file_size(fullpath, fullpath.stat().st_size, max_size)
+    with span('check_fileref', 'hash', filename=fileref['filename']):
+        if sha512_file(fullpath) != fileref['SHA-512']:
+            raise Exception('hash mismatch on fileref: ' +
+                            fullpath.as_posix())
+
+
+# Threads for check_filerefs. hashlib releases the GIL while it hashes, so
+# several files can be hashed at once.
+hash_workers = min(8, os.cpu_count() or 1)
+hash_pool = None
+hash_pool_lock = threading.Lock()
+
+
+def check_filerefs(location_array, filerefs, max_size=None):
+    """Check the hashes of several filerefs, in parallel."""
+    with span('check_filerefs', 'hash', count=len(filerefs)):
+        check_filerefs_parallel(location_array, filerefs, max_size)
+
+
+def check_filerefs_parallel(location_array, filerefs, max_size=None):
+    global hash_pool
+    if len(filerefs) < 2 or hash_workers < 2:
+        for fileref in filerefs:
+            check_fileref(location_array, fileref, max_size)
+        return
+    with hash_pool_lock:
+        if hash_pool is None:
+            hash_pool = futures.ThreadPoolExecutor(max_workers=hash_workers)
+    # list() to wait for all of them and raise the first exception.
+    list(hash_pool.map(lambda fileref: check_fileref(
+        location_array, fileref, max_size), filerefs))
+
+
+def load_fileref(location_array, fileref, max_size=None):
+    """A fileref is a dict containing a file path and an expected SHA-512
+    hash. Files larger than max_size raise an exception.
+    """
+    if fileref['pyom_fileref_magic'] != pyom_fileref_magic:
+        raise Exception('bad fileref magic number')
+    fullpath = resolve_path(location_array, fileref)
+    with span('load_fileref', 'io', filename=fileref['filename']):
+        content = read_file(fullpath, max_size)
+        with span('sha512', 'hash', size=len(content)):
+            if sha512_hex(content) != fileref['SHA-512']:
+                raise Exception('hash mismatch on fileref: ' +
+                                fullpath.as_posix())
     return content
 
 
-def create_block(gpg_ctx, rootdir, idx, fpr, protoblock, timestamp=None):
-    """Add standard fields like 'idx' and 'prev', then write file and sign it."""
+def build_block(rootdir, idx, fpr, protoblock, timestamp, prev_content=None):
+    """Add standard fields like 'idx' and 'prev' to a protoblock. Returns the
+    block, its JSON encoding, and the JSON encoding of its blockref. If
+    prev_content is not None, it is used instead of reading the previous
+    block from disk, so that several blocks can be built before any of them
+    are written.
+    """
     if idx < 0:
         raise Exception('negative block index')
-    if not timestamp:
-        timestamp = datetime.now(timezone.utc)
     block = copy.deepcopy(protoblock)
     block['pyom_version'] = pyom_version_number
     block['pyom_block_magic'] = pyom_block_magic
@@ -236,9 +547,12 @@ def create_block(gpg_ctx, rootdir, idx, fpr, protoblock, timestamp=None):
     if not 'owner' in block:
         block['owner'] = {}
     block['owner']['gpg'] = fpr
-    block['prev'] = getprevhash(rootdir, idx)
+    if prev_content is None:
+        block['prev'] = getprevhash(rootdir, idx)
+    else:
+        block['prev'] = create_fileref_from_content(
+            0, prevfilename(idx), prev_content)
     block['timestamp'] = timestamp.isoformat()
-    # encode as json and compute gpg signature
     block_content = json.dumps(block, indent=2).encode('utf-8')
     # The blockref is a small file containing a hash of the block. The owner confirms the
     # block by gpg-signing the blockref. The indirection means that you only need to copy
@@ -250,25 +564,131 @@ def create_block(gpg_ctx, rootdir, idx, fpr, protoblock, timestamp=None):
         'pyom_blockref_magic': pyom_blockref_magic,
         'gpg': fpr,
         'idx': idx,
-        'SHA-512': hashlib.sha512(block_content).hexdigest()
+        'SHA-512': sha512_hex(block_content)
     }
     blockref_content = json.dumps(blockref, indent=2).encode('utf-8')
-    sig_content, sign_result = gpg_ctx.sign(
-        blockref_content, mode=gpg.constants.sig.mode.DETACH)
+    return block, block_content, blockref_content
+
+
+def sign_blockref(gpg_ctx, fpr, blockref_content):
+    """Create a detached gpg signature for a blockref."""
+    count_resource('gpg_sign')
+    with span('gpg.sign', 'gpg'):
+        sig_content, sign_result = gpg_ctx.sign(
+            blockref_content, mode=gpg.constants.sig.mode.DETACH)
     if len(sign_result.signatures) == 0:
         raise Exception('no signatures')
     if sign_result.signatures[0].fpr != fpr:
         raise Exception('signatures don\'t match. expected: ' +
                         fpr + ' actual: ' + sign_result.signatures[0].fpr)
-    # write files
-    block_path = rootdir.joinpath(blockfilename(idx, block_ext_json))
-    block_path.parent.mkdir(parents=True, exist_ok=True)
-    block_path.write_bytes(block_content)
-    blockref_path = rootdir.joinpath(blockfilename(idx, block_ext_ref))
-    blockref_path.write_bytes(blockref_content)
-    sig_path = rootdir.joinpath(blockfilename(idx, block_ext_sig))
-    sig_path.write_bytes(sig_content)
-    return block
+    return sig_content
+
+
+@contextlib.contextmanager
+def signing_key(gpg_ctx, fpr):
+    """Sign with fpr's secret key, rather than gpg's default key, until the
+    end of the with block. The caller's signers are restored afterwards.
+    """
+    signers = gpg_ctx.signers
+    gpg_ctx.signers = [gpg_ctx.get_key(fpr, secret=True)]
+    try:
+        yield
+    finally:
+        gpg_ctx.signers = signers
+
+
+def signer_at(fpr, rotations, idx):
+    """The fpr of the key that signs block idx of fpr's blockchain.
+    rotations is the list of its key rotations (see rotate_key.py), in
+    order. A rotation in block i takes effect from block i + 1.
+    """
+    signer = fpr
+    for rotation in rotations:
+        if rotation['idx'] < idx:
+            signer = rotation['gpg']
+    return signer
+
+
+def fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_block_files(rootdir, idx, contents, fsync_policy=None):
+    """Write the files for consecutive blocks, starting at idx. contents is a
+    list of (block_content, blockref_content, sig_content) tuples.
+
+    Every file is written to a temporary file and then renamed, so a crash
+    never leaves a truncated file in the blockchain directory. The blocks
+    are renamed into place in order, with the signature last, so a complete
+    triple of files is always a complete block and the worst a crash can
+    leave behind is an incomplete triple at the end of the chain. See
+    recover_blockchain.py for rolling that back.
+    """
+    if fsync_policy is None:
+        fsync_policy = default_fsync_policy
+    tmpdir = rootdir.joinpath(tmp_dirname)
+    tmpdir.mkdir(parents=True, exist_ok=True)
+    renames = []
+    for i, triple in enumerate(contents):
+        for ext, content in zip([block_ext_json, block_ext_ref, block_ext_sig], triple):
+            path = rootdir.joinpath(blockfilename(idx + i, ext))
+            tmp_path = tmpdir.joinpath(path.name)
+            with open(tmp_path, 'wb') as f:
+                f.write(content)
+                if fsync_policy != FsyncPolicy.NONE:
+                    f.flush()
+                    os.fsync(f.fileno())
+            renames.append((tmp_path, path))
+    dirs = []
+    for tmp_path, path in renames:
+        if not path.parent in dirs:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            dirs.append(path.parent)
+        tmp_path.rename(path)
+        if fsync_policy == FsyncPolicy.FILE:
+            fsync_path(path.parent)
+    if fsync_policy == FsyncPolicy.BATCH:
+        for d in dirs:
+            fsync_path(d)
+
+
+def create_block(gpg_ctx, rootdir, idx, fpr, protoblock, timestamp=None, fsync_policy=None):
+    """Add standard fields like 'idx' and 'prev', then write file and sign it."""
+    if not timestamp:
+        timestamp = utc_now()
+    return create_blocks(gpg_ctx, rootdir, idx, fpr, [protoblock], [timestamp], fsync_policy)[0]
+
+
+def create_blocks(gpg_ctx, rootdir, idx, fpr, protoblocks, timestamps, fsync_policy=None, signer_fpr=None):
+    """Create consecutive blocks, starting at idx. All the blockrefs are
+    signed with the same gpg context before any files are written, so a
+    signing failure doesn't leave a partial batch on disk. signer_fpr is
+    the key that signs them, if the owner fpr has rotated its key.
+    """
+    if signer_fpr is None:
+        signer_fpr = fpr
+    if len(protoblocks) != len(timestamps):
+        raise Exception('create_blocks: need one timestamp per protoblock')
+    with span('create_blocks', 'block', idx=idx, numblocks=len(protoblocks)):
+        blocks = []
+        contents = []
+        prev_content = None
+        for i, (protoblock, timestamp) in enumerate(zip(protoblocks, timestamps)):
+            with span('build_block', 'block', idx=idx + i):
+                block, block_content, blockref_content = build_block(
+                    rootdir, idx + i, fpr, protoblock, timestamp, prev_content)
+            blocks.append(block)
+            contents.append((block_content, blockref_content))
+            prev_content = block_content
+        contents = [(block_content, blockref_content, sign_blockref(gpg_ctx, signer_fpr, blockref_content))
+                    for block_content, blockref_content in contents]
+        with span('write_block_files', 'io', idx=idx):
+            write_block_files(rootdir, idx, contents, fsync_policy)
+        return blocks
 
 
 def create_block0(gpg_ctx, rootdir, fpr):
@@ -294,12 +714,33 @@ def timestamp_path(timestamp):
 
 
 def mk_unique_path(basedir):
-    timestamp = datetime.now(timezone.utc)
+    timestamp = utc_now()
     return basedir.joinpath(timestamp_path(timestamp))
 
 
-def create_transaction(participants, expiry_delta, transaction_init={'contracts': []}):
-    timestamp = datetime.now(timezone.utc)
+def participant_info(participant):
+    """Collect everything that create_transaction needs to know about a
+    participant, so that it only has to be looked up once.
+    """
+    rootdir = participant['rootdir']
+    idx = most_recent_block_idx(rootdir)
+    recent_block = load_block(rootdir, idx)
+    return {
+        'gpg': recent_block['owner']['gpg'],
+        'key_content': read_file(rootdir.joinpath(block0_pubkey_filename),
+                                 default_limits.max_fileref_size),
+        # Get the url where the repo is currently hosted. The hosting location
+        # can change, so this is only included as a helpful comment.
+        'git_remote_urls': git_repo_remote_urls(rootdir)
+    }
+
+
+def create_transaction(participants, expiry_delta, transaction_init={'contracts': []}, max_workers=None):
+    """Create the transaction directory and protoblock for every participant.
+    The participants are processed in parallel: most of the work is git
+    subprocesses, gpg and disk I/O.
+    """
+    timestamp = utc_now()
     transaction_path = transactions_dirname.joinpath(timestamp_path(timestamp))
 
     def process_this_participant(this_participant):
@@ -313,6 +754,7 @@ def create_transaction(participants, expiry_delta, transaction_init={'contracts'
             transaction['numlocations'] = 0
         gpg_ctx = gpg.Context()
         gpg_ctx.home_dir = this_rootdir.joinpath(gnupg_dirname).as_posix()
+        known_fprs = set(map(lambda key: key.fpr, gpg_ctx.keylist()))
         transaction['pyom_version'] = pyom_version_number
         transaction['pyom_transaction_magic'] = pyom_transaction_magic
         transaction['timestamp'] = timestamp.isoformat()
@@ -324,43 +766,37 @@ def create_transaction(participants, expiry_delta, transaction_init={'contracts'
         locidx = transaction['numlocations']
         transaction['numlocations'] += 1
 
-        def process_that_participant(that_participant):
-            that_rootdir = that_participant['rootdir']
-            idx = most_recent_block_idx(that_rootdir)
-            recent_block = load_block(that_rootdir, idx)
-            fpr = recent_block['owner']['gpg']
+        def process_that_participant(that_info):
+            fpr = that_info['gpg']
             # import and copy their gpg key (if necessary)
-            if len(list(gpg_ctx.keylist(pattern=fpr))) != 1:
+            if not fpr in known_fprs:
                 # create sub-directory
                 fpr_dir = pathlib.PurePath(fpr)
                 transaction_dir.joinpath(fpr_dir).mkdir(
                     parents=False, exist_ok=False)
-                key_content = that_rootdir.joinpath(
-                    block0_pubkey_filename).read_bytes()
+                key_content = that_info['key_content']
                 gpg_ctx.key_import(key_content)
+                known_fprs.add(fpr)
                 key_filename = transaction_path.joinpath(
                     fpr_dir).joinpath(fpr + '.key')
                 this_rootdir.joinpath(key_filename).write_bytes(key_content)
-                # Get the url where the repo is currently hosted. The hosting location
-                # can change, so this is only included as a helpful comment.
-                remotes = git_repo_remote_urls(that_rootdir)
                 import_action = {
                     'type': 'import_gpg_key',
                     'gpg': fpr,
-                    'keyfile': create_fileref(this_rootdir, 0, key_filename),
-                    'git_remote_urls': remotes
+                    'keyfile': create_fileref_from_content(0, key_filename, key_content),
+                    'git_remote_urls': that_info['git_remote_urls']
                 }
                 protoblock['actions'].append(import_action)
             return {'gpg': fpr}
         transaction['participants'] = list(
-            map(process_that_participant, participants))
+            map(process_that_participant, infos))
         transaction_content = json.dumps(transaction, indent=2).encode('utf-8')
         transaction_filename = transaction_path.joinpath('transaction.json')
         this_rootdir.joinpath(transaction_filename).write_bytes(
             transaction_content)
         register_action = {
             'type': 'register_transaction',
-            'transaction': create_fileref(this_rootdir, 0, transaction_filename),
+            'transaction': create_fileref_from_content(0, transaction_filename, transaction_content),
             'locations': locations
         }
         protoblock['actions'].append(register_action)
@@ -369,7 +805,11 @@ def create_transaction(participants, expiry_delta, transaction_init={'contracts'
         this_rootdir.joinpath(protoblock_filename).write_bytes(
             protoblock_content)
         return protoblock
-    return list(map(process_this_participant, participants))
+    # The workers run git and gpg.
+    finish_lazy_import(subprocess, gpg)
+    with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        infos = list(executor.map(participant_info, participants))
+        return list(executor.map(process_this_participant, participants))
 
 
 def export_block0_pubkey(gpg_ctx, rootdir):
@@ -388,16 +828,33 @@ def export_block0_pubkey(gpg_ctx, rootdir):
 
 
 def import_key(gpg_ctx, key_content):
-    result = gpg_ctx.key_import(key_content)
+    count_resource('gpg_key_import')
+    with span('gpg.key_import', 'gpg'):
+        result = gpg_ctx.key_import(key_content)
     return result.imports[0].fpr
 
 
-def walkjson(object):
-    """Walk a json object recursively."""
-    yield object
-    if isinstance(object, dict):
-        for key, value in object.items():
-            yield from walkjson(value)
-    elif isinstance(object, list):
-        for value in object:
-            yield from walkjson(value)
+def walkjson(object, max_depth=None):
+    """Walk a json object, depth first. Uses a stack rather than recursion,
+    so deep nesting can't overflow the Python stack. If max_depth is given,
+    raise an exception if lists and dicts are nested more deeply.
+    """
+    stack = [(object, 1)]
+    while len(stack) > 0:
+        object, depth = stack.pop()
+        yield object
+        if isinstance(object, dict):
+            children = list(object.values())
+        elif isinstance(object, list):
+            children = object
+        else:
+            continue
+        if max_depth is not None and depth > max_depth:
+            raise Exception('JSON is nested too deeply (limit ' +
+                            str(max_depth) + ')')
+        stack.extend(map(lambda child: (child, depth + 1), reversed(children)))
+
+
+def check_json_depth(object, max_depth):
+    for _ in walkjson(object, max_depth):
+        pass
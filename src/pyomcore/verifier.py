@@ -16,24 +16,21 @@
 # You should have received a copy of the GNU General Public License
 # along with pyomcore. If not, see <https://www.gnu.org/licenses/>.
 
+import collections.abc
 import sys
 from enum import Enum
 from .utils import *
 
 
-def check_fileref(location_array, object):
-    """If the object is a fileref, check the hash"""
-    if isinstance(object, dict):
-        if 'pyom_fileref_magic' in object:
-            if object['pyom_fileref_magic'] == pyom_fileref_magic:
-                # This checks the hash
-                load_fileref(location_array, object)
+def is_fileref(object):
+    return (isinstance(object, dict) and
+            object.get('pyom_fileref_magic') == pyom_fileref_magic)
 
 
-def check_filerefs_json(location_array, json):
+def check_filerefs_json(location_array, json, max_depth=None, max_size=None):
     """Recursively check the filerefs in a json object."""
-    for obj in walkjson(json):
-        check_fileref(location_array, obj)
+    check_filerefs(location_array, list(
+        filter(is_fileref, walkjson(json, max_depth))), max_size)
 
 
 def check_blockchain_dir(rootdir):
@@ -68,31 +65,117 @@ def check_valid_blockref(blockref, fpr):
         raise Exception('SHA-512 incorrect length in blockref')
 
 
-def check_blockref_sig(gpg_ctx, fpr, blockref_content, sig_content):
-    """Check that the blockref is gpg-signed."""
-    verify_data, verify_result = gpg_ctx.verify(blockref_content, sig_content)
-    if len(verify_result.signatures) == 0 or verify_result.signatures[0].fpr != fpr:
+def is_signed_by(gpg_ctx, fpr, content, sig_content):
+    """Check that sig_content is a detached gpg signature of content by fpr."""
+    count_resource('gpg_verify')
+    with span('gpg.verify', 'gpg'):
+        verify_data, verify_result = gpg_ctx.verify(content, sig_content)
+    return len(verify_result.signatures) > 0 and verify_result.signatures[0].fpr == fpr
+
+
+def check_blockref_sig(gpg_ctx, fpr, blockref_content, sig_content, rotations=None):
+    """Check that the blockref is gpg-signed. If fpr has rotated its key,
+    rotations is the list of its key rotations, and the blockref must be
+    signed by the key that was in use at its idx.
+    """
+    signer = fpr
+    if rotations:
+        signer = signer_at(fpr, rotations, parse_json(blockref_content)['idx'])
+    if not is_signed_by(gpg_ctx, signer, blockref_content, sig_content):
         raise Exception('blockref has bad signature')
-    blockref = json.loads(blockref_content)
+    blockref = parse_json(blockref_content)
     check_valid_blockref(blockref, fpr)
     return blockref
 
 
-def check_block_sig(gpg_ctx, fpr, block_content, blockref_content, sig_content):
+def check_block_sig(gpg_ctx, fpr, block_content, blockref_content, sig_content, max_depth=None, rotations=None):
     """Check that block_txt is the JSON for a block. It needs to contain
     pyom_block_magic and be signed by the correct owner.
     """
-    blockref = check_blockref_sig(gpg_ctx, fpr, blockref_content, sig_content)
-    block = json.loads(block_content)
+    blockref = check_blockref_sig(
+        gpg_ctx, fpr, blockref_content, sig_content, rotations)
+    with span('json.loads', 'json', size=len(block_content)):
+        block = parse_json(block_content, max_depth)
     if blockref['idx'] != block['idx']:
         raise Exception('idx mismatch in blockref')
-    if blockref['SHA-512'] != hashlib.sha512(block_content).hexdigest():
-        raise Exception('SHA-512 mismatch in blockref')
+    with span('sha512', 'hash', size=len(block_content)):
+        if blockref['SHA-512'] != sha512_hex(block_content):
+            raise Exception('SHA-512 mismatch in blockref')
+    check_block_owner(fpr, block)
+    return block
+
+
+def check_block_owner(fpr, block):
     if block['pyom_block_magic'] != pyom_block_magic:
         raise Exception('bad pyom_block_magic')
     if block['owner']['gpg'] != fpr:
         raise Exception('bad owner')
-    return block
+
+
+def check_linked_blocks(gpg_ctx, fpr, block_contents, blockref_content, sig_content, max_depth=None, rotations=None):
+    """Check a sequence of consecutive blocks. Only the last one needs to
+    be signed: each of the others is authenticated by the SHA-512 in the
+    'prev' fileref of the block after it. Returns the blocks.
+    """
+    blocks = [None] * len(block_contents)
+    blocks[-1] = check_block_sig(
+        gpg_ctx, fpr, block_contents[-1], blockref_content, sig_content, max_depth, rotations)
+    for i in range(len(block_contents) - 2, -1, -1):
+        if blocks[i + 1]['prev']['SHA-512'] != sha512_hex(block_contents[i]):
+            raise Exception('bad prev hash in block ' +
+                            str(blocks[i + 1]['idx']))
+        blocks[i] = parse_json(block_contents[i], max_depth)
+        check_block_owner(fpr, blocks[i])
+        if blocks[i]['idx'] + 1 != blocks[i + 1]['idx']:
+            raise Exception('blocks are not in sequence')
+    return blocks
+
+
+def check_key_rotation(gpg_ctx, location_array, rotation, owner, old_fpr, max_size=None):
+    """Check the evidence for a key rotation: the new public key, and a
+    statement that owner's blockchain switches from old_fpr to the new
+    key, signed by both keys. Imports the new key. Returns the statement.
+    """
+    key_content = load_fileref(
+        location_array, rotation['keyfile'], max_size)
+    new_fpr = import_key(gpg_ctx, key_content)
+    if new_fpr != rotation['gpg']:
+        raise Exception('key rotation: fingerprint doesn\'t match')
+    statement_content = load_fileref(
+        location_array, rotation['statement'], max_size)
+    statement = parse_json(statement_content)
+    if statement['pyom_version'] != pyom_version_number:
+        raise Exception('bad pyom version in key rotation')
+    if statement['pyom_key_rotation_magic'] != pyom_key_rotation_magic:
+        raise Exception('bad pyom_key_rotation_magic')
+    if statement['owner'] != owner:
+        raise Exception('key rotation: wrong owner')
+    if statement['old_gpg'] != old_fpr:
+        raise Exception('key rotation: old key is not the current key')
+    if statement['new_gpg'] != new_fpr or new_fpr == old_fpr:
+        raise Exception('key rotation: bad new key')
+    if not isinstance(statement['idx'], int):
+        raise Exception('key rotation: idx is not an int')
+    for fpr, sig_name in [(old_fpr, 'old_sig'), (new_fpr, 'new_sig')]:
+        sig_content = load_fileref(
+            location_array, rotation[sig_name], max_size)
+        if not is_signed_by(gpg_ctx, fpr, statement_content, sig_content):
+            raise Exception('key rotation: bad signature: ' + sig_name)
+    return statement
+
+
+def key_rotation_entry(idx, action):
+    """The entry in a list of key rotations for a rotate_key or
+    import_key_rotation action, which rotates the key after block idx.
+    """
+    return {
+        'idx': idx,
+        'gpg': action['gpg'],
+        'keyfile': action['keyfile'],
+        'statement': action['statement'],
+        'old_sig': action['old_sig'],
+        'new_sig': action['new_sig']
+    }
 
 
 def check_register_transaction_timestamp(block_timestamp, transaction):
@@ -129,127 +212,361 @@ class TransactionState(Enum):
     ANNULLED = 3
 
 
+# TransactionState values, indexed by value.
+transaction_states = tuple(TransactionState)
+
+
 class TransactionStatus(object):
-    def __init__(self, transaction, block_idx):
-        self.transaction = transaction
+    """The state of a transaction that is registered on the blockchain.
+    There can be millions of these, so they are kept small: the hash is a
+    64-byte digest, fingerprints are interned, and the transaction itself
+    isn't kept in memory. It's loaded (and its hash checked) from its
+    fileref whenever it is needed.
+    """
+    __slots__ = ('digest', 'location_array', 'locidx', 'filename', 'block_idx',
+                 'pending_participants', 'signature_list', 'state_value')
+
+    def __init__(self, location_array, fileref, participants, block_idx):
+        self.digest = bytes.fromhex(fileref['SHA-512'])
+        self.location_array = location_array
+        self.locidx = fileref['locidx']
+        self.filename = fileref['filename']
         self.block_idx = block_idx
-        self.pending_participants = set(
-            map(lambda p: p['gpg'], transaction['participants']))
-        self.signatures = {}
-        self.state = TransactionState.PENDING
+        self.pending_participants = tuple(
+            map(lambda p: sys.intern(p['gpg']), participants))
+        # (fpr, idx, digest) of each sign_transaction's blockref.
+        self.signature_list = ()
+        self.state_value = TransactionState.PENDING.value
+
+    @property
+    def fileref(self):
+        return {
+            'pyom_fileref_magic': pyom_fileref_magic,
+            'locidx': self.locidx,
+            'filename': self.filename,
+            'SHA-512': self.digest.hex()
+        }
+
+    @property
+    def transaction(self):
+        return parse_json(load_fileref(self.location_array, self.fileref))
+
+    @property
+    def state(self):
+        return transaction_states[self.state_value]
+
+    @state.setter
+    def state(self, state):
+        self.state_value = state.value
+
+    @property
+    def signatures(self):
+        """The blockrefs of the sign_transaction actions, indexed by fpr."""
+        return dict(map(lambda sig: (sig[0], {
+            'pyom_version': pyom_version_number,
+            'pyom_blockref_magic': pyom_blockref_magic,
+            'gpg': sig[0],
+            'idx': sig[1],
+            'SHA-512': sig[2].hex()
+        }), self.signature_list))
+
+    def add_signature(self, fpr, blockref):
+        self.signature_list = self.signature_list + \
+            ((sys.intern(fpr), blockref['idx'], bytes.fromhex(blockref['SHA-512'])),)
 
     def remove_pending_participant(self, fpr):
         if not fpr in self.pending_participants:
             raise Exception(
                 'remove_pending_participant: fpr not found: ' + fpr)
-        self.pending_participants.remove(fpr)
+        self.pending_participants = tuple(
+            filter(lambda p: p != fpr, self.pending_participants))
 
     def is_pending(self):
-        return (self.state == TransactionState.PENDING)
+        return (self.state_value == TransactionState.PENDING.value)
 
     def is_confirmed(self):
-        return (self.state == TransactionState.CONFIRMED)
+        return (self.state_value == TransactionState.CONFIRMED.value)
 
     def is_annulled(self):
-        return (self.state == TransactionState.ANNULLED)
+        return (self.state_value == TransactionState.ANNULLED.value)
+
+    def is_final(self):
+        """CONFIRMED and CANCELLED transactions rarely change again."""
+        return (self.state_value == TransactionState.CONFIRMED.value or
+                self.state_value == TransactionState.CANCELLED.value)
+
+    def to_json(self):
+        return {
+            'rootdir': self.location_array[0].as_posix(),
+            'fileref': self.fileref,
+            'block_idx': self.block_idx,
+            'pending_participants': list(self.pending_participants),
+            'signatures': list(map(lambda sig: [sig[0], sig[1], sig[2].hex()], self.signature_list)),
+            'state': self.state_value
+        }
+
+    @staticmethod
+    def from_json(obj):
+        transaction_status = TransactionStatus(
+            [pathlib.Path(obj['rootdir'])], obj['fileref'], [], obj['block_idx'])
+        transaction_status.pending_participants = tuple(
+            map(sys.intern, obj['pending_participants']))
+        transaction_status.signature_list = tuple(map(lambda sig: (
+            sys.intern(sig[0]), sig[1], bytes.fromhex(sig[2])), obj['signatures']))
+        transaction_status.state_value = obj['state']
+        return transaction_status
+
+
+# The canonical form of a SHA-512 hash, as sha512_hex returns it.
+transaction_hash_re = re.compile('[0-9a-f]{128}')
+
+
+class TransactionDict(collections.abc.MutableMapping):
+    """A dict from transaction hash to TransactionStatus. The hashes are hex
+    strings, like everywhere else, but they are stored as the 64-byte
+    digests that the TransactionStatus objects already hold. Only the
+    canonical form of a hash (128 lowercase hex digits) is a key, like in
+    a dict of str, so that 'ABC...' or ' abc...' aren't the same
+    transaction as 'abc...'.
+    """
+
+    def __init__(self):
+        self.table = {}
+
+    @staticmethod
+    def digest(transaction_hash):
+        """The digest of a canonical hash, or None."""
+        if not (isinstance(transaction_hash, str) and
+                transaction_hash_re.fullmatch(transaction_hash)):
+            return None
+        return bytes.fromhex(transaction_hash)
+
+    def __getitem__(self, transaction_hash):
+        digest = TransactionDict.digest(transaction_hash)
+        if digest is None:
+            raise KeyError(transaction_hash)
+        return self.table[digest]
+
+    def __setitem__(self, transaction_hash, transaction_status):
+        if TransactionDict.digest(transaction_hash) != transaction_status.digest:
+            raise Exception('TransactionDict: hash mismatch')
+        self.table[transaction_status.digest] = transaction_status
+
+    def __delitem__(self, transaction_hash):
+        digest = TransactionDict.digest(transaction_hash)
+        if digest is None:
+            raise KeyError(transaction_hash)
+        del self.table[digest]
+
+    def __contains__(self, transaction_hash):
+        return TransactionDict.digest(transaction_hash) in self.table
+
+    def __iter__(self):
+        for digest in self.table:
+            yield digest.hex()
+
+    def __len__(self):
+        return len(self.table)
+
+    def items(self):
+        for digest, transaction_status in self.table.items():
+            yield digest.hex(), transaction_status
 
 
 class Verifier(object):
-    def __init__(self, rootdir, gpg_ctx):
+    """Replays a blockchain, one block at a time, and checks that it follows
+    the rules. The state is kept in dicts, unless a state_store (see
+    state_store.py) is given. If a history (see state_history.py) is given,
+    it records the changes that each block makes to the state. limits
+    (see Limits in utils.py) defaults to default_limits.
+
+    Transaction states must be written back with
+    self.transactions[transaction_hash] = transaction_status
+    after they are modified, because a state store keeps them on disk.
+    """
+
+    def __init__(self, rootdir, gpg_ctx, state_store=None, history=None, limits=None):
         self.rootdir = rootdir
+        self.limits = limits if limits is not None else default_limits
         self.location_array_root = [self.rootdir]
         self.nextidx = 0
+        self.prev_timestamp = None
+        # SHA-512 of the previous block, if it was verified by verify_block.
+        self.prev_hash = None
+        # Set if append_blocks failed part of the way through, which leaves
+        # the state ahead of the blockchain on disk.
+        self.stale = False
         self.gpg_ctx = gpg_ctx
-        self.fpr = import_key(self.gpg_ctx, self.rootdir.joinpath(
-            block0_pubkey_filename).read_bytes())
-        self.known_gpg_keys = {self.fpr: {}}
-        self.transactions = {}
-        self.banned = {}
-        self.extra_connections = {}
+        self.fpr = import_key(self.gpg_ctx, read_file(self.rootdir.joinpath(
+            block0_pubkey_filename), self.limits.max_fileref_size))
+        if state_store is None:
+            self.known_gpg_keys = {}
+            self.transactions = TransactionDict()
+            self.banned = {}
+            self.extra_connections = {}
+            self.key_rotations = {}
+        else:
+            self.known_gpg_keys = state_store.known_gpg_keys
+            self.transactions = state_store.transactions
+            self.banned = state_store.banned
+            self.extra_connections = state_store.extra_connections
+            self.key_rotations = state_store.key_rotations
+        self.history = history
+        if self.history is not None:
+            self.history.attach(self)
+        self.known_gpg_keys[self.fpr] = {}
 
     def is_banned(self, fpr):
         return (fpr in self.banned)
 
+    def rotations(self, fpr):
+        """fpr's key rotations that this blockchain knows about."""
+        return self.key_rotations.get(fpr, [])
+
+    @property
+    def signer_fpr(self):
+        """The key that signs the next block. It's self.fpr, the key in
+        public.key, until the owner rotates its key.
+        """
+        return signer_at(self.fpr, self.rotations(self.fpr), self.nextidx)
+
+    def check_not_stale(self):
+        if self.stale:
+            raise Exception('Verifier: state is ahead of the blockchain after a failed ' +
+                            'append_blocks, verify the chain again')
+
     def verify_block(self, idx):
-        if idx != self.nextidx:
-            raise Exception('unexpected idx')
-        self.nextidx += 1
         # Load files
         block_path = self.rootdir.joinpath(blockfilename(idx, block_ext_json))
-        block_content = block_path.read_bytes()
+        block_content = read_file(block_path, self.limits.max_block_size)
         blockref_path = self.rootdir.joinpath(
             blockfilename(idx, block_ext_ref))
-        blockref_content = blockref_path.read_bytes()
+        blockref_content = read_file(
+            blockref_path, self.limits.max_block_size)
         sig_path = self.rootdir.joinpath(blockfilename(idx, block_ext_sig))
-        sig_content = sig_path.read_bytes()
-        # Check gpg signature
-        block = check_block_sig(self.gpg_ctx, self.fpr,
-                                block_content, blockref_content, sig_content)
-        # Check fields
-        if block['pyom_version'] != pyom_version_number:
-            raise Exception('bad pyom version in block')
-        if block['prev'] != getprevhash(self.rootdir, idx):
-            raise Exception('bad prev hash')
-        if block['idx'] != idx:
-            raise Exception('bad index')
-        timestamp = datetime.fromisoformat(block['timestamp'])
-        if not (timestamp < datetime.now(timezone.utc)):
-            raise Exception('timestamp is in the future')
-        if idx > 0:
-            prevtimestamp = datetime.fromisoformat(
-                load_block(self.rootdir, idx-1)['timestamp'])
-            if not (prevtimestamp < timestamp):
-                raise Exception('invalid timestamp')
-        block_timestamp = datetime.fromisoformat(block['timestamp'])
-        self.verify_block_body(block_timestamp, idx, block)
+        sig_content = read_file(sig_path, self.limits.max_block_size)
+        self.verify_block_files(idx, block_content,
+                                blockref_content, sig_content)
+
+    def verify_blocks(self, start, stop=None):
+        """Verify the blocks from start up to, but not including, stop.
+        The files are read ahead while the blocks are checked.
+        """
+        for idx, block_content, blockref_content, sig_content in iter_block_files(
+                self.rootdir, start, stop, max_size=self.limits.max_block_size):
+            self.verify_block_files(idx, block_content,
+                                    blockref_content, sig_content)
+
+    def verify_block_files(self, idx, block_content, blockref_content, sig_content):
+        self.check_not_stale()
+        with span('verify_block', 'block', idx=idx):
+            if idx != self.nextidx:
+                raise Exception('unexpected idx')
+            self.nextidx += 1
+            for content in (block_content, blockref_content, sig_content):
+                if len(content) > self.limits.max_block_size:
+                    raise Exception('block file is too large (limit ' +
+                                    str(self.limits.max_block_size) + ' bytes)')
+            # Check gpg signature
+            block = check_block_sig(self.gpg_ctx, self.fpr, block_content, blockref_content,
+                                    sig_content, self.limits.max_json_depth, self.rotations(self.fpr))
+            # Check fields
+            if block['pyom_version'] != pyom_version_number:
+                raise Exception('bad pyom version in block')
+            if self.prev_hash is not None and idx > 0:
+                # The previous block's hash was checked against its blockref,
+                # so there's no need to read it again.
+                prevhash = {
+                    'pyom_fileref_magic': pyom_fileref_magic,
+                    'locidx': 0,
+                    'filename': prevfilename(idx).as_posix(),
+                    'SHA-512': self.prev_hash
+                }
+            else:
+                prevhash = getprevhash(self.rootdir, idx)
+            if block['prev'] != prevhash:
+                raise Exception('bad prev hash')
+            self.prev_hash = parse_json(blockref_content)['SHA-512']
+            if block['idx'] != idx:
+                raise Exception('bad index')
+            timestamp = datetime.fromisoformat(block['timestamp'])
+            if not (timestamp < utc_now()):
+                raise Exception('timestamp is in the future')
+            if idx > 0:
+                if not (self.prev_timestamp < timestamp):
+                    raise Exception('invalid timestamp')
+            self.prev_timestamp = timestamp
+            self.verify_block_body(timestamp, idx, block)
 
     def verify_block_body(self, block_timestamp, block_idx, block):
-        check_filerefs_json(self.location_array_root, block)
+        # block['prev'] has already been checked by verify_block_files, so
+        # don't hash the previous block again.
+        if len(block['actions']) > self.limits.max_actions:
+            raise Exception('too many actions in block (limit ' +
+                            str(self.limits.max_actions) + ')')
+        prev = block.get('prev')
+        check_filerefs(self.location_array_root, list(filter(
+            lambda obj: is_fileref(obj) and obj is not prev,
+            walkjson(block, self.limits.max_json_depth))), self.limits.max_linked_file_size)
         self.verify_block_actions(block_timestamp, block_idx, block['actions'])
+        if self.history is not None:
+            self.history.end_block(block_idx)
 
     def verify_block_actions(self, block_timestamp, block_idx, actions):
-        for action in actions:
-            t = action['type']
-            if t == 'import_gpg_key':
-                self.verify_import_gpg_key(action)
-            elif t == 'ban':
-                self.verify_ban(action)
-            elif t == 'register_transaction':
-                self.verify_register_transaction(
-                    block_timestamp, block_idx, action)
-            elif t == 'sign_transaction':
-                self.verify_sign_transaction(action)
-            elif t == 'confirm_transaction':
-                self.verify_confirm_transaction(action)
-            elif t == 'cancel_transaction':
-                self.verify_cancel_transaction(action)
-            elif t == 'annul_transaction':
-                self.verify_annul_transaction(action)
-            elif t == 'reinstate_transaction':
-                self.verify_reinstate_transaction(action)
-            elif t == 'add_extra_connection':
-                self.verify_add_extra_connection(action)
-            elif t == 'remove_extra_connection':
-                del self.extra_connections[action['gpg']]
-            elif t == 'verify_signed_tag':
-                # Check that a git repo has a signed tag.
-                fpr = action['gpg']
-                self.verify_fpr(fpr)
-                repodir = resolve_path(
-                    self.location_array_root, action['git_repo'])
-                commit_id = git_repo_current_commit_id(repodir)
-                git_verify_signed_tag(self.gpg_ctx, repodir, commit_id, fpr)
-            elif t == 'link_file':
-                # Link an arbitrary file to the blockchain. Hash is checked to
-                # prevent file contents from changing.
-                load_fileref(self.location_array_root, action['file'])
-            else:
-                raise Exception('unknown action type: ' + t)
+        for position, action in enumerate(actions):
+            with span(action['type'], 'action', idx=block_idx, position=position):
+                self.verify_action(block_timestamp, block_idx, action)
+
+    def verify_action(self, block_timestamp, block_idx, action):
+        t = action['type']
+        if t == 'import_gpg_key':
+            self.verify_import_gpg_key(action)
+        elif t == 'ban':
+            self.verify_ban(action)
+        elif t == 'register_transaction':
+            self.verify_register_transaction(
+                block_timestamp, block_idx, action)
+        elif t == 'sign_transaction':
+            self.verify_sign_transaction(action)
+        elif t == 'confirm_transaction':
+            self.verify_confirm_transaction(action)
+        elif t == 'cancel_transaction':
+            self.verify_cancel_transaction(action)
+        elif t == 'annul_transaction':
+            self.verify_annul_transaction(action)
+        elif t == 'reinstate_transaction':
+            self.verify_reinstate_transaction(action)
+        elif t == 'rotate_key':
+            self.verify_rotate_key(block_idx, action)
+        elif t == 'import_key_rotation':
+            self.verify_import_key_rotation(action)
+        elif t == 'add_extra_connection':
+            self.verify_add_extra_connection(action)
+        elif t == 'remove_extra_connection':
+            del self.extra_connections[action['gpg']]
+        elif t == 'verify_signed_tag':
+            # Check that a git repo has a signed tag.
+            fpr = action['gpg']
+            self.verify_fpr(fpr)
+            repodir = resolve_path(
+                self.location_array_root, action['git_repo'])
+            commit_id = git_repo_current_commit_id(repodir)
+            git_verify_signed_tag(self.gpg_ctx, repodir, commit_id, fpr)
+        elif t == 'link_file':
+            # Link an arbitrary file to the blockchain. Hash is checked to
+            # prevent file contents from changing.
+            check_fileref(self.location_array_root,
+                          action['file'], self.limits.max_linked_file_size)
+        else:
+            raise Exception('unknown action type: ' + t)
 
     def verify_import_gpg_key(self, action):
         fpr = action['gpg']
-        result = self.gpg_ctx.key_import(
-            load_fileref(self.location_array_root, action['keyfile']))
+        key_content = load_fileref(
+            self.location_array_root, action['keyfile'], self.limits.max_fileref_size)
+        count_resource('gpg_key_import')
+        with span('gpg.key_import', 'gpg'):
+            result = self.gpg_ctx.key_import(key_content)
         if result.imports[0].fpr != fpr:
             raise Exception(
                 'import_gpg_key: fingerprint doesn\'t match')
@@ -267,17 +584,17 @@ class Verifier(object):
         if self.is_banned(fpr):
             raise Exception('verify_ban: already banned')
         ref_content1 = load_fileref(
-            self.location_array_root, action['block_ref1'])
+            self.location_array_root, action['block_ref1'], self.limits.max_block_size)
         sig_content1 = load_fileref(
-            self.location_array_root, action['block_sig1'])
+            self.location_array_root, action['block_sig1'], self.limits.max_block_size)
         ref_content2 = load_fileref(
-            self.location_array_root, action['block_ref2'])
+            self.location_array_root, action['block_ref2'], self.limits.max_block_size)
         sig_content2 = load_fileref(
-            self.location_array_root, action['block_sig2'])
+            self.location_array_root, action['block_sig2'], self.limits.max_block_size)
         block_ref1 = check_blockref_sig(
-            self.gpg_ctx, fpr, ref_content1, sig_content1)
+            self.gpg_ctx, fpr, ref_content1, sig_content1, self.rotations(fpr))
         block_ref2 = check_blockref_sig(
-            self.gpg_ctx, fpr, ref_content2, sig_content2)
+            self.gpg_ctx, fpr, ref_content2, sig_content2, self.rotations(fpr))
         if block_ref1['idx'] != block_ref2['idx']:
             raise Exception('verify_ban: block idx mismatch')
         if block_ref1['SHA-512'] == block_ref2['SHA-512']:
@@ -287,9 +604,9 @@ class Verifier(object):
     def verify_register_transaction(self, block_timestamp, block_idx, action):
         """Add a transaction to the blockchain. Is it "pending" until all participants sign it."""
         transaction_txt = load_fileref(
-            self.location_array_root, action['transaction'])
+            self.location_array_root, action['transaction'], self.limits.max_fileref_size)
         transaction_hash = action['transaction']['SHA-512']
-        transaction = json.loads(transaction_txt)
+        transaction = parse_json(transaction_txt, self.limits.max_json_depth)
         # Create a new location_array for the transaction.
         if transaction['numlocations'] != len(action['locations']):
             raise Exception(
@@ -302,7 +619,8 @@ class Verifier(object):
                 'register_transaction: duplicate transaction:\n' + transaction_hash)
         self.verify_transaction(
             location_array_transaction, block_timestamp, transaction)
-        transaction_status = TransactionStatus(transaction, block_idx)
+        transaction_status = TransactionStatus(
+            self.location_array_root, action['transaction'], transaction['participants'], block_idx)
         transaction_status.remove_pending_participant(self.fpr)
         self.transactions[transaction_hash] = transaction_status
 
@@ -311,7 +629,8 @@ class Verifier(object):
             raise Exception('bad pyom_version in transaction')
         if transaction['pyom_transaction_magic'] != pyom_transaction_magic:
             raise Exception('bad pyom_transaction_magic')
-        check_filerefs_json(location_array, transaction)
+        check_filerefs_json(location_array, transaction,
+                            self.limits.max_json_depth, self.limits.max_linked_file_size)
         check_register_transaction_timestamp(block_timestamp, transaction)
         for p in transaction['participants']:
             fpr = p['gpg']
@@ -321,9 +640,9 @@ class Verifier(object):
         for contract in transaction['contracts']:
             contractdir = resolve_path(location_array, contract['path'])
             # Check the smart contract's uuid.
-            uuid_content = contractdir.joinpath(
-                smartcontract_uuid_filename).read_bytes()
-            uuid_hash = hashlib.sha512(uuid_content).hexdigest()
+            uuid_content = read_file(contractdir.joinpath(
+                smartcontract_uuid_filename))
+            uuid_hash = sha512_hex(uuid_content)
             if uuid_hash != contract['uuid_hash']['SHA-512']:
                 raise Exception('smart contract uuid mismatch')
             # Check the current commit is signed by the author(s) of the smart contract.
@@ -347,20 +666,21 @@ class Verifier(object):
         transaction = transaction_status.transaction
         # Load block and check signature
         block_txt = load_fileref(
-            self.location_array_root, this_action['block'])
+            self.location_array_root, this_action['block'], self.limits.max_block_size)
         block_ref = load_fileref(
-            self.location_array_root, this_action['block_ref'])
+            self.location_array_root, this_action['block_ref'], self.limits.max_block_size)
         block_sig = load_fileref(
-            self.location_array_root, this_action['block_sig'])
-        block = check_block_sig(
-            self.gpg_ctx, fpr, block_txt, block_ref, block_sig)
+            self.location_array_root, this_action['block_sig'], self.limits.max_block_size)
+        block = check_block_sig(self.gpg_ctx, fpr, block_txt, block_ref, block_sig,
+                                self.limits.max_json_depth, self.rotations(fpr))
         # Check block timestamp
         block_timestamp = datetime.fromisoformat(block['timestamp'])
         check_register_transaction_timestamp(block_timestamp, transaction)
         if not block_registers_transaction(transaction_hash, block):
             raise Exception('sign_transaction: transaction not found')
         transaction_status.remove_pending_participant(fpr)
-        transaction_status.signatures[fpr] = json.loads(block_ref)
+        transaction_status.add_signature(fpr, parse_json(block_ref))
+        self.transactions[transaction_hash] = transaction_status
 
     def verify_confirm_transaction(self, action):
         """After all the participants have signed a transaction, it can move from
@@ -375,6 +695,7 @@ class Verifier(object):
                             'unconfirmed partipants: ' +
                             str(transaction_status.pending_participants))
         transaction_status.state = TransactionState.CONFIRMED
+        self.transactions[transaction_hash] = transaction_status
 
     def verify_cancel_transaction(self, this_action):
         """One of the participants has not registered the transaction before it expired,
@@ -397,16 +718,20 @@ class Verifier(object):
         numblocks = len(blocks)
         if numblocks < 2:
             raise Exception('cancel_transaction: at least 2 blocks required')
-        for i in range(0, numblocks):
-            # Load block and check signature
-            block_txt = load_fileref(
-                self.location_array_root, blocks[i]['block'])
-            block_ref = load_fileref(
-                self.location_array_root, blocks[i]['block_ref'])
-            block_sig = load_fileref(
-                self.location_array_root, blocks[i]['block_sig'])
-            block = check_block_sig(
-                self.gpg_ctx, fpr, block_txt, block_ref, block_sig)
+        if numblocks > self.limits.max_cancel_blocks:
+            raise Exception('cancel_transaction: too many blocks (limit ' +
+                            str(self.limits.max_cancel_blocks) + ')')
+        # Load the blocks. Only the last block's signature is checked. The
+        # others are linked to it by their hashes.
+        max_size = self.limits.max_block_size
+        block_contents = list(map(lambda b: load_fileref(
+            self.location_array_root, b['block'], max_size), blocks))
+        block_ref = load_fileref(
+            self.location_array_root, blocks[-1]['block_ref'], max_size)
+        block_sig = load_fileref(
+            self.location_array_root, blocks[-1]['block_sig'], max_size)
+        for i, block in enumerate(check_linked_blocks(self.gpg_ctx, fpr, block_contents, block_ref, block_sig,
+                                                      self.limits.max_json_depth, self.rotations(fpr))):
             if block_registers_transaction(transaction_hash, block):
                 print(transaction_hash)
                 print(block)
@@ -430,6 +755,7 @@ class Verifier(object):
                         'cancel_transaction: last block is too old')
         # Cancel the transaction
         transaction_status.state = TransactionState.CANCELLED
+        self.transactions[transaction_hash] = transaction_status
 
     def verify_annul_transaction(self, action):
         """Annulling a transaction is usually unnecessary. It's only needed if
@@ -449,6 +775,7 @@ class Verifier(object):
         if not isinstance(action['explanation'], str):
             raise Exception('annul_transaction: explanation is not a str')
         transaction_status.state = TransactionState.ANNULLED
+        self.transactions[transaction_hash] = transaction_status
 
     def verify_reinstate_transaction(self, action):
         """Undo a previous 'annul_transaction' action."""
@@ -458,6 +785,7 @@ class Verifier(object):
             raise Exception(
                 'reinstate_transaction: transaction is not ANNULLED')
         transaction_status.state = TransactionState.CONFIRMED
+        self.transactions[transaction_hash] = transaction_status
 
     def verify_add_extra_connection(self, action):
         """Extra connections are optional and rarely needed. If one of the PYOMers in
@@ -469,34 +797,112 @@ class Verifier(object):
         fpr = action['gpg']
         self.verify_fpr(fpr)
         ref_content1 = load_fileref(
-            self.location_array_root, action['block_ref'])
+            self.location_array_root, action['block_ref'], self.limits.max_block_size)
         sig_content1 = load_fileref(
-            self.location_array_root, action['block_sig'])
+            self.location_array_root, action['block_sig'], self.limits.max_block_size)
         block_ref = check_blockref_sig(
-            self.gpg_ctx, fpr, ref_content1, sig_content1)
+            self.gpg_ctx, fpr, ref_content1, sig_content1, self.rotations(fpr))
         self.extra_connections[fpr] = block_ref
 
+    def verify_rotate_key(self, block_idx, action):
+        """The owner switches to a new signing key, from the next block on.
+        The statement is signed by both the old and the new key, and the
+        block itself is signed by the old key.
+        """
+        rotations = self.rotations(self.fpr)
+        if len(rotations) > 0 and rotations[-1]['idx'] == block_idx:
+            raise Exception('rotate_key: key already rotated in this block')
+        statement = check_key_rotation(self.gpg_ctx, self.location_array_root, action, self.fpr,
+                                       self.signer_fpr, self.limits.max_fileref_size)
+        if statement['idx'] != block_idx:
+            raise Exception('rotate_key: wrong block idx')
+        self.add_key_rotation(self.fpr, block_idx, action)
+
+    def verify_import_key_rotation(self, action):
+        """Another PYOMer has rotated their key. Their blocks are checked
+        against the new key from then on.
+        """
+        statement = parse_json(load_fileref(
+            self.location_array_root, action['statement'], self.limits.max_fileref_size))
+        owner = statement['owner']
+        self.verify_fpr(owner)
+        if owner == self.fpr:
+            raise Exception('import_key_rotation: use rotate_key')
+        rotations = self.rotations(owner)
+        idx = statement['idx']
+        if len(rotations) > 0 and not (rotations[-1]['idx'] < idx):
+            raise Exception('import_key_rotation: rotations are out of order')
+        check_key_rotation(self.gpg_ctx, self.location_array_root, action, owner,
+                           signer_at(owner, rotations, idx), self.limits.max_fileref_size)
+        self.add_key_rotation(owner, idx, action)
+
+    def add_key_rotation(self, fpr, idx, action):
+        # Assign a new list, so that a state store or history sees the change.
+        self.key_rotations[fpr] = self.rotations(
+            fpr) + [key_rotation_entry(idx, action)]
+
     def verify_fpr(self, fpr):
         if fpr not in self.known_gpg_keys:
             raise Exception('unknown gpg key: ' + fpr)
 
-    def append_block(self, gpg_ctx, protoblock):
+    def append_block(self, gpg_ctx, protoblock, fsync_policy=None):
         """Utility for creating a new block at the end of the chain."""
-        block_timestamp = datetime.now(timezone.utc)
-        self.verify_block_body(block_timestamp, self.nextidx, protoblock)
-        create_block(gpg_ctx, self.rootdir, self.nextidx,
-                     self.fpr, protoblock, block_timestamp)
+        return self.append_blocks(gpg_ctx, [protoblock], fsync_policy)[0]
 
+    def append_blocks(self, gpg_ctx, protoblocks, fsync_policy=None):
+        """Utility for creating several new blocks at the end of the chain.
+        Each protoblock is checked against the state left behind by the
+        previous ones, then all the blockrefs are signed in one go and the
+        files are written. Returns the new blocks.
 
-def verify_chain(rootdir):
+        The state can't be rolled back (it might be in a StateStore), so if
+        anything fails after the first protoblock has been applied, the
+        Verifier is marked stale and refuses to be used again.
+        """
+        self.check_not_stale()
+        # The batch is signed in one go, by one key.
+        for protoblock in protoblocks[:-1]:
+            if any(map(lambda action: action.get('type') == 'rotate_key',
+                       protoblock.get('actions', []))):
+                raise Exception(
+                    'append_blocks: a key rotation must be in the last block')
+        startidx = self.nextidx
+        signer_fpr = self.signer_fpr
+        timestamps = []
+        now = utc_now()
+        try:
+            for protoblock in protoblocks:
+                # Timestamps must be strictly increasing, even within a batch.
+                block_timestamp = now
+                if self.prev_timestamp is not None and not (self.prev_timestamp < block_timestamp):
+                    block_timestamp = self.prev_timestamp + \
+                        timedelta(microseconds=1)
+                self.verify_block_body(block_timestamp, self.nextidx, protoblock)
+                self.nextidx += 1
+                self.prev_hash = None
+                self.prev_timestamp = block_timestamp
+                timestamps.append(block_timestamp)
+            with signing_key(gpg_ctx, signer_fpr) if signer_fpr != self.fpr else contextlib.nullcontext():
+                return create_blocks(gpg_ctx, self.rootdir, startidx, self.fpr, protoblocks,
+                                     timestamps, fsync_policy, signer_fpr)
+        except Exception:
+            self.stale = True
+            raise
+
+
+def verify_chain(rootdir, state_store=None, history=None, limits=None):
     numblocks = check_blockchain_dir(rootdir)
     if numblocks == 0:
         raise Exception('no blocks found')
     gpg_ctx = init_local_gpg(rootdir.joinpath(gnupg_dirname))
-    v = Verifier(rootdir, gpg_ctx)
+    v = Verifier(rootdir, gpg_ctx, state_store, history, limits)
+    blocks = iter_block_files(rootdir, 0, numblocks,
+                              max_size=v.limits.max_block_size)
     for idx in range(0, numblocks):
         try:
-            v.verify_block(idx)
+            _, block_content, blockref_content, sig_content = next(blocks)
+            v.verify_block_files(idx, block_content,
+                                 blockref_content, sig_content)
         except Exception as e:
             print(f'Error in block {idx}:', e, file=sys.stderr)
             raise Exception(f'Blockchain verification failed in block {idx}')
@@ -504,4 +910,19 @@ def verify_chain(rootdir):
 
 
 if __name__ == "__main__":
-    verify_chain(pathlib.Path.cwd())
+    profile_from_argv()
+    if len(sys.argv) > 2 or (len(sys.argv) == 2 and sys.argv[1] != '--sqlite'):
+        print('usage: verifier [--sqlite]', file=sys.stderr)
+        sys.exit(1)
+    from .daemon import daemon_running, daemon_request
+    rootdir = pathlib.Path.cwd()
+    if len(sys.argv) == 2:
+        # Keep the state in a temporary database, for very large chains.
+        # The daemon keeps its state in memory, so it isn't used.
+        from .state_store import StateStore
+        verify_chain(rootdir, StateStore())
+    elif daemon_running(rootdir):
+        daemon_request(
+            rootdir, {'op': 'verify', 'rootdir': rootdir.as_posix()})
+    else:
+        verify_chain(rootdir)
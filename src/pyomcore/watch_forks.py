@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcore.
+#
+# pyomcore is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcore is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcore. If not, see <https://www.gnu.org/licenses/>.
+
+import sys
+from .utils import *
+from .verifier import (Verifier, check_block_sig, check_blockref_sig, check_key_rotation,
+                       key_rotation_entry, verify_chain)
+from .group_commit import repo_lock
+from .add_ban import add_ban
+from .rotate_key import copy_key_rotations
+
+# The fork watcher keeps a copy of every blockref and signature that it
+# has seen in the mirrors created by sync_peers. If a mirror later has a
+# different blockref at an index that was already seen, then the PYOMer
+# has forked their blockchain, and the old and new blockrefs are the
+# evidence that the 'ban' action needs.
+#
+# Mirrors come from peers, so nothing in them is trusted: new blocks are
+# only copied after their signatures and hash links have been checked,
+# and a mirror that fails is rejected without stopping the other checks.
+# The key rotations in the new blocks are checked and kept in the state,
+# so that blocks signed by a rotated key can be checked too. Their
+# evidence is copied to key_rotations/<idx>/ in the watch directory.
+fork_watch_dirname = pathlib.PurePath('fork_watch')
+fork_watch_state_filename = pathlib.PurePath('state.json')
+
+
+def blockref_hash(ref_content):
+    return parse_json(ref_content)['SHA-512']
+
+
+def import_mirror_key(gpg_ctx, fpr, mirror):
+    """Import the key in the mirror's public.key, which must be fpr's.
+    Returns the key file's content.
+    """
+    key_content = read_file(mirror.joinpath(
+        block0_pubkey_filename), default_limits.max_fileref_size)
+    if import_key(gpg_ctx, key_content) != fpr:
+        raise Exception('public key doesn\'t match: ' + fpr)
+    return key_content
+
+
+def copy_blockrefs(gpg_ctx, fpr, watchdir, mirror, start, stop, rotations):
+    """Check the mirror's blocks from start up to stop, then copy their
+    blockrefs. Each block must be signed by fpr's key at the time, and
+    linked to the one before it, so that the most recent blockref stands
+    for all of them. rotations are fpr's key rotations before start.
+    Returns them, with the rotations in the new blocks added.
+    """
+    prev_hash = None
+    if start > 0:
+        prev_hash = blockref_hash(read_file(
+            watchdir.joinpath(blockfilename(start - 1, block_ext_ref))))
+    contents = []
+    for idx, block_content, ref_content, sig_content in iter_block_files(
+            mirror, start, stop, max_size=default_limits.max_block_size):
+        block = check_block_sig(gpg_ctx, fpr, block_content, ref_content,
+                                sig_content, default_limits.max_json_depth, rotations)
+        if block['idx'] != idx:
+            raise Exception('bad index in block ' + str(idx))
+        if idx > 0 and block['prev']['SHA-512'] != prev_hash:
+            raise Exception('block ' + str(idx) +
+                            ' isn\'t linked to the block before it')
+        prev_hash = blockref_hash(ref_content)
+        contents.append((idx, ref_content, sig_content))
+        for action in block['actions']:
+            if action['type'] != 'rotate_key':
+                continue
+            statement = check_key_rotation(gpg_ctx, [mirror], action, fpr, signer_at(
+                fpr, rotations, idx), default_limits.max_fileref_size)
+            if statement['idx'] != idx:
+                raise Exception('rotate_key: wrong block idx in block ' + str(idx))
+            # Keep a copy: the mirror can change. The filenames are the
+            # peer's, so the copy goes in a directory of its own.
+            rotation = key_rotation_entry(idx, action)
+            dirname = key_rotations_dirname.joinpath(str(idx))
+            watchdir.joinpath(dirname).mkdir(parents=True, exist_ok=True)
+            for name in ['keyfile', 'statement', 'old_sig', 'new_sig']:
+                content = load_fileref(
+                    [mirror], action[name], default_limits.max_fileref_size)
+                path = dirname.joinpath(name)
+                watchdir.joinpath(path).write_bytes(content)
+                rotation[name] = create_fileref_from_content(0, path, content)
+            rotations = rotations + [rotation]
+    for idx, ref_content, sig_content in contents:
+        for ext, content in [(block_ext_ref, ref_content), (block_ext_sig, sig_content)]:
+            path = watchdir.joinpath(blockfilename(idx, ext))
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(content)
+    return rotations
+
+
+def fork_evidence(gpg_ctx, fpr, watchdir, mirror, idx, rotations):
+    """Check that both versions of block idx are signed by fpr's key at
+    the time. If they are, then this is a genuine fork, so return the
+    evidence.
+    """
+    ref_content1 = read_file(watchdir.joinpath(
+        blockfilename(idx, block_ext_ref)))
+    sig_content1 = read_file(watchdir.joinpath(
+        blockfilename(idx, block_ext_sig)))
+    ref_content2 = read_file(mirror.joinpath(
+        blockfilename(idx, block_ext_ref)), default_limits.max_block_size)
+    sig_content2 = read_file(mirror.joinpath(
+        blockfilename(idx, block_ext_sig)), default_limits.max_block_size)
+    key_content = import_mirror_key(gpg_ctx, fpr, mirror)
+    check_blockref_sig(gpg_ctx, fpr, ref_content1, sig_content1, rotations)
+    check_blockref_sig(gpg_ctx, fpr, ref_content2, sig_content2, rotations)
+    return {
+        'gpg': fpr,
+        'idx': idx,
+        'key_content': key_content,
+        'git_remote_urls': git_repo_remote_urls(mirror),
+        'ref_content1': ref_content1,
+        'sig_content1': sig_content1,
+        'ref_content2': ref_content2,
+        'sig_content2': sig_content2,
+        # Their filerefs are relative to the watch directory.
+        'key_rotations': rotations,
+        'watchdir': watchdir
+    }
+
+
+def watch_fork(gpg_ctx, mirrordir, fpr):
+    """Compare the mirror of fpr's blockchain with what was seen before.
+    The blocks are hash-linked, so if the most recent block that is in both
+    is unchanged then so is everything before it. That means that only one
+    blockref is compared, plus the new ones are copied: the cost doesn't
+    depend on the length of the chain. Returns fork evidence, or None.
+    """
+    mirror = mirrordir.joinpath(fpr)
+    watchdir = mirrordir.joinpath(fork_watch_dirname).joinpath(fpr)
+    state_path = watchdir.joinpath(fork_watch_state_filename)
+    state = {'numblocks': 0, 'key_rotations': []}
+    if state_path.exists():
+        state = json.loads(state_path.read_bytes())
+    rotations = state.get('key_rotations', [])
+    try:
+        numblocks = 1 + most_recent_block_idx(mirror)
+    except Exception:
+        # Not a PYOM blockchain.
+        return None
+    seen = state['numblocks']
+    idx = min(seen, numblocks) - 1
+    if idx >= 0:
+        old_hash = blockref_hash(read_file(watchdir.joinpath(
+            blockfilename(idx, block_ext_ref))))
+        new_hash = blockref_hash(read_file(mirror.joinpath(
+            blockfilename(idx, block_ext_ref)), default_limits.max_block_size))
+        if old_hash != new_hash:
+            # Keep the old blockrefs: they're the evidence.
+            return fork_evidence(gpg_ctx, fpr, watchdir, mirror, idx, rotations)
+    if numblocks > seen:
+        import_mirror_key(gpg_ctx, fpr, mirror)
+        state['key_rotations'] = copy_blockrefs(
+            gpg_ctx, fpr, watchdir, mirror, seen, numblocks, rotations)
+        state['numblocks'] = numblocks
+        state_path.write_bytes(json.dumps(state, indent=2).encode('utf-8'))
+    return None
+
+
+def watch_forks(mirrordir, fprs, rejected=None):
+    """Run watch_fork on every mirror. Returns a list of fork evidence.
+    A mirror that fails its checks is reported on stderr, and in rejected
+    (a dict from fpr to the error message), if it's given.
+    """
+    gpg_ctx = init_local_gpg(mirrordir.joinpath(
+        fork_watch_dirname).joinpath(gnupg_dirname))
+    evidence = []
+    for fpr in fprs:
+        try:
+            e = watch_fork(gpg_ctx, mirrordir, fpr)
+        except Exception as error:
+            print(fpr + ': mirror rejected: ' + str(error), file=sys.stderr)
+            if rejected is not None:
+                rejected[fpr] = str(error)
+            continue
+        if e is not None:
+            evidence.append(e)
+    return evidence
+
+
+def ban_forks(gpg_ctx, rootdir, evidence):
+    """Add a ban to your blockchain for each fork that isn't banned yet.
+    gpg_ctx should be ~/.gnupg
+    """
+    with repo_lock(rootdir):
+        v = verify_chain(rootdir)
+        for e in evidence:
+            if not v.is_banned(e['gpg']):
+                add_ban(gpg_ctx, v, e['gpg'], e['idx'], e['key_content'], e['git_remote_urls'],
+                        e['ref_content1'], e['sig_content1'], e['ref_content2'], e['sig_content2'],
+                        copy_key_rotations(v, e['gpg'], e['key_rotations'], e['watchdir']))
+
+
+if __name__ == "__main__":
+    profile_from_argv()
+    if len(sys.argv) == 3 and sys.argv[2] == '--ban':
+        ban = True
+    elif len(sys.argv) == 2:
+        ban = False
+    else:
+        print('usage: watch_forks path/to/mirrordir [--ban]', file=sys.stderr)
+        sys.exit(1)
+    rootdir = pathlib.Path.cwd()
+    mirrordir = pathlib.Path(sys.argv[1]).resolve()
+    fprs = sorted(filter(lambda p: re.fullmatch(
+        r'[0-9A-F]{40,64}', p), map(lambda p: p.name, mirrordir.iterdir())))
+    evidence = watch_forks(mirrordir, fprs)
+    for e in evidence:
+        print(e['gpg'] + ': fork at block ' + str(e['idx']))
+    if ban and len(evidence) > 0:
+        ban_forks(gpg.Context(), rootdir, evidence)
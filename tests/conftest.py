@@ -0,0 +1,77 @@
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcore.
+#
+# pyomcore is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcore is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcore. If not, see <https://www.gnu.org/licenses/>.
+
+# pytest fixtures. The users' repos are created once per session, from
+# the pre-generated keys, and every test gets a fresh copy of them.
+
+import shutil
+import pytest
+from pyomcore.utils import *
+from pyomcore.clock import FakeClock, use_clock
+from helpers import create_test_user
+
+numusers = 4
+
+# These are scripts that take arguments. The CI workflow runs them.
+collect_ignore = ['test_import_time.py',
+                  'test_pyomcore.py', 'test_sync_peers.py']
+
+
+class User(object):
+    def __init__(self, name, gpg_dir, rootdir):
+        self.name = name
+        self.gpg_dir = gpg_dir
+        self.rootdir = rootdir
+
+    def gpg_ctx(self):
+        return gpg.Context(home_dir=self.gpg_dir.as_posix())
+
+    def participant(self):
+        return {'rootdir': self.rootdir, 'locations_init': [], 'protoblock_init': {}}
+
+    def append(self, protoblock):
+        """Add a block without verifying the chain."""
+        idx = most_recent_block_idx(self.rootdir)
+        fpr = load_block(self.rootdir, 0)['owner']['gpg']
+        return create_block(self.gpg_ctx(), self.rootdir, idx + 1, fpr, protoblock)
+
+
+@pytest.fixture
+def clock():
+    """A FakeClock, used by pyomcore for the duration of the test. Use
+    clock.advance() instead of sleeping.
+    """
+    with use_clock(FakeClock()) as fake_clock:
+        yield fake_clock
+
+
+@pytest.fixture(scope='session')
+def template_dir(tmp_path_factory):
+    workdir = tmp_path_factory.mktemp('template')
+    for i in range(0, numusers):
+        create_test_user(workdir.joinpath(f'user{i}'), i)
+    return workdir
+
+
+@pytest.fixture
+def users(template_dir, tmp_path, clock):
+    """numusers users, each with a blockchain that has only block 0."""
+    workdir = tmp_path.joinpath('users')
+    # gpg-agent's sockets can't be copied.
+    shutil.copytree(template_dir, workdir,
+                    ignore=shutil.ignore_patterns('S.*'))
+    return list(map(lambda i: User(f'user{i}', workdir.joinpath(f'user{i}', 'gnupg'),
+                                       workdir.joinpath(f'user{i}', 'pyom')), range(0, numusers)))
@@ -0,0 +1,59 @@
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcore.
+#
+# pyomcore is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcore is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcore. If not, see <https://www.gnu.org/licenses/>.
+
+# Helpers shared by the test scripts and the pytest fixtures in
+# conftest.py.
+#
+# keys/ has pre-generated ed25519 secret keys without passphrases, so
+# that the tests don't have to generate keys. They are only for tests.
+# They were made with:
+#   gpg --batch --passphrase '' --quick-gen-key userN ed25519 sign,cert never
+#   gpg --armor --export-secret-keys userN > keys/userN.asc
+
+from pyomcore.utils import *
+from pyomcore.initialize_blockchain import ignore_local_state
+
+keys_dir = pathlib.Path(__file__).resolve().parent.joinpath('keys')
+numkeys = 6
+
+
+def import_test_key(gpg_dir, i):
+    """Create a gnupg home directory in gpg_dir, with the secret key of
+    user i. Returns a gpg context for it.
+    """
+    if not (0 <= i < numkeys):
+        raise Exception('there are only ' + str(numkeys) + ' test keys')
+    gpg_ctx = init_local_gpg(gpg_dir)
+    gpg_ctx.key_import(keys_dir.joinpath(f'user{i}.asc').read_bytes())
+    return gpg_ctx
+
+
+def create_test_user(userdir, i):
+    """Like initialize_blockchain, but with test key i, and without the
+    pyomcore smart contract. Returns (gpg_dir, rootdir).
+    """
+    gpg_dir = userdir.joinpath('gnupg')
+    gpg_ctx = import_test_key(gpg_dir, i)
+    rootdir = userdir.joinpath('pyom')
+    rootdir.mkdir(parents=True)
+    result = subprocess.run(
+        ['git', '-C', rootdir.as_posix(), 'init'], capture_output=True)
+    result.check_returncode()
+    ignore_local_state(rootdir)
+    fpr = export_block0_pubkey(gpg_ctx, rootdir)
+    create_block0(gpg_ctx, rootdir, fpr)
+    init_local_gpg(rootdir.joinpath(gnupg_dirname))
+    return gpg_dir, rootdir
@@ -0,0 +1,144 @@
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcore.
+#
+# pyomcore is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcore is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcore. If not, see <https://www.gnu.org/licenses/>.
+
+# Exporting and importing bundles.
+#
+# usage: python -m pytest tests/
+
+from datetime import timedelta
+import io
+import pytest
+from pyomcore.utils import *
+from pyomcore.verifier import verify_chain, check_blockchain_dir
+from pyomcore.confirm_transactions import confirm_transactions
+from pyomcore.bundle import (export_bundle, import_bundle, read_bundle_header, read_bundle_index,
+                             linked_files, path_len_format, data_len_format, bundle_magic,
+                             BundleWriter)
+
+
+@pytest.fixture
+def chain(users, clock):
+    """users[0]'s blockchain, with a confirmed and a cancelled transaction."""
+    participants = list(map(lambda user: user.participant(), users))
+    for user, protoblock in zip(users, create_transaction(participants, timedelta(days=1))):
+        user.append(protoblock)
+    users[0].append(create_transaction(participants, timedelta(seconds=2))[0])
+    clock.advance(timedelta(seconds=3))
+    for user in users:
+        user.append({'actions': []})
+    for that_user in users:
+        confirm_transactions(users[0].gpg_ctx(), users[0].rootdir,
+                             that_user.rootdir, confirm_only=False)
+    return users[0].rootdir
+
+
+def export(rootdir, start=0, stop=None):
+    f = io.BytesIO()
+    index = export_bundle(rootdir, f, start, stop)
+    return f.getvalue(), index
+
+
+def test_round_trip(chain, tmp_path):
+    content, index = export(chain)
+    mirror = tmp_path.joinpath('mirror')
+    header = import_bundle(io.BytesIO(content), mirror)
+    assert header['stop'] == most_recent_block_idx(chain) + 1
+    for entry in index:
+        assert mirror.joinpath(entry['path']).read_bytes() == \
+            chain.joinpath(entry['path']).read_bytes()
+    assert read_bundle_index(io.BytesIO(content)) == index
+    verify_chain(mirror)
+    # Importing again changes nothing.
+    import_bundle(io.BytesIO(content), mirror)
+
+
+def test_ranges(chain, tmp_path):
+    mirror = tmp_path.joinpath('mirror')
+    stop = most_recent_block_idx(chain) + 1
+    with pytest.raises(Exception, match='is missing'):
+        import_bundle(io.BytesIO(export(chain, 3)[0]), mirror)
+    import_bundle(io.BytesIO(export(chain, 0, 3)[0]), mirror)
+    assert most_recent_block_idx(mirror) == 2
+    import_bundle(io.BytesIO(export(chain, 3, stop)[0]), mirror)
+    assert verify_chain(mirror).nextidx == stop
+
+
+def test_corrupt(chain, tmp_path):
+    content, index = export(chain)
+    offset = index[-1]['offset']
+    corrupt = content[:offset] + bytes([content[offset] ^ 1]) + content[offset + 1:]
+    with pytest.raises(Exception, match='hash mismatch'):
+        import_bundle(io.BytesIO(corrupt), tmp_path.joinpath('mirror'))
+
+
+@pytest.mark.parametrize('path', [blockfilename(1, block_ext_sig).as_posix(),
+                                  blockfilename(1, block_ext_ref).as_posix(), 'transactions'])
+def test_interrupted(chain, tmp_path, path):
+    """The bundle ends in the middle of a record: only complete blocks are
+    written, and the error is the one from reading the bundle.
+    """
+    content, index = export(chain)
+    entry = next(filter(lambda entry: entry['path'].startswith(path), index))
+    mirror = tmp_path.joinpath('mirror')
+    with pytest.raises(Exception, match='unexpected end of file'):
+        import_bundle(io.BytesIO(content[:entry['offset'] + 1]), mirror)
+    assert check_blockchain_dir(mirror) == 1
+    assert list(mirror.joinpath(blockchain_dirname).rglob('*.tmp')) == []
+
+
+def test_hole(chain, tmp_path):
+    f = io.BytesIO()
+    writer = BundleWriter(f, {'pyom_version': pyom_version_number, 'gpg': 'X',
+                              'start': 0, 'stop': 3})
+    writer.add_file(chain, block0_pubkey_filename)
+    for idx in [0, 2]:
+        for relpath in linked_files(chain, load_block(chain, idx)):
+            writer.add_file(chain, relpath)
+        for ext in [block_ext_json, block_ext_ref, block_ext_sig]:
+            writer.add_file(chain, blockfilename(idx, ext))
+    writer.finish()
+    mirror = tmp_path.joinpath('mirror')
+    with pytest.raises(Exception, match='unexpected block file'):
+        import_bundle(io.BytesIO(f.getvalue()), mirror)
+    assert check_blockchain_dir(mirror) == 1
+
+
+def test_existing_file_differs(chain, tmp_path):
+    mirror = tmp_path.joinpath('mirror')
+    mirror.mkdir()
+    mirror.joinpath(block0_pubkey_filename).write_bytes(b'not the key')
+    with pytest.raises(Exception, match='different file'):
+        import_bundle(io.BytesIO(export(chain)[0]), mirror)
+
+
+def bundle_with_file(path, data=b'x'):
+    """A bundle with one record, for path."""
+    header = json.dumps({'pyom_version': pyom_version_number, 'gpg': 'X',
+                        'start': 0, 'stop': 1}).encode('utf-8')
+    return (bundle_magic + path_len_format.pack(len(header)) + header +
+            path_len_format.pack(len(path)) + path + data_len_format.pack(len(data)) + data +
+            hashlib.sha512(data).digest() + path_len_format.pack(0))
+
+
+@pytest.mark.parametrize('path', [b'../escape', b'/tmp/escape', b'.git/config', b'.pyom/tmp/x',
+                                  b'gnupg/gpg.conf', b'transactions/.hidden', b'junk/x',
+                                  b'blockchain'])
+def test_bad_paths(tmp_path, path):
+    mirror = tmp_path.joinpath('mirror')
+    with pytest.raises(Exception, match='bad path|not allowed'):
+        import_bundle(io.BytesIO(bundle_with_file(path)), mirror)
+    assert not tmp_path.joinpath('escape').exists()
+    assert not mirror.exists() or len(list(mirror.iterdir())) == 0
@@ -0,0 +1,118 @@
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcore.
+#
+# pyomcore is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcore is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcore. If not, see <https://www.gnu.org/licenses/>.
+
+# Requests to the daemon, over its socket.
+#
+# usage: python -m pytest tests/
+
+import socket
+import threading
+import pytest
+from pyomcore.utils import *
+from pyomcore.daemon import (Daemon, DaemonRequestHandler, daemon_server, daemon_request,
+                             daemon_serves, daemon_socket_path)
+
+
+@pytest.fixture(params=[False, True], ids=['no_history', 'history'])
+def daemon(request, users):
+    """A daemon for users[0], serving requests in a thread."""
+    user = users[0]
+    with daemon_server(Daemon(user.rootdir, user.gpg_ctx(), request.param)) as server:
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            yield server.daemon
+        finally:
+            server.shutdown()
+            thread.join()
+
+
+def verify(rootdir):
+    return daemon_request(rootdir, {'op': 'verify', 'rootdir': rootdir.as_posix()})
+
+
+def remove_block(rootdir, idx):
+    for ext in [block_ext_json, block_ext_ref, block_ext_sig]:
+        rootdir.joinpath(blockfilename(idx, ext)).unlink()
+
+
+def test_info(users, daemon):
+    rootdir = users[0].rootdir
+    assert daemon_request(rootdir, {'op': 'info'}) == {'rootdir': rootdir.as_posix()}
+    assert daemon_serves(rootdir)
+    assert not daemon_serves(users[1].rootdir)
+
+
+def test_socket_mode(users, daemon):
+    path = daemon_socket_path(users[0].rootdir)
+    assert stat.S_IMODE(path.stat().st_mode) == 0o600
+
+
+def test_silent_client(users, daemon, monkeypatch):
+    """A client that never sends its request doesn't block the daemon."""
+    monkeypatch.setattr(DaemonRequestHandler, 'timeout', 0.5)
+    rootdir = users[0].rootdir
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(daemon_socket_path(rootdir).as_posix())
+        assert verify(rootdir)['numblocks'] == 1
+
+
+def test_verify(users, daemon):
+    rootdir = users[0].rootdir
+    assert verify(rootdir) == {'fpr': load_block(rootdir, 0)['owner']['gpg'],
+                               'numblocks': 1}
+
+
+def test_append(users, daemon):
+    rootdir = users[0].rootdir
+    protoblocks = [{'actions': []}, {'actions': []}]
+    assert daemon_request(rootdir, {'op': 'append', 'rootdir': rootdir.as_posix(),
+                                    'protoblocks': protoblocks}) == {'idx': [1, 2]}
+    assert most_recent_block_idx(rootdir) == 2
+    assert verify(rootdir)['numblocks'] == 3
+    with pytest.raises(Exception, match='daemon serves a different blockchain'):
+        daemon_request(rootdir, {'op': 'append', 'rootdir': users[1].rootdir.as_posix(),
+                                 'protoblocks': protoblocks})
+
+
+def test_stale_cache(users, daemon):
+    user = users[0]
+    assert verify(user.rootdir)['numblocks'] == 1
+    # Blocks written by somebody else are picked up.
+    user.append({'actions': []})
+    user.append({'actions': []})
+    assert verify(user.rootdir)['numblocks'] == 3
+    # The chain shrinks: the last verified block is gone.
+    remove_block(user.rootdir, 2)
+    assert verify(user.rootdir)['numblocks'] == 2
+    # The last verified block is rewritten.
+    remove_block(user.rootdir, 1)
+    user.append({'actions': []})
+    assert verify(user.rootdir)['numblocks'] == 2
+    assert daemon.chain(user.rootdir).v.nextidx == 2
+
+
+def test_query_history(users, daemon):
+    user = users[0]
+    user.append({'actions': []})
+    request = {'op': 'query', 'rootdir': user.rootdir.as_posix(), 'idx': 0}
+    if daemon.history:
+        assert daemon_request(user.rootdir, request)['numblocks'] == 1
+    else:
+        with pytest.raises(Exception, match='without --history'):
+            daemon_request(user.rootdir, request)
+    del request['idx']
+    assert daemon_request(user.rootdir, request)['numblocks'] == 2
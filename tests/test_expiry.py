@@ -0,0 +1,113 @@
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcore.
+#
+# pyomcore is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcore is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcore. If not, see <https://www.gnu.org/licenses/>.
+
+# Transaction expiry and cancellation, with a fake clock.
+#
+# usage: python -m pytest tests/
+
+from datetime import timedelta
+import pytest
+from pyomcore.utils import *
+from pyomcore.verifier import TransactionState, verify_chain
+from pyomcore.confirm_transactions import confirm_transactions
+from pyomcore.clock import use_clock, SystemClock
+
+
+def register(users, expiry_delta):
+    """Create a transaction between all of users, and register it on the
+    blockchains of the first two. Returns the transaction hash.
+    """
+    protoblocks = create_transaction(
+        list(map(lambda user: user.participant(), users)), expiry_delta)
+    for user, protoblock in list(zip(users, protoblocks))[0:2]:
+        user.append(protoblock)
+    return protoblocks[0]['actions'][-1]['transaction']['SHA-512']
+
+
+def confirm_all(users):
+    for this_user in users:
+        for that_user in users:
+            confirm_transactions(this_user.gpg_ctx(), this_user.rootdir,
+                                 that_user.rootdir, confirm_only=False)
+
+
+def state(user, transaction_hash):
+    return verify_chain(user.rootdir).transactions[transaction_hash].state
+
+
+def test_expired_transaction_is_cancelled(users, clock):
+    transaction_hash = register(users, timedelta(seconds=2))
+    clock.advance(timedelta(seconds=3))
+    for user in users:
+        user.append({'actions': []})
+    confirm_all(users)
+    for user in users[0:2]:
+        assert state(user, transaction_hash) == TransactionState.CANCELLED
+    for user in users[2:]:
+        assert not transaction_hash in verify_chain(user.rootdir).transactions
+
+
+def test_no_cancel_before_expiry(users, clock):
+    transaction_hash = register(users, timedelta(days=1))
+    clock.advance(timedelta(hours=23))
+    for user in users:
+        user.append({'actions': []})
+    confirm_all(users)
+    for user in users[0:2]:
+        assert state(user, transaction_hash) == TransactionState.PENDING
+
+
+def test_no_cancel_without_a_block_after_expiry(users, clock):
+    transaction_hash = register(users, timedelta(seconds=2))
+    clock.advance(timedelta(seconds=3))
+    # The other users haven't added any blocks since the expiry, so there
+    # is no evidence that they didn't register the transaction in time.
+    confirm_all(users[0:2])
+    for that_user in users[2:]:
+        confirm_transactions(users[0].gpg_ctx(), users[0].rootdir,
+                             that_user.rootdir, confirm_only=False)
+    assert state(users[0], transaction_hash) == TransactionState.PENDING
+
+
+def test_register_after_expiry(users, clock):
+    protoblocks = create_transaction(
+        list(map(lambda user: user.participant(), users)), timedelta(hours=1))
+    clock.advance(timedelta(hours=2))
+    v = verify_chain(users[0].rootdir)
+    with pytest.raises(Exception, match='bad transaction expiry'):
+        v.append_block(users[0].gpg_ctx(), protoblocks[0])
+
+
+def test_confirmed_before_expiry(users, clock):
+    protoblocks = create_transaction(
+        list(map(lambda user: user.participant(), users)), timedelta(minutes=5))
+    transaction_hash = protoblocks[0]['actions'][-1]['transaction']['SHA-512']
+    for user, protoblock in zip(users, protoblocks):
+        clock.advance(timedelta(minutes=1))
+        user.append(protoblock)
+    clock.advance(timedelta(hours=1))
+    confirm_all(users)
+    for user in users:
+        assert state(user, transaction_hash) == TransactionState.CONFIRMED
+
+
+def test_timestamp_in_the_future(users, clock):
+    clock.advance(timedelta(days=1))
+    users[0].append({'actions': []})
+    verify_chain(users[0].rootdir)
+    with use_clock(SystemClock()):
+        with pytest.raises(Exception, match='verification failed in block 1'):
+            verify_chain(users[0].rootdir)
@@ -0,0 +1,78 @@
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcore.
+#
+# pyomcore is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcore is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcore. If not, see <https://www.gnu.org/licenses/>.
+
+# Committing the queue of submitted protoblocks.
+#
+# usage: python -m pytest tests/
+
+import pytest
+from pyomcore.utils import *
+from pyomcore import group_commit
+from pyomcore.group_commit import commit_pending, queue_dir, queue_ext_entry, queue_ext_result
+
+bad_protoblock = {'actions': [{'type': 'confirm_transaction', 'explanation': 'test',
+                               'transaction': {'SHA-512': '0' * 128}}]}
+
+
+def enqueue(rootdir, entries):
+    qdir = queue_dir(rootdir)
+    qdir.mkdir(parents=True, exist_ok=True)
+    for i, protoblocks in enumerate(entries):
+        qdir.joinpath(f'{i:020}' + queue_ext_entry).write_bytes(
+            json.dumps(protoblocks).encode('utf-8'))
+
+
+def results(rootdir, numentries):
+    qdir = queue_dir(rootdir)
+    assert list(qdir.glob('*' + queue_ext_entry)) == []
+    return list(map(lambda i: json.loads(qdir.joinpath(f'{i:020}' + queue_ext_result).read_bytes()),
+                    range(0, numentries)))
+
+
+def test_bad_entry(users, monkeypatch):
+    """Only the bad entries fail, and the chain is only verified again
+    after a failure.
+    """
+    user = users[0]
+    verified = []
+    verify_chain = group_commit.verify_chain
+    monkeypatch.setattr(group_commit, 'verify_chain',
+                        lambda rootdir: verified.append(rootdir) or verify_chain(rootdir))
+    enqueue(user.rootdir, [[{'actions': []}]] * 3 + [[bad_protoblock]] + [[{'actions': []}]] * 3)
+    commit_pending(user.gpg_ctx(), user.rootdir)
+    entry_results = results(user.rootdir, 7)
+    assert 'error' in entry_results.pop(3)
+    assert entry_results == list(map(lambda idx: {'idx': [idx]}, range(1, 7)))
+    # The fast path, the fallback, and once after the bad entry.
+    assert len(verified) == 3
+    assert most_recent_block_idx(user.rootdir) == 6
+
+
+def test_crash_after_append(users, monkeypatch):
+    """Blocks written before a crash aren't appended again."""
+    user = users[0]
+    enqueue(user.rootdir, [[{'actions': []}], [{'actions': [], 'note': 'test'}]])
+
+    def crash(qdir, name, result):
+        raise KeyboardInterrupt()
+    with monkeypatch.context() as m:
+        m.setattr(group_commit, 'write_result', crash)
+        with pytest.raises(KeyboardInterrupt):
+            commit_pending(user.gpg_ctx(), user.rootdir)
+    assert most_recent_block_idx(user.rootdir) == 2
+    commit_pending(user.gpg_ctx(), user.rootdir)
+    assert results(user.rootdir, 2) == [{'idx': [1]}, {'idx': [2]}]
+    assert most_recent_block_idx(user.rootdir) == 2
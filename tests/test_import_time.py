@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcore.
+#
+# pyomcore is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcore is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcore. If not, see <https://www.gnu.org/licenses/>.
+
+# Import-time budget for the pyom commands. Each command is imported in a
+# fresh interpreter with -X importtime. The import must not load gpg (it's
+# only needed once a signature is checked or created) and must fit in the
+# budget. The budget is a multiple of the time it takes to run
+# "python -c pass", so that it means the same on slow CI machines. A
+# command that goes over the budget is measured once more, in case the
+# machine was just busy.
+#
+# usage: test_import_time.py [budget as a multiple of "python -c pass"]
+
+import re
+import subprocess
+import sys
+import time
+from pyomcore.cli import commands
+
+
+def startup_us():
+    """The fastest of a few runs of an interpreter that does nothing."""
+    times = []
+    for i in range(0, 5):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'pass'], check=True)
+        times.append(time.perf_counter() - start)
+    return int(1000000 * min(times))
+
+
+def import_time_us(module):
+    script = ('import sys, ' + module + '\n' +
+              'print(sorted(m for m in sys.modules if m == "gpg.core" or m.startswith("gpg.")))')
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', script],
+                            capture_output=True)
+    result.check_returncode()
+    if result.stdout.decode().strip() != '[]':
+        raise Exception('importing ' + module + ' loads gpg: ' +
+                        result.stdout.decode().strip())
+    cumulative = None
+    for line in result.stderr.decode().splitlines():
+        m = re.fullmatch(
+            r'import time:\s+\d+ \|\s+(\d+) \| ' + re.escape(module), line)
+        if m:
+            cumulative = int(m.groups(0)[0])
+    if cumulative is None:
+        raise Exception('no import time for ' + module)
+    return cumulative
+
+
+baseline_us = startup_us()
+budget_us = baseline_us * (float(sys.argv[1]) if len(sys.argv) > 1 else 10)
+print(f'python -c pass: {baseline_us}us, budget: {int(budget_us)}us')
+
+# pyom itself must be nearly free: it only imports the subcommand's module.
+for module, budget in [('pyomcore.cli', budget_us / 5)] + list(map(lambda c: ('pyomcore.' + c, budget_us), commands)):
+    cumulative = import_time_us(module)
+    if cumulative > budget:
+        cumulative = min(cumulative, import_time_us(module))
+    if cumulative > budget:
+        raise Exception(f'importing {module} took {cumulative}us, budget is {int(budget)}us')
+    print(f'import {module}: {cumulative}us')
@@ -0,0 +1,100 @@
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcore.
+#
+# pyomcore is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcore is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcore. If not, see <https://www.gnu.org/licenses/>.
+
+# The verifier's limits on untrusted input.
+#
+# usage: python -m pytest tests/
+
+from datetime import timedelta
+import pytest
+from pyomcore.utils import *
+from pyomcore.verifier import verify_chain
+from pyomcore.confirm_transactions import confirm_transactions
+
+
+def nested(depth):
+    obj = []
+    for _ in range(0, depth - 1):
+        obj = [obj]
+    return obj
+
+
+def link_file_action(user):
+    return {'type': 'link_file', 'file': create_fileref(user.rootdir, 0, block0_pubkey_filename)}
+
+
+def check_fails(user, limits, message, capsys):
+    verify_chain(user.rootdir)
+    with pytest.raises(Exception, match='verification failed'):
+        verify_chain(user.rootdir, limits=limits)
+    assert message in capsys.readouterr().err
+
+
+def test_walkjson_is_not_recursive():
+    obj = nested(100000)
+    assert len(list(walkjson(obj))) == 100000
+    with pytest.raises(Exception, match='nested too deeply'):
+        check_json_depth(obj, 64)
+    check_json_depth(nested(64), 64)
+
+
+def test_parse_json_depth():
+    with pytest.raises(Exception, match='nested too deeply'):
+        parse_json(b'[' * 100000 + b']' * 100000)
+    with pytest.raises(Exception, match='nested too deeply'):
+        parse_json(json.dumps(nested(65)), 64)
+    parse_json(json.dumps(nested(64)), 64)
+
+
+def test_block_size(users, capsys):
+    users[0].append({'actions': [link_file_action(users[0])]})
+    check_fails(users[0], Limits(max_block_size=400),
+                'file is too large', capsys)
+
+
+def test_json_depth(users, capsys):
+    users[0].append({'actions': [], 'comment': nested(20)})
+    check_fails(users[0], Limits(max_json_depth=10),
+                'nested too deeply', capsys)
+
+
+def test_action_count(users, capsys):
+    users[0].append({'actions': [link_file_action(users[0])] * 3})
+    check_fails(users[0], Limits(max_actions=2),
+                'too many actions', capsys)
+
+
+def test_linked_file_size(users, capsys):
+    users[0].rootdir.joinpath('big.bin').write_bytes(b'x' * 1000)
+    users[0].append({'actions': [{'type': 'link_file', 'file': create_fileref(
+        users[0].rootdir, 0, pathlib.PurePath('big.bin'))}]})
+    check_fails(users[0], Limits(max_linked_file_size=999),
+                'file is too large', capsys)
+
+
+def test_cancel_blocks(users, clock, capsys):
+    protoblocks = create_transaction(
+        list(map(lambda user: user.participant(), users[0:2])), timedelta(seconds=2))
+    users[0].append(protoblocks[0])
+    # Three blocks of evidence: block 0, a block before the expiry that
+    # doesn't register the transaction, and a block after the expiry.
+    users[1].append({'actions': []})
+    clock.advance(timedelta(seconds=3))
+    users[1].append({'actions': []})
+    confirm_transactions(users[0].gpg_ctx(), users[0].rootdir,
+                         users[1].rootdir, confirm_only=False)
+    check_fails(users[0], Limits(max_cancel_blocks=2),
+                'too many blocks', capsys)
@@ -19,7 +19,6 @@
 import sys
 import pathlib
 import shutil
-import time
 from datetime import timedelta
 from pyomcore.utils import *
 from pyomcore.verifier import Verifier, check_blockchain_dir, verify_chain
@@ -32,6 +31,14 @@ from pyomcore.add_extra_connection import add_extra_connection
 from pyomcore.remove_extra_connection import remove_extra_connection
 from pyomcore.annul_transaction import annul_transaction
 from pyomcore.reinstate_transaction import reinstate_transaction
+from pyomcore.group_commit import submit_protoblock
+from pyomcore.state_history import StateHistory, state_tables
+from pyomcore.export_ledger import export_ledger, export_ledgers, export_filename
+from pyomcore.bundle import export_bundle, import_bundle, receive_bundle
+from pyomcore import tracing
+from pyomcore.clock import FakeClock, set_clock
+from helpers import import_test_key
+from concurrent.futures import ThreadPoolExecutor
 
 tmpdir = pathlib.Path(sys.argv[1])
 pyomcore_url = sys.argv[2]
@@ -39,6 +46,10 @@ pyomcore_url = sys.argv[2]
 tmpdir.mkdir(parents=True, exist_ok=True)
 tmpdir = tmpdir.resolve()
 
+# Use a fake clock, so that transactions can expire without sleeping.
+clock = FakeClock()
+set_clock(clock)
+
 users = []
 gpg_dirs = []
 rootdirs = []
@@ -51,9 +62,7 @@ for i in range(0, 4):
     userdir.mkdir(parents=True, exist_ok=True)
     # Create a directory to simulate the users ~/.gnupg
     gpg_dir = userdir.joinpath('gnupg')
-    gpg_dir.mkdir(parents=True, exist_ok=True)
-    gpg_ctx = init_local_gpg(gpg_dir)
-    gpg_ctx.create_key(name, algorithm='rsa4096', sign=True, certify=True)
+    gpg_ctx = import_test_key(gpg_dir, i)
     rootdir = userdir.joinpath('pyom')
     rootdir.mkdir(parents=True, exist_ok=True)
     result = subprocess.run(['git', 'clone', pyomcore_url, rootdir.joinpath(
@@ -113,9 +122,8 @@ for gpg_dir, rootdir, protoblock in list(zip(gpg_dirs, rootdirs, protoblocks))[0
     print('register transaction', rootdir.parent.name)
 
 # Let transaction expire
-print('start sleep(3)')
-time.sleep(3)
-print('stop sleep(3)')
+clock.advance(timedelta(seconds=3))
+print('advance clock 3s')
 
 # Add some trivial blocks
 for gpg_dir, rootdir in zip(gpg_dirs, rootdirs):
@@ -213,6 +221,122 @@ for gpg_dir, rootdir in zip(gpg_dirs[2:4], rootdirs[2:4]):
     copy_bans(gpg_ctx, rootdir, [rootdirs[1]])
     print('ban user0', rootdir.parent.name)
 
+# Append several blocks in one batch
+v = verify_chain(rootdirs[1])
+v.append_blocks(gpg.Context(home_dir=gpg_dirs[1].as_posix()),
+                [{'actions': []}, {'actions': []}, {'actions': []}])
+print('append_blocks', rootdirs[1].parent.name)
+
+# Concurrent submissions are coalesced into fewer blocks
+numblocks = check_blockchain_dir(rootdirs[2])
+with ThreadPoolExecutor(max_workers=8) as executor:
+    idxs = list(executor.map(lambda i: submit_protoblock(
+        gpg.Context(home_dir=gpg_dirs[2].as_posix()), rootdirs[2], {'actions': []}), range(0, 8)))
+if sorted(set(idxs)) != list(range(numblocks, check_blockchain_dir(rootdirs[2]))):
+    raise Exception('submit_protoblock: unexpected block indices')
+print('submit_protoblock', rootdirs[2].parent.name, idxs)
+
+# The block iterators match load_block
+numblocks = check_blockchain_dir(rootdirs[0])
+blocks = list(map(lambda idx: load_block(rootdirs[0], idx), range(0, numblocks)))
+if list(iter_blocks(rootdirs[0])) != blocks:
+    raise Exception('iter_blocks mismatch')
+if list(iter_blocks(rootdirs[0], 2, numblocks - 1, reverse=True)) != blocks[numblocks-2:1:-1]:
+    raise Exception('iter_blocks: reverse mismatch')
+actions = [(block['idx'], action) for block in blocks for action in block['actions']]
+if list(iter_actions(rootdirs[0])) != actions:
+    raise Exception('iter_actions mismatch')
+print('iter_blocks', rootdirs[0].parent.name)
+
+# Bundles of a chain with a smart contract. The contract isn't in the
+# bundle, so the receiver needs its own clone to verify the blocks.
+bundle_path = tmpdir.joinpath('user0.bundle')
+with open(bundle_path, 'wb') as f:
+    export_bundle(rootdirs[0], f)
+with open(bundle_path, 'rb') as f:
+    import_bundle(f, tmpdir.joinpath('imported'))
+if check_blockchain_dir(tmpdir.joinpath('imported')) != numblocks:
+    raise Exception('import_bundle: missing blocks')
+receiverdir = tmpdir.joinpath('received')
+result = subprocess.run(['git', 'clone', pyomcore_url, receiverdir.joinpath(
+    smart_contracts_dirname).joinpath('pyomcore').as_posix()], capture_output=True)
+result.check_returncode()
+with open(bundle_path, 'rb') as f:
+    if receive_bundle(f, receiverdir).nextidx != numblocks:
+        raise Exception('receive_bundle: missing blocks')
+print('bundle', rootdirs[0].parent.name)
+
+# Export the ledgers, then export again incrementally
+exportdir = tmpdir.joinpath('export')
+counts = export_ledgers(rootdirs, exportdir)
+if export_ledger(rootdirs[0], exportdir) != 0:
+    raise Exception('export_ledger: incremental export is not empty')
+owner = load_block(rootdirs[0], 0)['owner']['gpg']
+records = list(map(json.loads, exportdir.joinpath(
+    export_filename(rootdirs[0], owner, None)).read_text().splitlines()))
+if len(records) != counts[rootdirs[0]]:
+    raise Exception('export_ledger: unexpected number of records')
+# A copy of the same blockchain gets a file of its own.
+copydir = tmpdir.joinpath('export_copy')
+shutil.copytree(rootdirs[0], copydir, ignore=shutil.ignore_patterns('S.*'))
+if export_ledger(copydir, exportdir) != counts[rootdirs[0]] or \
+        len(list(exportdir.glob(owner + '.*.ndjson'))) != 2:
+    raise Exception('export_ledger: copies share a file')
+if [r['idx'] for r in records if r['record'] == 'blocks'] != list(range(0, check_blockchain_dir(rootdirs[0]))):
+    raise Exception('export_ledger: missing blocks')
+signs = [r for r in records if r['record'] == 'actions' and r['type'] == 'sign_transaction']
+signatures = [r for r in records if r['record'] == 'signatures']
+if len(signatures) == 0 or [(r['idx'], r['position'], r['gpg']) for r in signatures] != \
+        [(r['idx'], r['position'], r['gpg']) for r in signs]:
+    raise Exception('export_ledger: signatures mismatch')
+if any(r['type'] == 'sign_transaction' for r in records if r['record'] == 'transactions'):
+    raise Exception('export_ledger: sign_transaction is not a state change')
+print('export_ledger')
+
+# Trace a verification
+tracing.start_tracing()
+verify_chain(rootdirs[0])
+tracing.stop_tracing(tmpdir.joinpath('trace.json'))
+trace = json.loads(tmpdir.joinpath('trace.json').read_bytes())
+traced_blocks = [e['args']['idx'] for e in trace['traceEvents'] if e['name'] == 'verify_block']
+if traced_blocks != list(range(0, check_blockchain_dir(rootdirs[0]))):
+    raise Exception('tracing: missing verify_block spans')
+print('tracing')
+
+# Appending to a verified chain, and verifying the new block, costs the
+# same however long the chain is
+v = verify_chain(rootdirs[3])
+v_reader = verify_chain(rootdirs[3])
+with tracing.budget(gpg_verify=0, gpg_sign=1, gpg_key_import=0, git_subprocess=0, files_opened=1, json_parsed=0):
+    v.append_block(gpg.Context(
+        home_dir=gpg_dirs[3].as_posix()), {'actions': []})
+with tracing.budget(gpg_verify=1, gpg_sign=0, gpg_key_import=0, git_subprocess=0, files_opened=3, json_parsed=3):
+    v_reader.verify_blocks(v_reader.nextidx)
+print('resource budgets', rootdirs[3].parent.name)
+
+# The state history matches a replay up to each block
+history = StateHistory(snapshot_interval=3)
+verify_chain(rootdirs[0], history=history)
+gpg_ctx = init_local_gpg(rootdirs[0].joinpath(gnupg_dirname))
+v = Verifier(rootdirs[0], gpg_ctx)
+for idx in range(0, history.numblocks()):
+    v.verify_block(idx)
+    state = history.state_at(idx)
+    for name in state_tables:
+        expected = getattr(v, name)
+        actual = getattr(state, name)
+        if name == 'transactions':
+            expected = dict(map(lambda item: (
+                item[0], item[1].to_json()), expected.items()))
+            actual = dict(map(lambda item: (
+                item[0], item[1].to_json()), actual.items()))
+        if actual != dict(expected):
+            raise Exception(f'StateHistory: {name} mismatch in block {idx}')
+    for transaction_hash, transaction_status in v.transactions.items():
+        if history.transaction_at(transaction_hash, idx).to_json() != transaction_status.to_json():
+            raise Exception('StateHistory: transaction_at mismatch')
+print('state history', rootdirs[0].parent.name)
+
 # Verify
 for rootdir in rootdirs:
     verify_chain(rootdir)
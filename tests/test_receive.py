@@ -0,0 +1,115 @@
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcore.
+#
+# pyomcore is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcore is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcore. If not, see <https://www.gnu.org/licenses/>.
+
+# Verifying blocks while a bundle is received.
+#
+# usage: python -m pytest tests/
+
+from datetime import timedelta
+import io
+import shutil
+import socket
+import threading
+import pytest
+from pyomcore.utils import *
+from pyomcore.verifier import verify_chain
+from pyomcore.bundle import (export_bundle, receive_bundle, linked_files, read_bundle_header,
+                             BundleWriter)
+from test_bundle import chain, export, bundle_with_file
+
+
+def test_receive(chain, tmp_path):
+    mirror = tmp_path.joinpath('mirror')
+    stop = most_recent_block_idx(chain) + 1
+    v = receive_bundle(io.BytesIO(export(chain, 0, 3)[0]), mirror)
+    assert v.nextidx == 3
+    assert most_recent_block_idx(mirror) == 2
+    v = receive_bundle(io.BytesIO(export(chain, 3, stop)[0]), mirror, v)
+    assert v.nextidx == stop
+    assert verify_chain(mirror).nextidx == stop
+    # Blocks that are already there are checked, not verified again.
+    v = receive_bundle(io.BytesIO(export(chain)[0]), mirror)
+    assert v.nextidx == stop
+
+
+def test_bad_block_is_not_written(chain, tmp_path):
+    # Block 1 registers a transaction, so it links to files.
+    bad = 1
+    assert len(linked_files(chain, load_block(chain, bad))) > 0
+    forged = tmp_path.joinpath('forged')
+    shutil.copytree(chain, forged, ignore=shutil.ignore_patterns('S.*'))
+    path = forged.joinpath(blockfilename(bad, block_ext_json))
+    path.write_bytes(path.read_bytes().replace(b'"idx"', b'"idx" ', 1))
+    mirror = tmp_path.joinpath('mirror')
+    with pytest.raises(Exception, match='SHA-512 mismatch'):
+        receive_bundle(io.BytesIO(export(forged)[0]), mirror)
+    assert most_recent_block_idx(mirror) == bad - 1
+    assert not mirror.joinpath(blockfilename(bad, block_ext_json)).exists()
+    for relpath in linked_files(forged, load_block(forged, bad)):
+        assert not mirror.joinpath(relpath).exists()
+    assert verify_chain(mirror).nextidx == bad
+
+
+def test_truncated(chain, tmp_path):
+    content, index = export(chain)
+    entry = next(filter(lambda entry: entry['path'] ==
+                        blockfilename(2, block_ext_sig).as_posix(), index))
+    mirror = tmp_path.joinpath('mirror')
+    with pytest.raises(Exception):
+        receive_bundle(io.BytesIO(content[:entry['offset']]), mirror)
+    assert most_recent_block_idx(mirror) == 1
+
+
+def test_socket(chain, tmp_path):
+    sender, receiver = socket.socketpair()
+
+    def send():
+        with sender, sender.makefile('wb') as f:
+            export_bundle(chain, f)
+    thread = threading.Thread(target=send)
+    thread.start()
+    with receiver, receiver.makefile('rb') as f:
+        v = receive_bundle(f, tmp_path.joinpath('mirror'))
+        assert f.read() == b''
+    thread.join()
+    assert v.nextidx == most_recent_block_idx(chain) + 1
+
+
+def test_unlinked_file_is_removed(chain, tmp_path):
+    content, index = export(chain)
+    junk = transactions_dirname.joinpath('junk.bin')
+    chain.joinpath(junk).write_bytes(b'junk')
+    # Slip the junk in with block 1's files.
+    f = io.BytesIO()
+    writer = BundleWriter(f, read_bundle_header(io.BytesIO(content)))
+    for entry in index:
+        if entry['path'] == blockfilename(1, block_ext_json).as_posix():
+            writer.add_file(chain, junk)
+        writer.add_file(chain, pathlib.PurePath(entry['path']))
+    writer.finish()
+    mirror = tmp_path.joinpath('mirror')
+    with pytest.raises(Exception, match='doesn\'t link to'):
+        receive_bundle(io.BytesIO(f.getvalue()), mirror)
+    assert not mirror.joinpath(junk).exists()
+    assert most_recent_block_idx(mirror) == 0
+
+
+def test_local_state_is_refused(tmp_path):
+    mirror = tmp_path.joinpath('mirror')
+    for path in [b'gnupg/gpg.conf', b'.git/config', b'.pyom/tmp/x']:
+        with pytest.raises(Exception, match='bad path|not allowed'):
+            receive_bundle(io.BytesIO(bundle_with_file(path)), mirror)
+        assert not mirror.joinpath(path.decode('utf-8')).exists()
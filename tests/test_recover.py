@@ -0,0 +1,66 @@
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcore.
+#
+# pyomcore is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcore is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcore. If not, see <https://www.gnu.org/licenses/>.
+
+# Rolling back what a crash left in the blockchain directory.
+#
+# usage: python -m pytest tests/
+
+import os
+import subprocess
+import sys
+import pytest
+from pyomcore.utils import *
+from pyomcore.recover_blockchain import recover_blockchain_dir
+from pyomcore.verifier import verify_chain
+
+
+def test_recover(users):
+    user = users[0]
+    user.append({'actions': []})
+    user.append({'actions': []})
+    rootdir = user.rootdir
+    # A crash before the signature of block 2 was renamed into place.
+    rootdir.joinpath(blockfilename(2, block_ext_sig)).unlink()
+    expected = [rootdir.joinpath(blockfilename(2, block_ext_json)),
+                rootdir.joinpath(blockfilename(2, block_ext_ref))]
+    for idx, ext in [(1, block_ext_sig), (2, block_ext_sig), (3, block_ext_json)]:
+        path = rootdir.joinpath(blockfilename(idx, ext))
+        tmp_path = path.with_name(path.name + '.tmp')
+        tmp_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path.write_bytes(b'')
+        expected.append(tmp_path)
+    assert sorted(recover_blockchain_dir(rootdir)) == sorted(expected)
+    assert verify_chain(rootdir).nextidx == 2
+
+
+@pytest.mark.parametrize('name', ['0000000000000001.json.tmp.tmp',
+                                  '0000000000000100.json.tmp', 'x.tmp'])
+def test_unexpected_file(users, name):
+    """Temporary files that don't belong to a block in their directory are
+    left alone.
+    """
+    user = users[0]
+    user.append({'actions': []})
+    user.rootdir.joinpath(blockfilename(1, block_ext_json)).with_name(name).write_bytes(b'')
+    with pytest.raises(Exception, match='unexpected file in blockchain dir'):
+        recover_blockchain_dir(user.rootdir)
+
+
+def test_bad_fsync_policy():
+    result = subprocess.run([sys.executable, '-c', 'import pyomcore.utils'], capture_output=True,
+                            env=dict(os.environ, PYOM_FSYNC='ALWAYS'))
+    assert result.returncode != 0
+    assert b"PYOM_FSYNC must be one of NONE, BATCH, FILE, not: 'ALWAYS'" in result.stderr
@@ -0,0 +1,172 @@
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcore.
+#
+# pyomcore is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcore is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcore. If not, see <https://www.gnu.org/licenses/>.
+
+
+# Rotating the key that signs a blockchain.
+#
+# usage: python -m pytest tests/
+
+from datetime import timedelta
+import shutil
+import pytest
+from pyomcore.utils import *
+from pyomcore.verifier import verify_chain, is_signed_by
+from pyomcore.state_store import StateStore
+from pyomcore.confirm_transactions import confirm_transactions
+from pyomcore.rotate_key import rotate_key, create_rotate_key_action
+from pyomcore.add_ban import create_ban
+from pyomcore.state_digest import write_state_digest, read_state_digest, audit_state_digest
+from helpers import keys_dir
+
+# None of the users in conftest.py have this key.
+new_key = 5
+
+
+def add_key(user, i):
+    """Give user the secret key of test key i. Returns its fpr."""
+    return import_key(user.gpg_ctx(), keys_dir.joinpath(f'user{i}.asc').read_bytes())
+
+
+def append(user, protoblock):
+    """Like User.append, but signed by the current key."""
+    return verify_chain(user.rootdir).append_block(user.gpg_ctx(), protoblock)
+
+
+def test_rotate_key(users, clock):
+    user = users[0]
+    fpr = load_block(user.rootdir, 0)['owner']['gpg']
+    new_fpr = add_key(user, new_key)
+    gpg_ctx = user.gpg_ctx()
+    block = rotate_key(gpg_ctx, user.rootdir, new_fpr)
+    # The caller's context is left as it was.
+    assert not gpg_ctx.armor
+    assert gpg_ctx.signers == []
+    v = verify_chain(user.rootdir)
+    assert v.fpr == fpr
+    assert v.signer_fpr == new_fpr
+    assert verify_chain(user.rootdir, StateStore()).signer_fpr == new_fpr
+    # The block with the rotation is signed by the old key, the next one
+    # by the new key.
+    block = verify_chain(user.rootdir).append_block(gpg_ctx, {'actions': []})
+    assert gpg_ctx.signers == []
+    gpg_ctx = init_local_gpg(user.rootdir.joinpath(gnupg_dirname))
+    for idx, signer in [(block['idx'] - 1, fpr), (block['idx'], new_fpr)]:
+        assert is_signed_by(gpg_ctx, signer,
+                            read_file(user.rootdir.joinpath(blockfilename(idx, block_ext_ref))),
+                            read_file(user.rootdir.joinpath(blockfilename(idx, block_ext_sig))))
+    assert load_block(user.rootdir, block['idx'])['owner']['gpg'] == fpr
+    assert verify_chain(user.rootdir).nextidx == block['idx'] + 1
+
+
+def test_old_key_is_rejected(users, clock):
+    user = users[0]
+    rotate_key(user.gpg_ctx(), user.rootdir, add_key(user, new_key))
+    # User.append signs with the key in public.key.
+    user.append({'actions': []})
+    with pytest.raises(Exception, match='verification failed in block 2'):
+        verify_chain(user.rootdir)
+
+
+def test_statement_needs_both_signatures(users, clock):
+    user = users[0]
+    new_fpr = add_key(user, new_key)
+    v = verify_chain(user.rootdir)
+    action = create_rotate_key_action(user.gpg_ctx(), v, new_fpr)
+    # Replace the new key's signature with the old key's.
+    content = load_fileref([user.rootdir], action['old_sig'])
+    path = pathlib.PurePath(action['new_sig']['filename'])
+    user.rootdir.joinpath(path).write_bytes(content)
+    action['new_sig'] = create_fileref_from_content(0, path, content)
+    with pytest.raises(Exception, match='bad signature: new_sig'):
+        v.append_block(user.gpg_ctx(), {'actions': [action]})
+
+
+def test_rotation_must_end_batch(users, clock):
+    user = users[0]
+    new_fpr = add_key(user, new_key)
+    v = verify_chain(user.rootdir)
+    action = create_rotate_key_action(user.gpg_ctx(), v, new_fpr)
+    with pytest.raises(Exception, match='must be in the last block'):
+        v.append_blocks(user.gpg_ctx(), [
+                        {'actions': [action]}, {'actions': []}])
+    # Nothing was applied, so the Verifier can still be used.
+    assert v.nextidx == 1 and v.rotations(v.fpr) == []
+    v.append_block(user.gpg_ctx(), {'actions': [action]})
+    assert v.signer_fpr == new_fpr
+
+
+def test_failed_batch_is_stale(users, clock):
+    user = users[0]
+    v = verify_chain(user.rootdir)
+    with pytest.raises(Exception):
+        v.append_blocks(user.gpg_ctx(), [{'actions': []}, {'actions': [{'type': 'bogus'}]}])
+    assert most_recent_block_idx(user.rootdir) == 0
+    with pytest.raises(Exception, match='verify the chain again'):
+        v.append_block(user.gpg_ctx(), {'actions': []})
+    verify_chain(user.rootdir).append_block(user.gpg_ctx(), {'actions': []})
+
+
+def test_counterparty_rotates(users, clock):
+    this_user, that_user = users[0:2]
+    that_fpr = load_block(that_user.rootdir, 0)['owner']['gpg']
+    rotate_key(that_user.gpg_ctx(), that_user.rootdir,
+               add_key(that_user, new_key))
+    protoblocks = create_transaction(
+        [this_user.participant(), that_user.participant()], timedelta(days=1))
+    this_user.append(protoblocks[0])
+    append(that_user, protoblocks[1])
+    transaction_hash = protoblocks[0]['actions'][-1]['transaction']['SHA-512']
+    confirm_transactions(this_user.gpg_ctx(), this_user.rootdir,
+                         that_user.rootdir, confirm_only=False)
+    v = verify_chain(this_user.rootdir)
+    assert len(v.rotations(that_fpr)) == 1
+    assert v.transactions[transaction_hash].is_confirmed()
+    # The rotation is only imported once.
+    protoblocks = create_transaction(
+        [this_user.participant(), that_user.participant()], timedelta(days=1))
+    this_user.append(protoblocks[0])
+    append(that_user, protoblocks[1])
+    confirm_transactions(this_user.gpg_ctx(), this_user.rootdir,
+                         that_user.rootdir, confirm_only=False)
+    assert len(verify_chain(this_user.rootdir).rotations(that_fpr)) == 1
+
+
+def test_ban_rotated_forker(users, clock, tmp_path):
+    this_user, that_user = users[0:2]
+    that_fpr = load_block(that_user.rootdir, 0)['owner']['gpg']
+    rotate_key(that_user.gpg_ctx(), that_user.rootdir,
+               add_key(that_user, new_key))
+    forkdir = tmp_path.joinpath('fork')
+    shutil.copytree(that_user.rootdir, forkdir,
+                    ignore=shutil.ignore_patterns('S.*'))
+    # Both versions of block 2 are signed by the new key.
+    append(that_user, {'actions': []})
+    verify_chain(forkdir).append_block(that_user.gpg_ctx(), {'actions': []})
+    create_ban(this_user.gpg_ctx(), this_user.rootdir,
+               that_user.rootdir, forkdir)
+    v = verify_chain(this_user.rootdir)
+    assert v.is_banned(that_fpr)
+    assert len(v.rotations(that_fpr)) == 1
+
+
+def test_state_digest(users, clock):
+    user = users[0]
+    rotate_key(user.gpg_ctx(), user.rootdir, add_key(user, new_key))
+    append(user, {'actions': []})
+    digest = write_state_digest(user.gpg_ctx(), user.rootdir)
+    assert len(digest['key_rotations']) == 1
+    assert read_state_digest(user.rootdir) == digest
+    audit_state_digest(user.rootdir, digest)
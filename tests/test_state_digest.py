@@ -0,0 +1,86 @@
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcore.
+#
+# pyomcore is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcore is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcore. If not, see <https://www.gnu.org/licenses/>.
+
+# Signed state digests.
+#
+# usage: python -m pytest tests/
+
+from datetime import timedelta
+import pytest
+from pyomcore.utils import *
+from pyomcore.confirm_transactions import confirm_transactions
+from pyomcore.state_digest import (write_state_digest, read_state_digest,
+                                   audit_state_digest, state_digest_content)
+
+
+def trade(users):
+    """A confirmed transaction between users. Returns its hash."""
+    protoblocks = create_transaction(
+        list(map(lambda user: user.participant(), users)), timedelta(days=1))
+    for user, protoblock in zip(users, protoblocks):
+        user.append(protoblock)
+    for this_user in users:
+        for that_user in users:
+            confirm_transactions(this_user.gpg_ctx(), this_user.rootdir,
+                                 that_user.rootdir, confirm_only=False)
+    return protoblocks[0]['actions'][-1]['transaction']['SHA-512']
+
+
+def test_write_and_read(users, clock):
+    transaction_hash = trade(users[0:2])
+    user = users[0]
+    digest = write_state_digest(user.gpg_ctx(), user.rootdir)
+    assert digest['head']['idx'] == most_recent_block_idx(user.rootdir)
+    assert digest['transactions'][transaction_hash]['state'] == 'CONFIRMED'
+    assert read_state_digest(user.rootdir) == digest
+    audit_state_digest(user.rootdir, digest)
+    # Deterministic: writing it again gives the same file.
+    content = user.rootdir.joinpath(state_digest_filename).read_bytes()
+    write_state_digest(user.gpg_ctx(), user.rootdir)
+    assert user.rootdir.joinpath(state_digest_filename).read_bytes() == content
+    assert content == state_digest_content(digest)
+
+
+def test_stale(users, clock):
+    user = users[0]
+    digest = write_state_digest(user.gpg_ctx(), user.rootdir)
+    user.append({'actions': []})
+    with pytest.raises(Exception, match='out of date'):
+        read_state_digest(user.rootdir)
+    assert read_state_digest(user.rootdir, allow_stale=True) == digest
+
+
+def test_tampered(users, clock):
+    user = users[0]
+    write_state_digest(user.gpg_ctx(), user.rootdir)
+    path = user.rootdir.joinpath(state_digest_filename)
+    path.write_bytes(path.read_bytes().replace(b'"banned": []', b'"banned": ["X"]'))
+    with pytest.raises(Exception):
+        read_state_digest(user.rootdir)
+
+
+def test_false_digest_fails_audit(users, clock):
+    user = users[0]
+    digest = write_state_digest(user.gpg_ctx(), user.rootdir)
+    # The owner signs a digest that doesn't match their blockchain.
+    digest['banned'] = ['X']
+    content = state_digest_content(digest)
+    user.rootdir.joinpath(state_digest_filename).write_bytes(content)
+    user.rootdir.joinpath(state_digest_sig_filename).write_bytes(
+        sign_blockref(user.gpg_ctx(), digest['gpg'], content))
+    assert read_state_digest(user.rootdir) == digest
+    with pytest.raises(Exception, match='doesn\'t match the blockchain'):
+        audit_state_digest(user.rootdir, digest)
@@ -0,0 +1,44 @@
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcore.
+#
+# pyomcore is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcore is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcore. If not, see <https://www.gnu.org/licenses/>.
+
+# The state history matches a replay up to each block.
+#
+# usage: python -m pytest tests/
+
+import pytest
+from pyomcore.utils import *
+from pyomcore.verifier import Verifier, verify_chain
+from pyomcore.state_history import StateHistory
+from test_state_store import chains, state_json
+
+
+@pytest.mark.parametrize('snapshot_interval', [1, 2, 1000])
+def test_state_at(users, chains, snapshot_interval, tmp_path):
+    rootdir = users[0].rootdir
+    history = StateHistory(snapshot_interval, tmp_path.joinpath('history.db').as_posix())
+    verify_chain(rootdir, history=history)
+    assert history.numsnapshots == history.numblocks() // snapshot_interval
+    replay = Verifier(rootdir, init_local_gpg(rootdir.joinpath(gnupg_dirname)))
+    for idx in range(0, history.numblocks()):
+        replay.verify_blocks(idx, idx + 1)
+        expected = state_json(replay)
+        assert state_json(history.state_at(idx)) == expected
+        for transaction_hash, transaction_status in expected['transactions'].items():
+            assert history.transaction_at(transaction_hash, idx).to_json() == transaction_status
+        for transaction_hash in chains.values():
+            if not transaction_hash in expected['transactions']:
+                assert history.transaction_at(transaction_hash, idx) is None
+    history.close()
@@ -0,0 +1,183 @@
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcore.
+#
+# pyomcore is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcore is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcore. If not, see <https://www.gnu.org/licenses/>.
+
+# The sqlite state store gives the same results as the in-memory state.
+#
+# usage: python -m pytest tests/
+
+from datetime import timedelta
+import sqlite3
+import pytest
+from pyomcore.utils import *
+from pyomcore.verifier import verify_chain, TransactionStatus, TransactionState, TransactionDict
+from pyomcore.state_store import StateStore, TransactionTable
+from pyomcore.state_history import state_tables
+from pyomcore.annul_transaction import annul_transaction
+from pyomcore.reinstate_transaction import reinstate_transaction
+from test_state_digest import trade
+
+# The default hot_size, everything paged out, and almost everything.
+hot_sizes = [10000, 0, 1]
+
+
+@pytest.fixture
+def chains(users, clock):
+    """Transactions in every state but CANCELLED. Returns the hashes, by
+    state.
+    """
+    this_user, that_user = users[0:2]
+    hashes = {'CONFIRMED': trade(users[0:2]), 'ANNULLED': trade(users[0:2])}
+    annul_transaction(this_user.gpg_ctx(), this_user.rootdir,
+                      hashes['ANNULLED'], 'test')
+    reinstated = trade(users[0:2])
+    annul_transaction(this_user.gpg_ctx(), this_user.rootdir, reinstated, 'test')
+    reinstate_transaction(this_user.gpg_ctx(), this_user.rootdir, reinstated)
+    protoblocks = create_transaction(
+        [this_user.participant(), that_user.participant()], timedelta(days=1))
+    this_user.append(protoblocks[0])
+    hashes['PENDING'] = protoblocks[0]['actions'][-1]['transaction']['SHA-512']
+    return hashes
+
+
+def state_json(v):
+    state = {}
+    for name in state_tables:
+        state[name] = dict(getattr(v, name).items())
+    state['transactions'] = dict(map(lambda item: (item[0], item[1].to_json()),
+                                     state['transactions'].items()))
+    return state
+
+
+@pytest.mark.parametrize('hot_size', hot_sizes)
+def test_same_state(users, chains, hot_size):
+    for user in users[0:2]:
+        expected = state_json(verify_chain(user.rootdir))
+        store = StateStore(hot_size=hot_size)
+        v = verify_chain(user.rootdir, store)
+        assert state_json(v) == expected
+        assert len(store.transactions.final) <= hot_size
+        store.close()
+    v = verify_chain(users[0].rootdir, StateStore(hot_size=hot_size))
+    for state, transaction_hash in chains.items():
+        assert v.transactions[transaction_hash].state.name == state
+
+
+@pytest.mark.parametrize('action_type, state, error', [
+    ('confirm_transaction', 'CONFIRMED', 'confirm_transaction: transaction is not PENDING'),
+    ('annul_transaction', 'ANNULLED', 'annul_transaction: transaction is not CONFIRMED'),
+    ('reinstate_transaction', 'CONFIRMED', 'reinstate_transaction: transaction is not ANNULLED'),
+])
+def test_bad_transition(users, chains, action_type, state, error, capsys):
+    user = users[0]
+    user.append({'actions': [{'type': action_type, 'explanation': 'test',
+                              'transaction': {'SHA-512': chains[state]}}]})
+    for state_store in [None] + list(map(lambda hot_size: StateStore(hot_size=hot_size), hot_sizes)):
+        capsys.readouterr()
+        with pytest.raises(Exception, match='verification failed'):
+            verify_chain(user.rootdir, state_store)
+        assert error in capsys.readouterr().err
+
+
+@pytest.mark.parametrize('alias', [str.upper, lambda h: ' ' + h, lambda h: h + '\n'])
+def test_non_canonical_hash(users, chains, alias):
+    """Only the exact hash names a transaction, whatever the backend."""
+    user = users[0]
+    transaction_hash = chains['CONFIRMED']
+    transaction_status = verify_chain(user.rootdir).transactions[transaction_hash]
+    with pytest.raises(Exception, match='hash mismatch'):
+        TransactionDict()[alias(transaction_hash)] = transaction_status
+    for transactions in [verify_chain(user.rootdir).transactions,
+                         verify_chain(user.rootdir, StateStore(hot_size=0)).transactions]:
+        assert transaction_hash in transactions
+        assert not alias(transaction_hash) in transactions
+        with pytest.raises(KeyError):
+            transactions[alias(transaction_hash)]
+    user.append({'actions': [{'type': 'annul_transaction', 'explanation': 'test',
+                              'transaction': {'SHA-512': alias(transaction_hash)}}]})
+    for state_store in [None, StateStore()]:
+        with pytest.raises(Exception, match='verification failed'):
+            verify_chain(user.rootdir, state_store)
+
+
+def test_from_json(users, chains):
+    for transaction_hash, transaction_status in verify_chain(users[0].rootdir).transactions.items():
+        obj = transaction_status.to_json()
+        copy = TransactionStatus.from_json(json.loads(json.dumps(obj)))
+        assert copy.to_json() == obj
+        assert copy.digest.hex() == transaction_hash
+        assert copy.state == transaction_status.state
+        assert copy.signatures == transaction_status.signatures
+
+
+def fake_status(i, state):
+    transaction_status = TransactionStatus([pathlib.Path('/nonexistent')], {
+        'pyom_fileref_magic': pyom_fileref_magic,
+        'locidx': 0,
+        'filename': 'transaction.json',
+        'SHA-512': sha512_hex(str(i).encode('utf-8'))
+    }, [], i)
+    transaction_status.state = state
+    return transaction_status
+
+
+def test_lru_eviction():
+    table = TransactionTable(sqlite3.connect(''), hot_size=2)
+    statuses = list(map(lambda i: fake_status(i, TransactionState.CONFIRMED), range(0, 4)))
+    hashes = list(map(lambda s: s.digest.hex(), statuses))
+    for transaction_hash, transaction_status in zip(hashes[0:2], statuses[0:2]):
+        table[transaction_hash] = transaction_status
+    # Using 0 makes 1 the least recently used.
+    assert table[hashes[0]] is statuses[0]
+    table[hashes[2]] = statuses[2]
+    assert list(table.final.keys()) == [hashes[0], hashes[2]]
+    # 1 is loaded from the database, and evicts 0.
+    assert table[hashes[1]] is not statuses[1]
+    assert table[hashes[1]].to_json() == statuses[1].to_json()
+    assert list(table.final.keys()) == [hashes[2], hashes[1]]
+    # Pending transactions always stay in memory.
+    pending = fake_status(3, TransactionState.PENDING)
+    table[hashes[3]] = pending
+    assert table.active == {hashes[3]: pending}
+    assert len(table.final) == 2
+    # Finalizing it moves it to the cache.
+    pending.state = TransactionState.CONFIRMED
+    table[hashes[3]] = pending
+    assert table.active == {}
+    assert list(table.final.keys()) == [hashes[1], hashes[3]]
+    assert len(table) == 4
+    assert list(table) == hashes
+    del table[hashes[3]]
+    assert not hashes[3] in table
+    with pytest.raises(KeyError):
+        table[hashes[3]]
+
+
+def test_items_streams():
+    table = TransactionTable(sqlite3.connect(''), hot_size=1)
+    statuses = list(map(lambda i: fake_status(i, TransactionState.CONFIRMED), range(0, 2500)))
+    for transaction_status in statuses:
+        table[transaction_status.digest.hex()] = transaction_status
+    cached = dict(table.final)
+    seen = 0
+    for transaction_hash, transaction_status in table.items():
+        assert transaction_hash == statuses[seen].digest.hex()
+        assert transaction_status.to_json() == statuses[seen].to_json()
+        seen += 1
+    assert seen == len(statuses)
+    # The cached transaction is used as it is.
+    assert dict(table.items())[statuses[-1].digest.hex()] is statuses[-1]
+    # Iterating doesn't fill up the cache.
+    assert dict(table.final) == cached
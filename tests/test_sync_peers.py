@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcore.
+#
+# pyomcore is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcore is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcore. If not, see <https://www.gnu.org/licenses/>.
+
+# Test sync_peers against local bare repos, over file:// urls. The blocks
+# are empty placeholder files: sync_peers only looks at the filenames.
+#
+# usage: test_sync_peers.py path/to/tmpdir
+
+import shutil
+import sys
+from pyomcore.utils import *
+from pyomcore.sync_peers import sync_peers
+
+tmpdir = pathlib.Path(sys.argv[1])
+shutil.rmtree(tmpdir, ignore_errors=True)
+tmpdir.mkdir(parents=True)
+tmpdir = tmpdir.resolve()
+
+
+def git(*args):
+    result = subprocess.run(['git', '-c', 'user.name=pyom', '-c', 'user.email=pyom@example.com'] +
+                            list(args), capture_output=True)
+    result.check_returncode()
+
+
+def add_blocks(workdir, numblocks):
+    start = 0
+    if workdir.joinpath(blockchain_dirname).exists():
+        start = 1 + most_recent_block_idx(workdir)
+    for idx in range(start, start + numblocks):
+        for ext in [block_ext_json, block_ext_ref, block_ext_sig]:
+            path = workdir.joinpath(blockfilename(idx, ext))
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(b'{}')
+    git('-C', workdir.as_posix(), 'add', '.')
+    git('-C', workdir.as_posix(), 'commit', '--quiet', '-m', 'blocks')
+    git('-C', workdir.as_posix(), 'push', '--quiet', 'origin', 'HEAD')
+
+
+# Create some peers, each with a bare repo and a working clone.
+numpeers = 20
+known_gpg_keys = {}
+workdirs = {}
+for i in range(0, numpeers):
+    fpr = f'{i:040X}'
+    bare = tmpdir.joinpath('remotes').joinpath(fpr + '.git')
+    git('init', '--quiet', '--bare', bare.as_posix())
+    workdir = tmpdir.joinpath('work').joinpath(fpr)
+    git('clone', '--quiet', bare.as_uri(), workdir.as_posix())
+    add_blocks(workdir, 1 + i % 3)
+    known_gpg_keys[fpr] = {'origin': bare.as_uri()}
+    workdirs[fpr] = workdir
+# A peer whose only remote doesn't exist.
+missing_fpr = 'F' * 40
+known_gpg_keys[missing_fpr] = {
+    'origin': tmpdir.joinpath('remotes').joinpath('missing.git').as_uri()}
+# A peer whose remote is a git option.
+option_fpr = 'E' * 40
+pwned = tmpdir.joinpath('pwned')
+known_gpg_keys[option_fpr] = {
+    'origin': '--upload-pack=touch ' + pwned.as_posix()}
+
+mirrordir = tmpdir.joinpath('mirrors')
+report = sync_peers(mirrordir, known_gpg_keys, max_concurrency=4)
+for fpr, workdir in workdirs.items():
+    r = report[fpr]
+    if r['error'] is not None or not r['new_blocks'] or r['new_head'] != most_recent_block_idx(workdir):
+        raise Exception('first sync: bad report for ' + fpr + ': ' + str(r))
+if report[missing_fpr]['error'] is None:
+    raise Exception('expected an error for the missing remote')
+if report[option_fpr]['error'] is None or pwned.exists():
+    raise Exception('a remote url was used as a git option')
+print('first sync')
+
+# Nothing has changed.
+report = sync_peers(mirrordir, known_gpg_keys, max_concurrency=4)
+if any(map(lambda r: r['new_blocks'], report.values())):
+    raise Exception('second sync: unexpected new blocks')
+print('second sync')
+
+# Only the peers that add blocks are reported.
+changed = sorted(workdirs.keys())[::3]
+for fpr in changed:
+    add_blocks(workdirs[fpr], 2)
+report = sync_peers(mirrordir, known_gpg_keys, max_concurrency=4)
+new = sorted(filter(lambda fpr: report[fpr]['new_blocks'], report.keys()))
+if new != changed:
+    raise Exception('third sync: expected new blocks in ' + str(changed) + ', got ' + str(new))
+for fpr in changed:
+    if report[fpr]['new_head'] != report[fpr]['old_head'] + 2:
+        raise Exception('third sync: bad report for ' + fpr + ': ' + str(report[fpr]))
+print('third sync')
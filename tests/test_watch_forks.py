@@ -0,0 +1,153 @@
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcore.
+#
+# pyomcore is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcore is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcore. If not, see <https://www.gnu.org/licenses/>.
+
+
+# Watching mirrors for forks.
+#
+# usage: python -m pytest tests/
+
+from datetime import timedelta
+import shutil
+import pytest
+from pyomcore.utils import *
+from pyomcore.verifier import verify_chain
+from pyomcore.rotate_key import rotate_key, create_rotate_key_action
+from pyomcore.watch_forks import watch_forks, ban_forks, fork_watch_dirname
+from test_rotate_key import add_key, append, new_key
+
+
+def fpr_of(user):
+    return load_block(user.rootdir, 0)['owner']['gpg']
+
+
+def mirror(mirrordir, rootdir):
+    """Copy rootdir into mirrordir, like sync_peers would."""
+    fpr = load_block(rootdir, 0)['owner']['gpg']
+    path = mirrordir.joinpath(fpr)
+    shutil.rmtree(path, ignore_errors=True)
+    shutil.copytree(rootdir, path, ignore=shutil.ignore_patterns('S.*'))
+    return path
+
+
+@pytest.fixture
+def mirrordir(tmp_path):
+    return tmp_path.joinpath('mirrors')
+
+
+def test_no_fork(users, clock, mirrordir):
+    user = users[1]
+    user.append({'actions': []})
+    mirror(mirrordir, user.rootdir)
+    assert watch_forks(mirrordir, [fpr_of(user)]) == []
+    user.append({'actions': []})
+    mirror(mirrordir, user.rootdir)
+    assert watch_forks(mirrordir, [fpr_of(user)]) == []
+
+
+def test_fork(users, clock, mirrordir, tmp_path):
+    user = users[1]
+    forkdir = tmp_path.joinpath('fork')
+    shutil.copytree(user.rootdir, forkdir, ignore=shutil.ignore_patterns('S.*'))
+    user.append({'actions': []})
+    mirror(mirrordir, user.rootdir)
+    assert watch_forks(mirrordir, [fpr_of(user)]) == []
+    # The same key signs a different block 1.
+    clock.advance(timedelta(seconds=1))
+    create_block(user.gpg_ctx(), forkdir, 1, fpr_of(user), {'actions': []})
+    mirror(mirrordir, forkdir)
+    evidence = watch_forks(mirrordir, [fpr_of(user)])
+    assert len(evidence) == 1
+    assert evidence[0]['idx'] == 1
+
+
+def test_bad_signature_is_rejected(users, clock, mirrordir):
+    bad_user, good_user = users[1:3]
+    for user in [bad_user, good_user]:
+        mirror(mirrordir, user.rootdir)
+    fprs = [fpr_of(bad_user), fpr_of(good_user)]
+    assert watch_forks(mirrordir, fprs) == []
+    for user in [bad_user, good_user]:
+        user.append({'actions': []})
+        mirror(mirrordir, user.rootdir)
+    sig_path = mirrordir.joinpath(fprs[0]).joinpath(blockfilename(1, block_ext_sig))
+    # Signed by somebody else.
+    sig_path.write_bytes(sign_blockref(users[3].gpg_ctx(), fpr_of(users[3]),
+                                       read_file(sig_path.with_name(blockfilename(1, block_ext_ref).name))))
+    rejected = {}
+    assert watch_forks(mirrordir, fprs, rejected) == []
+    assert list(rejected.keys()) == [fprs[0]]
+    # The bad blockref wasn't kept, and the good mirror was still checked.
+    watchdir = mirrordir.joinpath(fork_watch_dirname)
+    assert not watchdir.joinpath(fprs[0], blockfilename(1, block_ext_ref)).exists()
+    assert watchdir.joinpath(fprs[1], blockfilename(1, block_ext_ref)).exists()
+    # And it's rejected again next time, without an exception.
+    rejected = {}
+    assert watch_forks(mirrordir, fprs, rejected) == []
+    assert fprs[0] in rejected
+
+
+def test_rotated_key(users, clock, mirrordir, tmp_path):
+    this_user, that_user = users[0:2]
+    fpr = fpr_of(that_user)
+    mirror(mirrordir, that_user.rootdir)
+    assert watch_forks(mirrordir, [fpr]) == []
+    rotate_key(that_user.gpg_ctx(), that_user.rootdir,
+               add_key(that_user, new_key))
+    forkdir = tmp_path.joinpath('fork')
+    shutil.copytree(that_user.rootdir, forkdir,
+                    ignore=shutil.ignore_patterns('S.*'))
+    # Blocks signed by the new key are fine.
+    append(that_user, {'actions': []})
+    mirror(mirrordir, that_user.rootdir)
+    rejected = {}
+    assert watch_forks(mirrordir, [fpr], rejected) == []
+    assert rejected == {}
+    # A fork signed by the new key is found, and can be banned.
+    verify_chain(forkdir).append_block(that_user.gpg_ctx(), {'actions': []})
+    mirror(mirrordir, forkdir)
+    evidence = watch_forks(mirrordir, [fpr])
+    assert len(evidence) == 1
+    assert evidence[0]['idx'] == 2
+    ban_forks(this_user.gpg_ctx(), this_user.rootdir, evidence)
+    assert verify_chain(this_user.rootdir).is_banned(fpr)
+
+
+def test_rotation_evidence_paths(users, clock, mirrordir):
+    """The peer chooses the filenames of the rotation evidence, but the
+    copies only go in the watch directory's key_rotations.
+    """
+    user = users[1]
+    fpr = fpr_of(user)
+    mirror(mirrordir, user.rootdir)
+    assert watch_forks(mirrordir, [fpr]) == []
+    v = verify_chain(user.rootdir)
+    action = create_rotate_key_action(user.gpg_ctx(), v, add_key(user, new_key))
+    for name, filename in [('keyfile', 'state.json'), ('statement', 'rotated.json')]:
+        user.rootdir.joinpath(action[name]['filename']).rename(user.rootdir.joinpath(filename))
+        action[name]['filename'] = filename
+    v.append_block(user.gpg_ctx(), {'actions': [action]})
+    mirror(mirrordir, user.rootdir)
+    rejected = {}
+    assert watch_forks(mirrordir, [fpr], rejected) == []
+    assert rejected == {}
+    watchdir = mirrordir.joinpath(fork_watch_dirname, fpr)
+    for path in iter_dir_recursive(watchdir):
+        relpath = path.relative_to(watchdir)
+        assert relpath.parts[0] in ['blockchain', 'key_rotations', 'state.json']
+    state = json.loads(watchdir.joinpath('state.json').read_bytes())
+    assert state['numblocks'] == 2
+    assert list(map(lambda r: r['statement']['filename'], state['key_rotations'])) == [
+        'key_rotations/1/statement']